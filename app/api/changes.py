@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Optional
+import hashlib
+import uuid
+from ..database import get_async_read_session
+from .. import crud, schemas
+from ..logic.changes import current_change_seq, funds_change_version
+
+router = APIRouter(tags=["changes"])
+
+# Conditional GETs. A fund's change sequence moves on every write to it
+# (logic/changes.py), so the sequence, the URL and the Accept header (which
+# picks the format) identify a response body: a strong ETag. The sequence is
+# read before the body, so a tag never claims a newer state than the body
+# holds; a write landing in between shows up under the next tag.
+
+def etag_for(request: Request, version: str) -> str:
+    representation = f"{request.url.path}?{request.url.query}|{request.headers.get('accept', '')}"
+    digest = hashlib.blake2b(representation.encode(), digest_size=8).hexdigest()
+    return f'"{version}-{digest}"'
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match compares weakly: a W/ prefix doesn't matter
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def conditional(request: Request, response: Response, version: str) -> Optional[Response]:
+    # Sets the ETag on `response`, or returns the 304 to send instead (with
+    # the headers already set on `response`)
+    headers = {"ETag": etag_for(request, version), "Vary": "Accept"}
+    if _matches(request, headers["ETag"]):
+        return Response(status_code=304, headers={**response.headers, **headers})
+    response.headers.update(headers)
+    return None
+
+def seq_conditional(request: Request, response: Response, seq: Optional[int], *parts: str) -> Optional[Response]:
+    # conditional() keyed on a fund's sequence, plus `parts` for bodies that
+    # also depend on something else (e.g. today's date); no ETag for an
+    # unknown fund (seq None), which the endpoint reports as before
+    if seq is None:
+        return None
+    return conditional(request, response, ".".join([str(seq), *parts]))
+
+async def fund_conditional(request: Request, response: Response, session: AsyncSession, fund_id: uuid.UUID) -> Optional[Response]:
+    return seq_conditional(request, response, await session.run_sync(current_change_seq, fund_id))
+
+async def funds_conditional(request: Request, response: Response, session: AsyncSession) -> Optional[Response]:
+    return conditional(request, response, await session.run_sync(funds_change_version))
+
+@router.get("/api/funds/{fund_id}/changes", response_model=schemas.FundChanges)
+async def read_changes(
+    fund_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    since: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_async_read_session),
+):
+    # Companies, transactions and waterfall allocations written after `since`
+    # (0: everything), for clients that keep a local copy of the fund
+    seq = await session.run_sync(current_change_seq, fund_id)
+    if seq is None:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    not_modified = conditional(request, response, str(seq))
+    if not_modified:
+        return not_modified
+    return await session.run_sync(crud.get_changes, fund_id, since, seq)
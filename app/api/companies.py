@@ -1,27 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional
 import uuid
-from ..database import get_session
+from ..database import get_async_read_session, get_async_session
 from .. import crud, schemas
+from .changes import fund_conditional
+from .formats import COLUMNAR_FORMATS, columnar_response, response_format
 
 router = APIRouter(tags=["companies"])
 
 @router.get("/api/funds/{fund_id}/companies", response_model=List[schemas.PortfolioCompanyRead])
-def read_companies(fund_id: uuid.UUID, session: Session = Depends(get_session)):
-    return crud.get_companies(session, fund_id)
+async def read_companies(
+    fund_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    format: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_session),
+):
+    output = response_format(request, format)
+    not_modified = await fund_conditional(request, response, session, fund_id)
+    if not_modified:
+        return not_modified
+    if output in COLUMNAR_FORMATS:
+        rows = await session.run_sync(crud.get_company_rows, fund_id)
+        return columnar_response(list(schemas.PortfolioCompanyRead.model_fields), rows, output, response)
+    if output == "ndjson" and format is not None:
+        raise HTTPException(status_code=400, detail="NDJSON is not available for companies")
+    return await session.run_sync(crud.get_companies, fund_id)
 
 @router.post("/api/funds/{fund_id}/companies", response_model=schemas.PortfolioCompanyRead)
-def create_company(fund_id: uuid.UUID, company: schemas.PortfolioCompanyCreate, session: Session = Depends(get_session)):
+async def create_company(fund_id: uuid.UUID, company: schemas.PortfolioCompanyCreate, session: AsyncSession = Depends(get_async_session)):
     if company.fund_id is None:
         company.fund_id = fund_id
     elif company.fund_id != fund_id:
         raise HTTPException(status_code=400, detail="Fund ID mismatch")
-    return crud.create_company(session, company)
+    return await session.run_sync(crud.create_company, company)
+
+@router.get("/api/companies/{company_id}/marks", response_model=List[schemas.ValuationMarkRead])
+async def read_company_marks(company_id: uuid.UUID, session: AsyncSession = Depends(get_async_read_session)):
+    # Recorded valuation history, oldest first
+    company = await session.get(crud.PortfolioCompany, company_id)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return await session.run_sync(crud.get_marks, company_id)
+
+@router.post("/api/companies/{company_id}/marks", response_model=schemas.ValuationMarkRead)
+async def create_company_mark(
+    company_id: uuid.UUID, mark: schemas.ValuationMarkCreate, session: AsyncSession = Depends(get_async_session)
+):
+    db_mark = await session.run_sync(crud.create_valuation_mark, company_id, mark)
+    if db_mark is None:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return db_mark
 
 @router.get("/api/companies/{company_id}", response_model=schemas.PortfolioCompanyRead)
-def read_company(company_id: uuid.UUID, session: Session = Depends(get_session)):
-    company = session.get(crud.PortfolioCompany, company_id)
+async def read_company(company_id: uuid.UUID, session: AsyncSession = Depends(get_async_read_session)):
+    company = await session.get(crud.PortfolioCompany, company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     return company
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Iterator
+import uuid
+from ..database import get_async_read_session, sync_bind
+from .. import crud
+from ..logic.export import DATASETS, MEDIA_TYPES, export_chunks, export_filename
+
+router = APIRouter(tags=["exports"])
+
+def _export_stream(bind, fund_id: uuid.UUID, dataset: str, fmt: str) -> Iterator[bytes]:
+    # Runs after the request's own session is gone (see ndjson_lines), so it
+    # holds its own for as long as the cursor is being drained
+    with Session(bind) as session:
+        yield from export_chunks(session, fund_id, dataset, fmt)
+
+@router.get("/api/funds/{fund_id}/export/{dataset}.{fmt}")
+async def export_fund_dataset(fund_id: uuid.UUID, dataset: str, fmt: str, session: AsyncSession = Depends(get_async_read_session)):
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset, expected one of: {', '.join(DATASETS)}")
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail=f"Unknown format, expected one of: {', '.join(MEDIA_TYPES)}")
+    fund = await session.run_sync(crud.get_fund, fund_id)
+    if not fund:
+        raise HTTPException(status_code=404, detail="Fund not found")
+
+    filename = export_filename(fund.fund_code, fund_id, dataset, fmt)
+    return StreamingResponse(
+        _export_stream(sync_bind(session), fund_id, dataset, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
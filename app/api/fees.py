@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import date
+from typing import Optional
+import anyio
+import uuid
+from ..database import get_async_session
+from .. import crud, schemas
+from ..logic.fees import compute_fee_schedule, load_fee_inputs, post_fee_schedule
+
+router = APIRouter(tags=["fees"])
+
+@router.post("/api/funds/{fund_id}/management-fees", response_model=schemas.FeeScheduleResult)
+async def generate_fund_management_fees(
+    fund_id: uuid.UUID,
+    through: Optional[date] = None,
+    dry_run: bool = False,
+    session: AsyncSession = Depends(get_async_session),
+):
+    # Posts the fund's quarterly management fees due by `through` (default
+    # today) that are not posted yet; dry_run only returns the schedule.
+    # Every fund at once: python generate_fees.py
+    fund = await session.run_sync(crud.get_fund, fund_id)
+    if not fund:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    through = through or date.today()
+    inputs = await session.run_sync(load_fee_inputs, [fund_id])
+    try:
+        schedule = await anyio.to_thread.run_sync(compute_fee_schedule, inputs, through)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    inserted, skipped = (0, 0) if dry_run else await session.run_sync(post_fee_schedule, schedule)
+    return {
+        "fund_id": fund_id,
+        "through": through,
+        "dry_run": dry_run,
+        "inserted": inserted,
+        "skipped": skipped,
+        "periods": schedule.drop(columns="fund_id").to_dict("records"),
+    }
@@ -0,0 +1,86 @@
+from enum import Enum
+from fastapi import HTTPException, Request, Response
+from typing import List, Optional, Sequence
+import io
+import orjson
+import uuid
+from .pagination import NDJSON_MEDIA_TYPE
+
+# Response formats for the large list endpoints, chosen with ?format= or the
+# Accept header. The columnar ones are built from plain query rows, with no
+# ORM objects or per-row validation:
+#   columns  {"rows": n, "columns": {"field": [v1, v2, ...], ...}}
+#   arrow    Arrow IPC stream
+#   parquet  Parquet file
+# Anything else gets the default row-per-object JSON.
+
+COLUMNS_MEDIA_TYPE = "application/vnd.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+FORMATS = {
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "columns": COLUMNS_MEDIA_TYPE,
+    "arrow": ARROW_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+}
+COLUMNAR_FORMATS = ("columns", "arrow", "parquet")
+
+def response_format(request: Request, format: Optional[str]) -> Optional[str]:
+    # None means the default JSON
+    if format is not None:
+        if format == "json":
+            return None
+        if format not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown format, expected one of: json, {', '.join(FORMATS)}")
+        return format
+    accept = request.headers.get("accept", "")
+    for name, media_type in FORMATS.items():
+        if media_type in accept:
+            return name
+    return None
+
+def _transpose(names: Sequence[str], rows: Sequence) -> dict:
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return {name: list(values) for name, values in zip(names, columns)}
+
+def _arrow_values(values: list) -> list:
+    # Arrow has no UUID/Enum/free-form JSON types: send them as strings
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, Enum):
+        return [value.value if value is not None else None for value in values]
+    if isinstance(sample, uuid.UUID):
+        return [str(value) if value is not None else None for value in values]
+    if isinstance(sample, (dict, list)):
+        return [orjson.dumps(value).decode() if value is not None else None for value in values]
+    return values
+
+def _arrow_table(columns: dict):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow and Parquet responses need pyarrow installed on the server")
+    return pa.table({name: _arrow_values(values) for name, values in columns.items()})
+
+def columnar_response(names: Sequence[str], rows: List, format: str, response: Optional[Response] = None) -> Response:
+    # `rows` are tuples in `names` order. Headers already set on the
+    # endpoint's injected `response` (e.g. the next cursor) are carried over.
+    columns = _transpose(names, rows)
+    if format == "columns":
+        body = orjson.dumps({"rows": len(rows), "columns": columns})
+    else:
+        table = _arrow_table(columns)
+        sink = io.BytesIO()
+        if format == "arrow":
+            import pyarrow as pa
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(table, sink)
+        body = sink.getvalue()
+
+    result = Response(content=body, media_type=FORMATS[format])
+    if response is not None:
+        result.headers.raw.extend(response.headers.raw)
+    return result
@@ -1,23 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
 import uuid
-from ..database import get_session
+from ..database import get_async_read_session, get_async_session
 from .. import crud, schemas
+from .changes import fund_conditional, funds_conditional
 
 router = APIRouter(prefix="/api/funds", tags=["funds"])
 
 @router.post("/", response_model=schemas.FundRead)
-def create_fund(fund: schemas.FundCreate, session: Session = Depends(get_session)):
-    return crud.create_fund(session, fund)
+async def create_fund(fund: schemas.FundCreate, session: AsyncSession = Depends(get_async_session)):
+    return await session.run_sync(crud.create_fund, fund)
 
 @router.get("/", response_model=List[schemas.FundRead])
-def read_funds(session: Session = Depends(get_session)):
-    return crud.get_funds(session)
+async def read_funds(request: Request, response: Response, session: AsyncSession = Depends(get_async_read_session)):
+    not_modified = await funds_conditional(request, response, session)
+    if not_modified:
+        return not_modified
+    return await session.run_sync(crud.get_funds)
 
 @router.get("/{fund_id}", response_model=schemas.FundRead)
-def read_fund(fund_id: uuid.UUID, session: Session = Depends(get_session)):
-    fund = crud.get_fund(session, fund_id)
+async def read_fund(
+    fund_id: uuid.UUID, request: Request, response: Response, session: AsyncSession = Depends(get_async_read_session)
+):
+    not_modified = await fund_conditional(request, response, session, fund_id)
+    if not_modified:
+        return not_modified
+    fund = await session.run_sync(crud.get_fund, fund_id)
     if not fund:
         raise HTTPException(status_code=404, detail="Fund not found")
     return fund
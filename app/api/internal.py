@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import List
+from ..auth import token_verifier
+from ..database import replica_pool
+from ..instrumentation import render_metrics, slow_requests
+from ..logic.jobs import job_queue
+
+router = APIRouter(tags=["internal"], include_in_schema=False)
+
+# Prometheus text exposition format
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("/internal/metrics", response_class=PlainTextResponse)
+def read_internal_metrics():
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+@router.get("/internal/metrics/slow", response_model=List[dict])
+def read_slow_requests():
+    # Newest last; empty unless SLOW_REQUEST_MS is set
+    return slow_requests()
+
+@router.get("/internal/jobs", response_model=dict)
+def read_job_stats():
+    # Queued/running jobs and writes folded into already-queued ones, this worker only
+    return job_queue.backend.stats()
+
+@router.get("/internal/auth", response_model=dict)
+def read_auth_stats():
+    # Verified-token cache hits, signature checks, rejections and JWKS refreshes
+    return token_verifier.stats()
+
+@router.get("/internal/db", response_model=List[dict])
+def read_database_stats():
+    # Primary then replicas: sessions opened by this worker, lag, health and pool usage
+    return replica_pool.stats()
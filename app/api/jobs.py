@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Dict
+import uuid
+from ..database import get_async_read_session
+from .. import crud, schemas
+from ..logic.jobs import job_queue
+
+router = APIRouter(tags=["jobs"])
+
+# Waterfall results are fresh when X-Computed-Version has caught up with
+# X-Fund-Version; writes return the X-Fund-Version to wait for
+FUND_VERSION_HEADER = "X-Fund-Version"
+COMPUTED_VERSION_HEADER = "X-Computed-Version"
+
+def version_headers(fund_id: uuid.UUID) -> Dict[str, str]:
+    status = job_queue.fund_status(fund_id)
+    return {
+        FUND_VERSION_HEADER: str(status["requested_version"]),
+        COMPUTED_VERSION_HEADER: str(status["computed_version"]),
+    }
+
+@router.get("/api/jobs/{job_id}", response_model=schemas.RecomputeJob)
+def read_job(job_id: uuid.UUID):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/api/funds/{fund_id}/jobs", response_model=schemas.FundJobStatus)
+async def read_fund_jobs(fund_id: uuid.UUID, session: AsyncSession = Depends(get_async_read_session)):
+    fund = await session.run_sync(crud.get_fund, fund_id)
+    if not fund:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    return job_queue.fund_status(fund_id)
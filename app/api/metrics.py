@@ -1,20 +1,190 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Dict, List, Optional
+from datetime import date
+import anyio
 import uuid
-from ..database import get_session
+from ..database import get_async_read_session, sync_bind
 from .. import crud, schemas
-from ..logic.metrics import calculate_fund_metrics
+from ..logic.cache import metrics_cache
+from .changes import seq_conditional
+from ..logic.changes import current_change_seq
+from .jobs import version_headers
+from .formats import COLUMNAR_FORMATS, columnar_response, response_format
+from .pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NDJSON_MEDIA_TYPE,
+    decode_cursor,
+    ndjson_lines,
+    paginate,
+)
+from ..logic.company_metrics import compute_company_metrics, load_company_metrics_inputs
+from ..logic.metrics import (
+    compute_fund_metrics,
+    compute_portfolio_metrics,
+    load_fund_metrics_inputs,
+    load_portfolio_frames,
+)
+from ..logic.simulation import load_simulation_inputs, run_simulation
+from ..logic.timeseries import compute_metrics_timeseries, load_timeseries_inputs
 
-router = APIRouter(prefix="/api/funds", tags=["metrics"])
+router = APIRouter(tags=["metrics"])
 
-@router.get("/{fund_id}/metrics", response_model=schemas.FundMetrics)
-def read_fund_metrics(fund_id: uuid.UUID, session: Session = Depends(get_session)):
-    metrics = calculate_fund_metrics(session, fund_id)
+# Queries run on the async session; the pandas/XIRR phase runs in a worker
+# thread so it does not hold up the event loop
+
+@router.get("/api/metrics", response_model=Dict[uuid.UUID, schemas.FundMetrics])
+async def read_portfolio_metrics(fund_id: Optional[List[uuid.UUID]] = Query(None), session: AsyncSession = Depends(get_async_read_session)):
+    frames = await session.run_sync(load_portfolio_frames, fund_id)
+    return await anyio.to_thread.run_sync(compute_portfolio_metrics, frames)
+
+@router.get("/api/funds/{fund_id}/metrics", response_model=schemas.FundMetrics)
+async def read_fund_metrics(
+    fund_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    as_of: Optional[date] = None,
+    session: AsyncSession = Depends(get_async_read_session),
+):
+    # Read before computing, so the headers never claim more than the result covers
+    response.headers.update(version_headers(fund_id))
+    # Net IRR carries a terminal value dated today, so the day is part of the
+    # key. So is the fund's sequence as this session's database sees it: a
+    # result computed on a lagging replica is only reused for that state.
+    # Historical metrics (as_of) are dated by as_of instead, and rerun the
+    # waterfall on the capital called by then (metrics._waterfall_as_of).
+    today = date.today().isoformat()
+    seq = await session.run_sync(current_change_seq, fund_id)
+    not_modified = seq_conditional(request, response, seq, today if as_of is None else f"as-of:{as_of}")
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        inputs = await session.run_sync(load_fund_metrics_inputs, fund_id, as_of)
+        return await anyio.to_thread.run_sync(compute_fund_metrics, inputs)
+
+    key = f"metrics:{today}:{seq}" if as_of is None else f"metrics-as-of:{as_of.isoformat()}:{seq}"
+    metrics = await metrics_cache.aget_or_compute(key, fund_id, compute)
+    if not metrics:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    return metrics
+
+@router.get("/api/funds/{fund_id}/companies/metrics", response_model=schemas.FundCompanyMetrics)
+async def read_fund_company_metrics(
+    fund_id: uuid.UUID, request: Request, response: Response, session: AsyncSession = Depends(get_async_read_session)
+):
+    today = date.today().isoformat()
+    seq = await session.run_sync(current_change_seq, fund_id)
+    not_modified = seq_conditional(request, response, seq, today)
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        inputs = await session.run_sync(load_company_metrics_inputs, fund_id)
+        return await anyio.to_thread.run_sync(compute_company_metrics, inputs)
+
+    metrics = await metrics_cache.aget_or_compute(f"companies:{today}:{seq}", fund_id, compute)
     if not metrics:
         raise HTTPException(status_code=404, detail="Fund not found")
     return metrics
 
-@router.get("/{fund_id}/waterfall", response_model=List[schemas.WaterfallAllocationRead])
-def read_waterfall(fund_id: uuid.UUID, session: Session = Depends(get_session)):
-    return crud.get_waterfall(session, fund_id)
+@router.get("/api/companies/{company_id}/metrics", response_model=schemas.CompanyMetrics)
+async def read_company_metrics(company_id: uuid.UUID, session: AsyncSession = Depends(get_async_read_session)):
+    company = await session.get(crud.PortfolioCompany, company_id)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    inputs = await session.run_sync(load_company_metrics_inputs, company.fund_id, [company_id])
+    metrics = await anyio.to_thread.run_sync(compute_company_metrics, inputs)
+    return metrics["companies"][0]
+
+@router.get("/api/funds/{fund_id}/metrics/timeseries", response_model=schemas.FundMetricsTimeseries)
+async def read_fund_metrics_timeseries(
+    fund_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    freq: str = Query("Q", pattern="^(M|Q|Y)$"),
+    session: AsyncSession = Depends(get_async_read_session),
+):
+    today = date.today().isoformat()
+    seq = await session.run_sync(current_change_seq, fund_id)
+    not_modified = seq_conditional(request, response, seq, today)
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        inputs = await session.run_sync(load_timeseries_inputs, fund_id)
+        return await anyio.to_thread.run_sync(compute_metrics_timeseries, inputs, freq)
+
+    timeseries = await metrics_cache.aget_or_compute(f"timeseries:{freq}:{today}:{seq}", fund_id, compute)
+    if not timeseries:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    return timeseries
+
+@router.post("/api/funds/{fund_id}/metrics/simulation", response_model=schemas.SimulationResult)
+async def simulate_fund_metrics(fund_id: uuid.UUID, request: schemas.SimulationRequest, session: AsyncSession = Depends(get_async_read_session)):
+    inputs = await session.run_sync(load_simulation_inputs, fund_id)
+    if inputs is None:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    # Chunks fan out to the process pool from a worker thread
+    return await anyio.to_thread.run_sync(
+        lambda: run_simulation(
+            inputs,
+            request.paths,
+            request.default.model_dump(),
+            stages={stage: assumption.model_dump() for stage, assumption in request.stages.items()},
+            companies={company_id: assumption.model_dump() for company_id, assumption in request.companies.items()},
+            seed=request.seed,
+        )
+    )
+
+@router.get("/api/funds/{fund_id}/waterfall", response_model=List[schemas.WaterfallAllocationRead])
+async def read_waterfall(
+    fund_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    format: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_session),
+):
+    filters = {"date_from": date_from, "date_to": date_to}
+    output = response_format(request, format)
+    response.headers.update(version_headers(fund_id))
+    seq = await session.run_sync(current_change_seq, fund_id)
+    not_modified = seq_conditional(request, response, seq)
+    if not_modified:
+        return not_modified
+    if output == "ndjson":
+        return StreamingResponse(
+            ndjson_lines(crud.stream_waterfall, fund_id, bind=sync_bind(session), **filters),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=dict(response.headers),
+        )
+
+    after = decode_cursor(cursor)
+    if output in COLUMNAR_FORMATS:
+        # Straight from the query rows; the cached list below holds dicts
+        if after is None and limit is None:
+            rows = await session.run_sync(crud.get_waterfall, fund_id, rows=True, **filters)
+        else:
+            limit = limit or DEFAULT_PAGE_SIZE
+            rows = await session.run_sync(crud.get_waterfall, fund_id, after=after, limit=limit + 1, rows=True, **filters)
+            rows = paginate(rows, limit, response, key=lambda allocation: (allocation.distribution_date, allocation.id))
+        return columnar_response(list(schemas.WaterfallAllocationRead.model_fields), rows, output, response)
+
+    if after is None and limit is None:
+        if date_from is None and date_to is None:
+            async def compute():
+                allocations = await session.run_sync(crud.get_waterfall, fund_id)
+                return [allocation.model_dump() for allocation in allocations]
+
+            # Keyed on the sequence for the same reason as the metrics
+            return await metrics_cache.aget_or_compute(f"waterfall:{seq}", fund_id, compute)
+        return await session.run_sync(crud.get_waterfall, fund_id, **filters)
+    limit = limit or DEFAULT_PAGE_SIZE
+    rows = await session.run_sync(crud.get_waterfall, fund_id, after=after, limit=limit + 1, **filters)
+    return paginate(rows, limit, response, key=lambda allocation: (allocation.distribution_date, allocation.id))
@@ -0,0 +1,50 @@
+from fastapi import HTTPException, Response
+from datetime import date
+from typing import Callable, Iterator, List, Optional, Tuple
+from sqlmodel import Session
+import base64
+import orjson
+import uuid
+from ..database import engine
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Lines are flushed to the client in batches rather than one write per row
+NDJSON_BATCH_SIZE = 1000
+
+# Keyset cursors are the (date, id) of the last row served, base64url encoded
+
+def encode_cursor(row_date: date, row_id: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(f"{row_date.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[date, uuid.UUID]]:
+    if cursor is None:
+        return None
+    try:
+        row_date, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return date.fromisoformat(row_date), uuid.UUID(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def paginate(rows: List, limit: int, response: Response, key: Callable) -> List:
+    # `rows` was fetched with limit + 1 so a further page can be detected
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(rows[-1]))
+    return rows
+
+def ndjson_lines(stream: Callable[..., Iterator[dict]], *args, bind=None, **kwargs) -> Iterator[bytes]:
+    # Runs after the request's own session is gone, so it opens its own (on
+    # `bind`, the request's database, see sync_bind) and keeps it for as long
+    # as the server-side cursor is being drained
+    with Session(bind or engine) as session:
+        batch = []
+        for row in stream(session, *args, **kwargs):
+            batch.append(orjson.dumps(row, default=str))
+            if len(batch) >= NDJSON_BATCH_SIZE:
+                yield b"\n".join(batch) + b"\n"
+                batch = []
+        if batch:
+            yield b"\n".join(batch) + b"\n"
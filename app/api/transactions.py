@@ -1,20 +1,136 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
-from typing import List
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import date
+from typing import AsyncIterator, Iterator, List, Optional
+import anyio
 import uuid
-from ..database import get_session
+from ..database import get_async_read_session, get_async_session, get_session, sync_bind
 from .. import crud, schemas
+from ..models import TransactionType
+from ..logic.ingest import detect_format, parse_rows
+from .changes import fund_conditional
+from .jobs import version_headers
+from .formats import COLUMNAR_FORMATS, columnar_response, response_format
+from .pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NDJSON_MEDIA_TYPE,
+    decode_cursor,
+    ndjson_lines,
+    paginate,
+)
 
 router = APIRouter(tags=["transactions"])
 
 @router.get("/api/funds/{fund_id}/transactions", response_model=List[schemas.TransactionRead])
-def read_transactions(fund_id: uuid.UUID, session: Session = Depends(get_session)):
-    return crud.get_transactions(session, fund_id)
+async def read_transactions(
+    fund_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    tx_type: Optional[TransactionType] = None,
+    company_id: Optional[uuid.UUID] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    format: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_session),
+):
+    filters = {"tx_type": tx_type, "company_id": company_id, "date_from": date_from, "date_to": date_to}
+    output = response_format(request, format)
+    not_modified = await fund_conditional(request, response, session, fund_id)
+    if not_modified:
+        return not_modified
+    if output == "ndjson":
+        return StreamingResponse(
+            ndjson_lines(crud.stream_transactions, fund_id, bind=sync_bind(session), **filters),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=dict(response.headers),
+        )
+    columnar = output in COLUMNAR_FORMATS
+
+    # Without a cursor or limit the whole list is returned, as before
+    after = decode_cursor(cursor)
+    if after is None and limit is None:
+        rows = await session.run_sync(crud.get_transactions, fund_id, rows=columnar, **filters)
+    else:
+        limit = limit or DEFAULT_PAGE_SIZE
+        rows = await session.run_sync(crud.get_transactions, fund_id, after=after, limit=limit + 1, rows=columnar, **filters)
+        rows = paginate(rows, limit, response, key=lambda tx: (tx.transaction_date, tx.id))
+    if columnar:
+        return columnar_response(list(schemas.TransactionRead.model_fields), rows, output, response)
+    return rows
 
 @router.post("/api/funds/{fund_id}/transactions", response_model=schemas.TransactionRead)
-def create_transaction(fund_id: uuid.UUID, transaction: schemas.TransactionCreate, session: Session = Depends(get_session)):
+async def create_transaction(
+    fund_id: uuid.UUID,
+    transaction: schemas.TransactionCreate,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
     if transaction.fund_id is None:
         transaction.fund_id = fund_id
     elif transaction.fund_id != fund_id:
         raise HTTPException(status_code=400, detail="Fund ID mismatch")
-    return crud.create_transaction(session, transaction)
+    db_tx = await session.run_sync(crud.create_transaction, transaction)
+    # The waterfall is recomputed in the background; X-Fund-Version is the
+    # computed version to wait for (GET /api/funds/{fund_id}/jobs)
+    response.headers.update(version_headers(fund_id))
+    return db_tx
+
+async def _body_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig") + "\n"
+    if buffer:
+        yield buffer.decode("utf-8-sig")
+
+def _blocking_lines(lines: AsyncIterator[str]) -> Iterator[str]:
+    # Pull the request stream from the worker thread doing the inserts, so
+    # rows are parsed and written as they arrive instead of buffering the body
+    while True:
+        try:
+            yield anyio.from_thread.run(lines.__anext__)
+        except StopAsyncIteration:
+            return
+
+def _file_lines(file) -> Iterator[str]:
+    for line in file:
+        yield line.decode("utf-8-sig")
+
+@router.post("/api/funds/{fund_id}/transactions:batch", response_model=schemas.TransactionBatchResult)
+async def create_transactions_batch(fund_id: uuid.UUID, request: Request, session: Session = Depends(get_session)):
+    # Accepts a JSON array, a streamed CSV/NDJSON body, or a multipart `file` upload.
+    # The import is a long write that pulls the body from its worker thread, so
+    # it stays on a sync session in the threadpool rather than the event loop.
+    fund = await run_in_threadpool(crud.get_fund, session, fund_id)
+    if not fund:
+        raise HTTPException(status_code=404, detail="Fund not found")
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing file upload")
+        fmt = detect_format(upload.content_type, upload.filename)
+        if fmt is None:
+            raise HTTPException(status_code=415, detail="Upload must be CSV or NDJSON")
+        rows = parse_rows(_file_lines(upload.file), fmt)
+    elif content_type.startswith("application/json"):
+        rows = await request.json()
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of transactions")
+    else:
+        fmt = detect_format(content_type)
+        if fmt is None:
+            raise HTTPException(status_code=415, detail="Body must be JSON, CSV or NDJSON")
+        rows = parse_rows(_blocking_lines(_body_lines(request.stream())), fmt)
+
+    return await run_in_threadpool(crud.create_transactions_bulk, session, fund_id, rows)
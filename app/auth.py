@@ -1,35 +1,259 @@
-from fastapi import Request, HTTPException, Depends
-from jose import jwt, JWTError
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import json
+import os
+import threading
+import time
+import urllib.request
+from fastapi import Request, HTTPException
+from jose import jwk, jwt, JWTError
 from .config import settings
 
-# Supabase uses JWTs for authentication.
-# The public key is not directly exposed, but we can verify the token 
-# using the SUPABASE_PUBLISHABLE_KEY (which acts as the secret for HS256 tokens in some configurations)
-# or better, by calling the Supabase Auth API.
-# However, for a simple middleware, we can verify the signature if we have the JWT Secret.
+# Supabase access tokens are JWTs, signed either with the project's JWT secret
+# (HS256, SUPABASE_JWT_SECRET) or with its asymmetric signing keys (RS256 /
+# ES256), published as a JWKS at SUPABASE_URL/auth/v1/.well-known/jwks.json.
+#
+# Nothing here touches the network on the request path. The JWKS is read from
+# a local file (SUPABASE_JWKS_PATH) that a background thread refreshes, keys
+# are parsed once when they load, and tokens that already verified are kept
+# in an LRU until they expire, so a repeat request costs a dict lookup rather
+# than a signature check.
+#
+# With AUTH_VERIFY_JWT off (development, load tests) any bearer token is
+# accepted, as before.
 
-def get_current_user(request: Request):
+HMAC_ALGORITHMS = ("HS256",)
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+# Algorithm for JWKS entries that don't name one
+DEFAULT_ALGORITHMS = {"RSA": "RS256", "EC": "ES256"}
+# A token signed by a key we don't have asks for a refresh at most this often
+UNKNOWN_KEY_REFRESH_SECONDS = 30
+
+class VerifiedTokenCache:
+    # Bounded LRU of token -> claims. Entries go when the token expires, so a
+    # hit never outlives the signature check it stands for.
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str, now: float) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: dict, expires_at: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (claims, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class TokenVerifier:
+    def __init__(
+        self,
+        secret: str,
+        jwks_path: str,
+        jwks_url: str,
+        audience: str,
+        cache_entries: int,
+        refresh_seconds: float,
+    ):
+        self.jwks_path = jwks_path
+        self.jwks_url = jwks_url
+        self.audience = audience or None
+        self.refresh_seconds = refresh_seconds
+        self.cache = VerifiedTokenCache(cache_entries)
+        self._hmac_key = jwk.construct(secret, "HS256") if secret else None
+        # kid -> (key, the algorithm it verifies)
+        self._keys: Dict[str, Tuple[object, str]] = {}
+        self._jwks_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._refresh_requested = threading.Event()
+        self._last_unknown_key = 0.0
+        self._stats = {"hits": 0, "verified": 0, "rejected": 0, "refreshes": 0, "last_refresh_error": None}
+        try:
+            self.load_jwks()
+        except Exception as exc:
+            # A malformed file doesn't stop the app: asymmetric tokens are
+            # rejected until a refresh loads a good one
+            self._stats["last_refresh_error"] = f"{type(exc).__name__}: {exc}"
+
+    # --- key material ---
+
+    def load_jwks(self) -> bool:
+        # (Re)reads the local JWKS file if it changed; True if the keys did
+        try:
+            mtime = os.path.getmtime(self.jwks_path)
+        except OSError:
+            return False
+        if mtime == self._jwks_mtime:
+            return False
+        with open(self.jwks_path) as f:
+            jwks = json.load(f)
+        self._jwks_mtime = mtime
+        return self._set_keys(jwks)
+
+    def _set_keys(self, jwks: dict) -> bool:
+        keys = {}
+        for key in jwks.get("keys", []):
+            if key.get("use", "sig") != "sig" or "kid" not in key:
+                continue
+            algorithm = key.get("alg") or DEFAULT_ALGORITHMS.get(key.get("kty"))
+            if algorithm not in ASYMMETRIC_ALGORITHMS:
+                continue
+            keys[key["kid"]] = (jwk.construct(key, algorithm), algorithm)
+        with self._lock:
+            removed = set(self._keys) - set(keys)
+            changed = set(keys) != set(self._keys)
+            self._keys = keys
+        # Tokens verified with a key that is gone must be checked again
+        if removed:
+            self.cache.clear()
+        return changed
+
+    def fetch_jwks(self):
+        # Downloads the JWKS and swaps the local file in one rename, so other
+        # workers reading it never see half a file
+        with urllib.request.urlopen(self.jwks_url, timeout=10) as response:
+            jwks = json.loads(response.read())
+        directory = os.path.dirname(os.path.abspath(self.jwks_path))
+        temporary = os.path.join(directory, f".{os.path.basename(self.jwks_path)}.{os.getpid()}")
+        with open(temporary, "w") as f:
+            json.dump(jwks, f)
+        os.replace(temporary, self.jwks_path)
+        self.load_jwks()
+
+    def start(self):
+        if self._thread is not None or self.refresh_seconds <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="jwks-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._refresh_requested.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refresh_loop(self):
+        while not self._stopping.is_set():
+            try:
+                # Without a URL the file is managed elsewhere; pick up its changes
+                if self.jwks_url:
+                    self.fetch_jwks()
+                else:
+                    self.load_jwks()
+                self._stats["refreshes"] += 1
+                self._stats["last_refresh_error"] = None
+            except Exception as exc:
+                self._stats["last_refresh_error"] = f"{type(exc).__name__}: {exc}"
+            self._refresh_requested.wait(self.refresh_seconds)
+            self._refresh_requested.clear()
+
+    def _key_for(self, header: dict) -> Tuple[object, str]:
+        # The key and the algorithm bound to it when it loaded; the header's
+        # alg only picks between the secret and the JWKS, it is never trusted
+        # to say how a key verifies
+        algorithm = header.get("alg")
+        if algorithm in HMAC_ALGORITHMS:
+            if self._hmac_key is None:
+                raise JWTError("HS256 tokens are not accepted without SUPABASE_JWT_SECRET")
+            return self._hmac_key, "HS256"
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise JWTError(f"Unsupported signing algorithm: {algorithm}")
+        key = self._keys.get(header.get("kid"))
+        if key is None:
+            # Likely a rotated key: wake the refresher, but don't wait for it
+            now = time.monotonic()
+            if now - self._last_unknown_key > UNKNOWN_KEY_REFRESH_SECONDS:
+                self._last_unknown_key = now
+                self._refresh_requested.set()
+            raise JWTError("Unknown signing key")
+        return key
+
+    # --- tokens ---
+
+    def verify(self, token: str) -> dict:
+        # Claims of a valid token; JWTError otherwise
+        claims = self.cache.get(token, time.time())
+        if claims is not None:
+            self._stats["hits"] += 1
+            return claims
+        try:
+            key, algorithm = self._key_for(jwt.get_unverified_header(token))
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                audience=self.audience,
+                options={"verify_aud": self.audience is not None},
+            )
+        except JWTError:
+            self._stats["rejected"] += 1
+            raise
+        self._stats["verified"] += 1
+        # Tokens without an expiry are checked every time
+        if "exp" in claims:
+            self.cache.put(token, claims, float(claims["exp"]))
+        return claims
+
+    def stats(self) -> dict:
+        return {**self._stats, "cached_tokens": len(self.cache), "signing_keys": len(self._keys)}
+
+def _jwks_url() -> str:
+    if settings.SUPABASE_JWKS_URL:
+        return settings.SUPABASE_JWKS_URL
+    if settings.SUPABASE_URL:
+        return f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json"
+    return ""
+
+token_verifier = TokenVerifier(
+    secret=settings.SUPABASE_JWT_SECRET,
+    jwks_path=settings.SUPABASE_JWKS_PATH,
+    jwks_url=_jwks_url(),
+    audience=settings.SUPABASE_JWT_AUDIENCE,
+    cache_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    refresh_seconds=settings.JWKS_REFRESH_SECONDS,
+)
+
+def _unauthorized(detail: str):
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+# Added to every router in main.py. Async so it runs on the event loop: a
+# cache hit is a dict lookup and a miss is one signature check, both cheaper
+# than the hop to a worker thread a sync dependency would take.
+async def get_current_user(request: Request) -> dict:
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid authentication token")
-    
-    token = auth_header.split(" ")[1]
-    
-    # In a real production app with Supabase, you would typically use 
-    # the 'gotrue' library or verify against Supabase's public keys.
-    # For this implementation, we'll provide a placeholder that explains 
-    # how to verify the Supabase JWT.
-    
-    try:
-        # Note: Supabase JWTs are signed with a project-specific JWT Secret 
-        # found in Settings > API. You should add SUPABASE_JWT_SECRET to your .env
-        # payload = jwt.decode(token, settings.SUPABASE_JWT_SECRET, algorithms=["HS256"], audience="authenticated")
-        # return payload
-        
-        # Placeholder: In development, we'll just check if the token exists.
-        # In production, uncomment the jwt.decode logic above.
+        raise _unauthorized("Missing or invalid authentication token")
+
+    token = auth_header[len("Bearer "):]
+    if not settings.AUTH_VERIFY_JWT:
         return {"user_id": "placeholder_id"}
+    try:
+        claims = token_verifier.verify(token)
     except JWTError:
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
-
-# To use this, add `user: dict = Depends(get_current_user)` to your protected routes.
+        raise _unauthorized("Could not validate credentials")
+    return {"user_id": claims.get("sub"), "role": claims.get("role"), "claims": claims}
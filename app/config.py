@@ -5,8 +5,53 @@ class Settings(BaseSettings):
     SUPABASE_PUBLISHABLE_KEY: str = ""
     SUPABASE_JWT_SECRET: str = ""
     DATABASE_URL: str = "sqlite:///./test.db"
+    # Read replicas, comma separated; read-only endpoints go round-robin over
+    # them (database.py). Empty: everything on DATABASE_URL.
+    DATABASE_REPLICA_URLS: str = ""
+    # Replicas further behind than this are skipped (0: never), measured
+    # every REPLICA_LAG_CHECK_SECONDS (0: no checks)
+    REPLICA_MAX_LAG_SECONDS: float = 5
+    REPLICA_LAG_CHECK_SECONDS: float = 5
+    # After a write, that client reads from the primary for this long
+    READ_AFTER_WRITE_SECONDS: int = 10
     SECRET_KEY: str = "secret"
     DEBUG: bool = True
+    # Logs every SQL statement; /internal/metrics is the low-overhead alternative
+    SQL_ECHO: bool = False
+    # Request/SQL instrumentation (/internal/metrics). SLOW_REQUEST_MS > 0 keeps
+    # the last SLOW_REQUEST_SAMPLES requests over it, with their statements
+    METRICS_ENABLED: bool = True
+    SLOW_REQUEST_MS: float = 0
+    SLOW_REQUEST_SAMPLES: int = 50
+    # Connection pool, applied to both the sync and async engines
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_PRE_PING: bool = True
+    # Metrics/waterfall cache: "memory" (per worker), "sqlite" (shared file) or "none"
+    CACHE_BACKEND: str = "memory"
+    CACHE_MAX_ENTRIES: int = 1024
+    CACHE_SQLITE_PATH: str = "./cache.db"
+    # Monte Carlo process pool: 0 = one worker per CPU, 1 = run in-process
+    SIMULATION_WORKERS: int = 0
+    # Waterfall recompute jobs: "memory" (in-process queue worked by
+    # JOB_WORKERS threads) or "inline" (run in the writing request)
+    JOB_BACKEND: str = "memory"
+    JOB_WORKERS: int = 2
+    # Finished jobs kept for status lookups
+    JOB_HISTORY: int = 1000
+    # Bearer tokens: off accepts any token (development); on verifies Supabase
+    # JWTs, HS256 with SUPABASE_JWT_SECRET and RS256/ES256 with the JWKS
+    AUTH_VERIFY_JWT: bool = False
+    SUPABASE_JWT_AUDIENCE: str = "authenticated"
+    # Local copy of the project's JWKS, refreshed every JWKS_REFRESH_SECONDS
+    # from SUPABASE_JWKS_URL (default: SUPABASE_URL/auth/v1/.well-known/jwks.json)
+    SUPABASE_JWKS_PATH: str = "./jwks.json"
+    SUPABASE_JWKS_URL: str = ""
+    JWKS_REFRESH_SECONDS: int = 600
+    # Verified tokens remembered until they expire
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
 
     model_config = SettingsConfigDict(env_file=".env")
 
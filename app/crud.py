@@ -1,10 +1,32 @@
-from typing import List, Union
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from sqlalchemy import bindparam, insert, tuple_, update
 from sqlmodel import Session, select
-from .models import Fund, PortfolioCompany, Transaction, WaterfallAllocation, TransactionType
-from .schemas import FundCreate, PortfolioCompanyCreate, TransactionCreate
-from .logic.waterfall import compute_waterfall
+from .models import Fund, FundAggregate, PortfolioCompany, Transaction, ValuationMark, WaterfallAllocation, TransactionType
+from .schemas import (
+    FundCreate,
+    PortfolioCompanyCreate,
+    PortfolioCompanyRead,
+    TransactionCreate,
+    TransactionRead,
+    ValuationMarkCreate,
+    WaterfallAllocationRead,
+)
+from .logic import aggregates
+from .logic.cache import metrics_cache
+from .logic.changes import current_change_seq, next_change_seq
+from .logic.ingest import BULK_INSERT_CHUNK_SIZE
+from .logic.jobs import job_queue
 import uuid
 
+STREAM_BATCH_SIZE = 1000
+
+def read_columns(model, schema) -> list:
+    # Table columns in the read schema's field order, for plain row selects
+    return [model.__table__.c[name] for name in schema.model_fields]
+
 # Funds
 def get_funds(session: Session):
     return session.exec(select(Fund)).all()
@@ -15,6 +37,7 @@ def get_fund(session: Session, fund_id: uuid.UUID):
 def create_fund(session: Session, fund: FundCreate):
     db_fund = Fund.from_orm(fund)
     session.add(db_fund)
+    session.add(FundAggregate(fund_id=db_fund.id))
     session.commit()
     session.refresh(db_fund)
     return db_fund
@@ -23,22 +46,147 @@ def create_fund(session: Session, fund: FundCreate):
 def get_companies(session: Session, fund_id: uuid.UUID):
     return session.exec(select(PortfolioCompany).where(PortfolioCompany.fund_id == fund_id)).all()
 
+def get_company_rows(session: Session, fund_id: uuid.UUID):
+    # Plain tuples in PortfolioCompanyRead field order (columnar responses)
+    stmt = select(*read_columns(PortfolioCompany, PortfolioCompanyRead)).where(PortfolioCompany.fund_id == fund_id)
+    return session.execute(stmt).all()
+
 def create_company(session: Session, company: PortfolioCompanyCreate):
     db_company = PortfolioCompany.from_orm(company)
+    db_company.change_seq = next_change_seq(session, db_company.fund_id)
     session.add(db_company)
+    # Its valuation, if any, starts the company's mark history
+    mark = _current_mark(session, db_company)
+    if mark is not None:
+        session.add(mark)
+    aggregates.apply_company(session, db_company)
     session.commit()
     session.refresh(db_company)
+    metrics_cache.bump(db_company.fund_id)
     return db_company
 
+# Valuation marks
+def _current_mark(session: Session, company: PortfolioCompany) -> Optional[ValuationMark]:
+    # The company's current valuation as a mark, dated the way
+    # logic/valuations.py dates companies without history
+    if not (company.latest_post_money and company.ownership_pct):
+        return None
+    fund = session.get(Fund, company.fund_id)
+    if fund is None:
+        return None
+    return ValuationMark(
+        fund_id=company.fund_id,
+        company_id=company.id,
+        mark_date=company.last_round_date or company.initial_investment_date or fund.fund_start_date,
+        post_money=company.latest_post_money,
+        ownership_pct=company.ownership_pct,
+        value=aggregates.current_value(company),
+        change_seq=company.change_seq,
+    )
+
+def get_marks(session: Session, company_id: uuid.UUID):
+    stmt = select(ValuationMark).where(ValuationMark.company_id == company_id).order_by(
+        ValuationMark.mark_date, ValuationMark.created_at, ValuationMark.id
+    )
+    return session.exec(stmt).all()
+
+def create_valuation_mark(session: Session, company_id: uuid.UUID, mark: ValuationMarkCreate):
+    # Adds a dated mark to the company's history; None if it doesn't exist.
+    # A mark dated on or after the current valuation (or any mark, if there is
+    # none) also becomes the company's current valuation, a backdated one only
+    # fills in history.
+    company = session.get(PortfolioCompany, company_id)
+    if company is None:
+        return None
+    change_seq = next_change_seq(session, company.fund_id)
+
+    # Companies created before mark history keep their current valuation as
+    # the first mark, so adding one doesn't lose it
+    has_history = session.exec(select(ValuationMark.id).where(ValuationMark.company_id == company_id).limit(1)).first()
+    if has_history is None:
+        current = _current_mark(session, company)
+        if current is not None:
+            session.add(current)
+
+    ownership_pct = mark.ownership_pct if mark.ownership_pct is not None else company.ownership_pct
+    db_mark = ValuationMark(
+        fund_id=company.fund_id,
+        company_id=company_id,
+        mark_date=mark.mark_date,
+        post_money=mark.post_money,
+        ownership_pct=ownership_pct,
+        value=(mark.post_money * ownership_pct) if ownership_pct else 0,
+        change_seq=change_seq,
+    )
+    session.add(db_mark)
+
+    current_date = company.last_round_date or company.initial_investment_date
+    has_valuation = bool(company.latest_post_money and company.ownership_pct)
+    if not has_valuation or current_date is None or mark.mark_date >= current_date:
+        previous_value = aggregates.current_value(company)
+        company.latest_post_money = mark.post_money
+        company.ownership_pct = ownership_pct
+        company.last_round_date = mark.mark_date
+        company.change_seq = change_seq
+        company.updated_at = datetime.utcnow()
+        session.add(company)
+        aggregates.apply_mark(session, company, previous_value)
+
+    session.commit()
+    session.refresh(db_mark)
+    metrics_cache.bump(company.fund_id)
+    return db_mark
+
 # Transactions
-def get_transactions(session: Session, fund_id: uuid.UUID):
-    return session.exec(select(Transaction).where(Transaction.fund_id == fund_id)).all()
+def _filter_transactions(
+    stmt,
+    fund_id: uuid.UUID,
+    tx_type: Optional[TransactionType] = None,
+    company_id: Optional[uuid.UUID] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    stmt = stmt.where(Transaction.fund_id == fund_id)
+    if tx_type is not None:
+        stmt = stmt.where(Transaction.tx_type == tx_type)
+    if company_id is not None:
+        stmt = stmt.where(Transaction.company_id == company_id)
+    if date_from is not None:
+        stmt = stmt.where(Transaction.transaction_date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Transaction.transaction_date <= date_to)
+    return stmt.order_by(Transaction.transaction_date.asc(), Transaction.id.asc())
+
+def get_transactions(
+    session: Session,
+    fund_id: uuid.UUID,
+    after: Optional[Tuple[date, uuid.UUID]] = None,
+    limit: Optional[int] = None,
+    rows: bool = False,
+    **filters,
+):
+    # Keyset pagination on (transaction_date, id). With rows=True, plain
+    # tuples in TransactionRead field order instead of ORM objects.
+    selected = select(*read_columns(Transaction, TransactionRead)) if rows else select(Transaction)
+    stmt = _filter_transactions(selected, fund_id, **filters)
+    if after is not None:
+        stmt = stmt.where(tuple_(Transaction.transaction_date, Transaction.id) > tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return session.execute(stmt).all() if rows else session.exec(stmt).all()
+
+def stream_transactions(session: Session, fund_id: uuid.UUID, **filters) -> Iterator[dict]:
+    # Plain rows off a server-side cursor; no ORM objects, flat memory
+    stmt = _filter_transactions(select(*read_columns(Transaction, TransactionRead)), fund_id, **filters)
+    for row in session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE)):
+        yield dict(row._mapping)
 
 def create_transaction(session: Session, transaction: Union[TransactionCreate, dict]):
     if isinstance(transaction, dict):
         db_tx = Transaction(**transaction)
     else:
         db_tx = Transaction.from_orm(transaction)
+    db_tx.change_seq = next_change_seq(session, db_tx.fund_id)
     session.add(db_tx)
     
     # Business Rule: If capital call, update company total_invested
@@ -46,16 +194,181 @@ def create_transaction(session: Session, transaction: Union[TransactionCreate, d
         company = session.get(PortfolioCompany, db_tx.company_id)
         if company:
             company.total_invested += db_tx.amount
+            company.change_seq = db_tx.change_seq
             session.add(company)
 
+    aggregates.apply_transaction(session, db_tx)
+
     session.commit()
     session.refresh(db_tx)
+    metrics_cache.bump(db_tx.fund_id)
 
-    # Trigger waterfall recompute if distribution
+    # Waterfall recompute runs as a background job, coalesced with other
+    # pending writes to the fund: distributions replay from their date,
+    # capital calls raise the capital still to be returned
     if db_tx.tx_type == TransactionType.distribution:
-        compute_waterfall(session, db_tx.fund_id)
+        job_queue.enqueue_waterfall(session, db_tx.fund_id, since=db_tx.transaction_date)
+    elif db_tx.tx_type == TransactionType.capital_call:
+        job_queue.enqueue_waterfall(session, db_tx.fund_id, capital_changed=True)
 
     return db_tx
 
-def get_waterfall(session: Session, fund_id: uuid.UUID):
-    return session.exec(select(WaterfallAllocation).where(WaterfallAllocation.fund_id == fund_id).order_by(WaterfallAllocation.distribution_date.asc())).all()
+def _row_error(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+        )
+    return str(exc)
+
+def create_transactions_bulk(session: Session, fund_id: uuid.UUID, rows: Iterable[Union[dict, Exception]]):
+    # Rows are consumed lazily, so a streamed upload is validated and inserted
+    # chunk by chunk. A row may also be the exception raised while decoding it.
+    company_ids = set(session.exec(select(PortfolioCompany.id).where(PortfolioCompany.fund_id == fund_id)).all())
+    invested: Dict[uuid.UUID, float] = defaultdict(float)
+    errors = []
+    chunk = []
+    received = 0
+    inserted = 0
+    earliest_distribution = None
+    has_capital_calls = False
+    created_at = datetime.utcnow()
+    # The whole batch is one change. Taken up front since rows are inserted
+    # as they stream in; other writes to the fund wait for the batch.
+    change_seq = next_change_seq(session, fund_id)
+
+    for row_number, row in enumerate(rows, start=1):
+        received += 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            tx = TransactionCreate.model_validate(row)
+            if tx.fund_id is None:
+                tx.fund_id = fund_id
+            elif tx.fund_id != fund_id:
+                raise ValueError("Fund ID mismatch")
+            if tx.company_id is not None and tx.company_id not in company_ids:
+                raise ValueError("Company not found in fund")
+        except (ValueError, ValidationError) as exc:
+            errors.append({"row": row_number, "error": _row_error(exc)})
+            continue
+
+        # Offset created_at by row so same-day ties keep upload order in the waterfall
+        row_created_at = created_at + timedelta(microseconds=row_number)
+        chunk.append({
+            **tx.model_dump(),
+            "id": uuid.uuid4(),
+            "created_at": row_created_at,
+            "updated_at": row_created_at,
+            "change_seq": change_seq,
+        })
+
+        # Business Rule: capital calls roll up into company total_invested
+        if tx.tx_type == TransactionType.capital_call:
+            has_capital_calls = True
+            if tx.company_id:
+                invested[tx.company_id] += tx.amount
+        elif tx.tx_type == TransactionType.distribution:
+            if earliest_distribution is None or tx.transaction_date < earliest_distribution:
+                earliest_distribution = tx.transaction_date
+
+        if len(chunk) >= BULK_INSERT_CHUNK_SIZE:
+            session.execute(insert(Transaction), chunk)
+            inserted += len(chunk)
+            chunk = []
+
+    if chunk:
+        session.execute(insert(Transaction), chunk)
+        inserted += len(chunk)
+
+    # One executemany UPDATE for every company touched by the batch
+    if invested:
+        companies = PortfolioCompany.__table__
+        session.execute(
+            update(companies)
+            .where(companies.c.id == bindparam("company_id"))
+            .values(total_invested=companies.c.total_invested + bindparam("increment"), change_seq=change_seq),
+            [{"company_id": company_id, "increment": amount} for company_id, amount in invested.items()],
+        )
+
+    aggregates.rebuild_aggregates(session, [fund_id])
+    session.commit()
+    metrics_cache.bump(fund_id)
+
+    # One waterfall job for the whole batch, replaying from the earliest
+    # distribution and picking up any new capital
+    job = None
+    if has_capital_calls or earliest_distribution is not None:
+        job = job_queue.enqueue_waterfall(session, fund_id, since=earliest_distribution, capital_changed=has_capital_calls)
+
+    return {
+        "fund_id": fund_id,
+        "received": received,
+        "inserted": inserted,
+        "errors": errors,
+        "job_id": job["id"] if job else None,
+    }
+
+def _filter_waterfall(stmt, fund_id: uuid.UUID, date_from: Optional[date] = None, date_to: Optional[date] = None):
+    stmt = stmt.where(WaterfallAllocation.fund_id == fund_id)
+    if date_from is not None:
+        stmt = stmt.where(WaterfallAllocation.distribution_date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(WaterfallAllocation.distribution_date <= date_to)
+    return stmt.order_by(WaterfallAllocation.distribution_date.asc(), WaterfallAllocation.id.asc())
+
+def get_waterfall(
+    session: Session,
+    fund_id: uuid.UUID,
+    after: Optional[Tuple[date, uuid.UUID]] = None,
+    limit: Optional[int] = None,
+    rows: bool = False,
+    **filters,
+):
+    # Keyset pagination on (distribution_date, id); rows=True as in get_transactions
+    selected = select(*read_columns(WaterfallAllocation, WaterfallAllocationRead)) if rows else select(WaterfallAllocation)
+    stmt = _filter_waterfall(selected, fund_id, **filters)
+    if after is not None:
+        stmt = stmt.where(tuple_(WaterfallAllocation.distribution_date, WaterfallAllocation.id) > tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return session.execute(stmt).all() if rows else session.exec(stmt).all()
+
+def stream_waterfall(session: Session, fund_id: uuid.UUID, **filters) -> Iterator[dict]:
+    stmt = _filter_waterfall(select(*read_columns(WaterfallAllocation, WaterfallAllocationRead)), fund_id, **filters)
+    for row in session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE)):
+        yield dict(row._mapping)
+
+# Change feed
+def get_changes(session: Session, fund_id: uuid.UUID, since: int, seq: Optional[int] = None):
+    # Everything stamped after `since`, or None if the fund doesn't exist;
+    # since=0 is a full snapshot, rows written before sequencing included.
+    # `seq` (read first unless given) is where the next call starts: every
+    # row up to it is visible by then, see logic/changes.py.
+    if seq is None:
+        seq = current_change_seq(session, fund_id)
+        if seq is None:
+            return None
+    fund = session.get(Fund, fund_id)
+    if fund is None:
+        return None
+
+    def changed(model):
+        stmt = select(model).where(model.fund_id == fund_id)
+        return stmt.where(model.change_seq > since) if since > 0 else stmt
+
+    companies = session.exec(changed(PortfolioCompany).order_by(PortfolioCompany.change_seq, PortfolioCompany.id)).all()
+    transactions = session.exec(changed(Transaction).order_by(Transaction.change_seq, Transaction.id)).all()
+    waterfall = session.exec(
+        changed(WaterfallAllocation).order_by(WaterfallAllocation.distribution_date, WaterfallAllocation.id)
+    ).all()
+    marks = session.exec(changed(ValuationMark).order_by(ValuationMark.change_seq, ValuationMark.id)).all()
+    return {
+        "fund_id": fund_id,
+        "since": since,
+        "seq": seq,
+        "fund": fund,
+        "companies": companies,
+        "transactions": transactions,
+        "waterfall": waterfall,
+        "marks": marks,
+    }
@@ -1,11 +1,212 @@
-from sqlmodel import create_engine, Session, SQLModel
+from itertools import count
+from typing import List, Optional
+import threading
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from .config import settings
+from .instrumentation import instrument_engine
+from .migrations import create_schema
 
-engine = create_engine(settings.DATABASE_URL, echo=settings.DEBUG)
+def _pool_options(url: str) -> dict:
+    # SQLite dialects pick their own pool class (NullPool/StaticPool), which
+    # take no sizing arguments; the pool settings are for Postgres
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def async_database_url(url: str) -> str:
+    # asyncpg for Postgres, aiosqlite locally
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+class Database:
+    # One database server: a sync engine (scripts, jobs, streamed responses)
+    # and an async one (request handlers) on the same URL
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = create_engine(url, echo=settings.SQL_ECHO, **_pool_options(url))
+        self.async_engine = create_async_engine(async_database_url(url), echo=settings.SQL_ECHO, **_pool_options(url))
+        instrument_engine(self.engine)
+        instrument_engine(self.async_engine.sync_engine)
+        self.sessions = 0
+        # Replication lag in seconds from the last check (None: unknown or no check yet)
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def healthy(self) -> bool:
+        if self.error is not None:
+            return False
+        return self.lag is None or settings.REPLICA_MAX_LAG_SECONDS <= 0 or self.lag <= settings.REPLICA_MAX_LAG_SECONDS
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "sessions": self.sessions,
+            "lag_seconds": self.lag,
+            "healthy": self.healthy,
+            "error": self.error,
+            "pool": _pool_stats(self.engine.pool),
+            "async_pool": _pool_stats(self.async_engine.pool),
+        }
+
+def _pool_stats(pool) -> dict:
+    # QueuePool numbers; SQLite's NullPool/StaticPool only have a description
+    if not hasattr(pool, "checkedout"):
+        return {"class": type(pool).__name__}
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+# Seconds since the replica last replayed a commit, or 0 when it has replayed
+# everything it received (an idle primary would otherwise look like lag)
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+class ReplicaPool:
+    # Reads go round-robin over the replicas (DATABASE_REPLICA_URLS). A
+    # background check measures each one's replication lag every
+    # REPLICA_LAG_CHECK_SECONDS; replicas that are behind by more than
+    # REPLICA_MAX_LAG_SECONDS, or unreachable, are skipped until they
+    # recover, and with none left reads fall back to the primary.
+
+    def __init__(self, primary: Database, replicas: List[Database]):
+        self.primary = primary
+        self.replicas = replicas
+        self._next = count()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def choose(self) -> Database:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next) % len(self.replicas)]
+            if replica.healthy:
+                return replica
+        return self.primary
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    if replica.engine.dialect.name == "postgresql":
+                        lag = connection.execute(POSTGRES_LAG_QUERY).scalar()
+                        replica.lag = float(lag) if lag is not None else 0.0
+                    else:
+                        # No lag to ask for (e.g. a SQLite copy): reachable is enough
+                        connection.execute(text("SELECT 1"))
+                replica.error = None
+            except Exception as exc:
+                replica.error = f"{type(exc).__name__}: {exc}"
+
+    def start(self):
+        if not self.replicas or self._thread is not None or settings.REPLICA_LAG_CHECK_SECONDS <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._check_loop, name="replica-lag", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _check_loop(self):
+        while not self._stopping.is_set():
+            self.check()
+            self._stopping.wait(settings.REPLICA_LAG_CHECK_SECONDS)
+
+    def stats(self) -> List[dict]:
+        return [self.primary.stats()] + [replica.stats() for replica in self.replicas]
+
+primary = Database("primary", settings.DATABASE_URL)
+replica_pool = ReplicaPool(
+    primary,
+    [
+        Database(f"replica-{i}", url.strip())
+        for i, url in enumerate(settings.DATABASE_REPLICA_URLS.split(","), start=1)
+        if url.strip()
+    ],
+)
+
+engine = primary.engine
+async_engine = primary.async_engine
 
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    create_schema(engine)
 
 def get_session():
+    primary.sessions += 1
     with Session(engine) as session:
         yield session
+
+def _async_session(database: Database) -> AsyncSession:
+    database.sessions += 1
+    # Objects stay loaded after commit: responses are serialized outside the
+    # greenlet, where an expired attribute could not be refreshed
+    return AsyncSession(database.async_engine, expire_on_commit=False, info={"database": database})
+
+async def get_async_session():
+    # Writes, and anything that must see them: always the primary
+    async with _async_session(primary) as session:
+        yield session
+
+# Set on responses to writes; while it lives (READ_AFTER_WRITE_SECONDS) the
+# client's reads stay on the primary, so it sees its own writes even if the
+# replicas are behind
+READ_PRIMARY_COOKIE = "read_primary"
+
+async def get_async_read_session(request: Request):
+    # Read-only endpoints: a replica, unless there are none, none is usable
+    # or the client wrote recently
+    database = primary if request.cookies.get(READ_PRIMARY_COOKIE) else replica_pool.choose()
+    async with _async_session(database) as session:
+        yield session
+
+def sync_bind(session: AsyncSession):
+    # The sync engine on the same database as `session`, for streamed
+    # responses that open their own Session once the request's is gone
+    return session.info.get("database", primary).engine
+
+class ReadAfterWriteMiddleware:
+    # Plain ASGI middleware: successful POST/PUT/PATCH/DELETE responses get
+    # the READ_PRIMARY_COOKIE
+    WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+    def __init__(self, app):
+        self.app = app
+        self.cookie = (
+            f"{READ_PRIMARY_COOKIE}=1; Max-Age={settings.READ_AFTER_WRITE_SECONDS}; Path=/; HttpOnly; SameSite=Lax"
+        ).encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in self.WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", self.cookie)]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
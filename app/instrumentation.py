@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+import time
+from sqlalchemy import event
+from .config import settings
+
+# In-process request/SQL instrumentation, exposed in Prometheus text format
+# by /internal/metrics. Each worker process keeps its own numbers (scrape
+# every worker, as with any multi-process Prometheus target).
+#
+# Per request: latency by route template, query count and DB time. Per
+# statement: duration. Per compute phase (waterfall, XIRR): duration.
+# With SLOW_REQUEST_MS set, requests over it are kept with their statements
+# in a small ring buffer (/internal/metrics/slow).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Statements kept per sampled request, so one runaway loop can't hold memory
+MAX_SAMPLED_STATEMENTS = 200
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, total in sorted(snapshot):
+            pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, label_values)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = ",".join(pairs + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(pairs)}}}" if pairs else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request.", ("route",), QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL per HTTP request.", ("route",))
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement latency.", (), QUERY_BUCKETS)
+PHASE_SECONDS = Histogram("compute_phase_duration_seconds", "Compute phase latency (waterfall, xirr).", ("phase",))
+
+HISTOGRAMS = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, QUERY_SECONDS, PHASE_SECONDS]
+
+# The current request's counters; a mutable dict, so work done in threads or
+# greenlets started from the request (which copy the context) adds to it
+_request: ContextVar[Optional[dict]] = ContextVar("request_instrumentation", default=None)
+_slow_requests: deque = deque(maxlen=max(settings.SLOW_REQUEST_SAMPLES, 1))
+
+def render_metrics() -> str:
+    return "\n".join(line for histogram in HISTOGRAMS for line in histogram.render()) + "\n"
+
+def slow_requests() -> List[dict]:
+    return list(_slow_requests)
+
+@contextmanager
+def timed(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        PHASE_SECONDS.observe(seconds, phase)
+        stats = _request.get()
+        if stats is not None:
+            stats["phases"][phase] = stats["phases"].get(phase, 0.0) + seconds
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_instrumentation_started", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    QUERY_SECONDS.observe(seconds)
+    stats = _request.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db_seconds"] += seconds
+        statements = stats["statements"]
+        if statements is not None and len(statements) < MAX_SAMPLED_STATEMENTS:
+            statements.append({"sql": statement, "ms": round(seconds * 1000, 3), "executemany": executemany})
+
+def instrument_engine(engine):
+    # Takes a sync Engine (for an AsyncEngine, pass its .sync_engine)
+    if settings.METRICS_ENABLED:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+class InstrumentationMiddleware:
+    # Plain ASGI middleware: no extra task per request, and streamed bodies
+    # are timed until their last chunk
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        sampling = settings.SLOW_REQUEST_MS > 0
+        stats = {"queries": 0, "db_seconds": 0.0, "phases": {}, "statements": [] if sampling else None}
+        token = _request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            _request.reset(token)
+            # Route templates keep the label set bounded; unmatched paths share one
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(seconds, scope["method"], route, str(status))
+            REQUEST_QUERIES.observe(stats["queries"], route)
+            REQUEST_DB_SECONDS.observe(stats["db_seconds"], route)
+            if sampling and seconds * 1000 >= settings.SLOW_REQUEST_MS:
+                _slow_requests.append({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query_string": scope.get("query_string", b"").decode("latin-1"),
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(seconds * 1000, 3),
+                    "db_ms": round(stats["db_seconds"] * 1000, 3),
+                    "queries": stats["queries"],
+                    "phases_ms": {phase: round(value * 1000, 3) for phase, value in stats["phases"].items()},
+                    "statements": stats["statements"],
+                    "at": time.time(),
+                })
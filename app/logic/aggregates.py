@@ -0,0 +1,272 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import delete, func, update
+from sqlmodel import Session, select
+from ..models import (
+    CompanyAggregate,
+    Fund,
+    FundAggregate,
+    PortfolioCompany,
+    Transaction,
+    TransactionType,
+    WaterfallAllocation,
+)
+from .money import CENTS, cents, round_cents, sum_cents, units
+import uuid
+
+# Stored vs recomputed values closer than this are considered equal (float sums)
+CONSISTENCY_TOLERANCE = 0.01
+
+FUND_TOTAL_COLUMNS = {
+    TransactionType.capital_call: "total_contributed",
+    TransactionType.distribution: "total_distributions",
+    TransactionType.management_fee: "total_fees",
+    TransactionType.other_fee: "total_fees",
+}
+
+COMPANY_TOTAL_COLUMNS = {
+    TransactionType.capital_call: "total_invested",
+    TransactionType.distribution: "realized_proceeds",
+}
+
+FUND_COLUMNS = [
+    "total_contributed",
+    "total_distributions",
+    "total_fees",
+    "fund_unrealized_value",
+    "lp_total_distributions",
+    "total_gp_carry",
+]
+
+COMPANY_COLUMNS = ["total_invested", "realized_proceeds", "unrealized_value", "moic"]
+
+def current_value(company: PortfolioCompany) -> float:
+    # The company's unrealized value from its current valuation
+    return (company.latest_post_money * company.ownership_pct) if (company.latest_post_money and company.ownership_pct) else 0
+
+def _moic(total_invested: float, realized_proceeds: float, unrealized_value: float) -> float:
+    return (realized_proceeds + unrealized_value) / total_invested if total_invested > 0 else 0
+
+# Full recompute
+
+def _expected_fund_aggregates(session: Session, fund_ids: Optional[List[uuid.UUID]] = None) -> Dict[uuid.UUID, dict]:
+    funds_stmt = select(Fund.id)
+    if fund_ids is not None:
+        funds_stmt = funds_stmt.where(Fund.id.in_(fund_ids))
+    expected = {fund_id: {column: 0.0 for column in FUND_COLUMNS} for fund_id in session.exec(funds_stmt).all()}
+    if not expected:
+        return expected
+    funds = list(expected)
+
+    # Sums in integer cents (money.py), converted once per total
+    totals_stmt = select(Transaction.fund_id, Transaction.tx_type, sum_cents(Transaction.amount)).where(
+        Transaction.fund_id.in_(funds)
+    ).group_by(Transaction.fund_id, Transaction.tx_type)
+    for fund_id, tx_type, total in session.exec(totals_stmt).all():
+        column = FUND_TOTAL_COLUMNS.get(TransactionType(tx_type))
+        if column:
+            # Both fee types land in total_fees; a sum of whole cents stays exact
+            expected[fund_id][column] = round(expected[fund_id][column] + total / CENTS, 2)
+
+    waterfall_stmt = select(
+        WaterfallAllocation.fund_id,
+        sum_cents(WaterfallAllocation.lp_distribution),
+        sum_cents(WaterfallAllocation.gp_distribution),
+    ).where(WaterfallAllocation.fund_id.in_(funds)).group_by(WaterfallAllocation.fund_id)
+    for fund_id, lp_total_distributions, total_gp_carry in session.exec(waterfall_stmt).all():
+        expected[fund_id]["lp_total_distributions"] = lp_total_distributions / CENTS
+        expected[fund_id]["total_gp_carry"] = total_gp_carry / CENTS
+
+    unrealized_stmt = select(
+        PortfolioCompany.fund_id,
+        sum_cents(PortfolioCompany.latest_post_money * PortfolioCompany.ownership_pct),
+    ).where(PortfolioCompany.fund_id.in_(funds)).group_by(PortfolioCompany.fund_id)
+    for fund_id, unrealized in session.exec(unrealized_stmt).all():
+        expected[fund_id]["fund_unrealized_value"] = unrealized / CENTS
+
+    return expected
+
+def _expected_company_aggregates(session: Session, fund_ids: Optional[List[uuid.UUID]] = None) -> Dict[uuid.UUID, dict]:
+    companies_stmt = select(
+        PortfolioCompany.id, PortfolioCompany.fund_id, PortfolioCompany.latest_post_money, PortfolioCompany.ownership_pct
+    )
+    totals_stmt = select(Transaction.company_id, Transaction.tx_type, sum_cents(Transaction.amount)).where(
+        Transaction.company_id.is_not(None)
+    ).group_by(Transaction.company_id, Transaction.tx_type)
+    if fund_ids is not None:
+        companies_stmt = companies_stmt.where(PortfolioCompany.fund_id.in_(fund_ids))
+        totals_stmt = totals_stmt.where(Transaction.fund_id.in_(fund_ids))
+
+    expected = {}
+    for company_id, fund_id, latest_post_money, ownership_pct in session.exec(companies_stmt).all():
+        expected[company_id] = {
+            "fund_id": fund_id,
+            "total_invested": 0.0,
+            "realized_proceeds": 0.0,
+            "unrealized_value": (latest_post_money * ownership_pct) if (latest_post_money and ownership_pct) else 0,
+        }
+    for company_id, tx_type, total in session.exec(totals_stmt).all():
+        column = COMPANY_TOTAL_COLUMNS.get(TransactionType(tx_type))
+        if column and company_id in expected:
+            expected[company_id][column] = total / CENTS
+
+    for row in expected.values():
+        row["moic"] = _moic(row["total_invested"], row["realized_proceeds"], row["unrealized_value"])
+    return expected
+
+def rebuild_aggregates(session: Session, fund_ids: Optional[List[uuid.UUID]] = None) -> int:
+    # Replaces the stored aggregates with a full recompute; the caller commits
+    fund_rows = _expected_fund_aggregates(session, fund_ids)
+    company_rows = _expected_company_aggregates(session, fund_ids)
+
+    fund_delete = delete(FundAggregate)
+    company_delete = delete(CompanyAggregate)
+    if fund_ids is not None:
+        fund_delete = fund_delete.where(FundAggregate.fund_id.in_(fund_ids))
+        company_delete = company_delete.where(CompanyAggregate.fund_id.in_(fund_ids))
+    session.exec(company_delete)
+    session.exec(fund_delete)
+
+    session.add_all([FundAggregate(fund_id=fund_id, **values) for fund_id, values in fund_rows.items()])
+    session.add_all([CompanyAggregate(company_id=company_id, **values) for company_id, values in company_rows.items()])
+    session.flush()
+    return len(fund_rows)
+
+def check_aggregates(session: Session, fund_ids: Optional[List[uuid.UUID]] = None) -> List[dict]:
+    # Differences between the stored aggregates and a full recompute
+    mismatches = []
+
+    def compare(table, key, stored, expected, columns):
+        if stored is None:
+            mismatches.append({"table": table, "id": key, "column": None, "stored": None, "expected": expected})
+            return
+        for column in columns:
+            stored_value = getattr(stored, column)
+            if abs(stored_value - expected[column]) > CONSISTENCY_TOLERANCE:
+                mismatches.append({
+                    "table": table, "id": key, "column": column,
+                    "stored": stored_value, "expected": expected[column],
+                })
+
+    stored_funds_stmt = select(FundAggregate)
+    stored_companies_stmt = select(CompanyAggregate)
+    if fund_ids is not None:
+        stored_funds_stmt = stored_funds_stmt.where(FundAggregate.fund_id.in_(fund_ids))
+        stored_companies_stmt = stored_companies_stmt.where(CompanyAggregate.fund_id.in_(fund_ids))
+    stored_funds = {row.fund_id: row for row in session.exec(stored_funds_stmt).all()}
+    stored_companies = {row.company_id: row for row in session.exec(stored_companies_stmt).all()}
+
+    for fund_id, expected in _expected_fund_aggregates(session, fund_ids).items():
+        compare(FundAggregate.__tablename__, fund_id, stored_funds.get(fund_id), expected, FUND_COLUMNS)
+    for company_id, expected in _expected_company_aggregates(session, fund_ids).items():
+        compare(CompanyAggregate.__tablename__, company_id, stored_companies.get(company_id), expected, COMPANY_COLUMNS)
+    return mismatches
+
+# Write-path maintenance. These run inside the writer's transaction, before
+# it commits; a missing row (data written before aggregates existed) falls
+# back to rebuilding that fund.
+
+def apply_transaction(session: Session, transaction: Transaction):
+    fund_column = FUND_TOTAL_COLUMNS.get(transaction.tx_type)
+    company_column = COMPANY_TOTAL_COLUMNS.get(transaction.tx_type)
+    if fund_column is None:
+        return
+    now = datetime.utcnow()
+
+    fund_result = session.exec(
+        update(FundAggregate)
+        .where(FundAggregate.fund_id == transaction.fund_id)
+        .values({fund_column: round_cents(getattr(FundAggregate, fund_column) + transaction.amount), "updated_at": now})
+    )
+    if fund_result.rowcount == 0:
+        rebuild_aggregates(session, [transaction.fund_id])
+        return
+
+    if company_column and transaction.company_id:
+        amount = transaction.amount
+        invested = round_cents(CompanyAggregate.total_invested + (amount if company_column == "total_invested" else 0))
+        proceeds = round_cents(CompanyAggregate.realized_proceeds + (amount if company_column == "realized_proceeds" else 0))
+        company_result = session.exec(
+            update(CompanyAggregate)
+            .where(CompanyAggregate.company_id == transaction.company_id)
+            .values({
+                company_column: invested if company_column == "total_invested" else proceeds,
+                "moic": func.coalesce((proceeds + CompanyAggregate.unrealized_value) / func.nullif(invested, 0), 0),
+                "updated_at": now,
+            })
+        )
+        if company_result.rowcount == 0:
+            rebuild_aggregates(session, [transaction.fund_id])
+
+def apply_company(session: Session, company: PortfolioCompany):
+    unrealized_value = current_value(company)
+    fund_result = session.exec(
+        update(FundAggregate)
+        .where(FundAggregate.fund_id == company.fund_id)
+        .values(
+            fund_unrealized_value=round_cents(FundAggregate.fund_unrealized_value + units(cents(unrealized_value))),
+            updated_at=datetime.utcnow(),
+        )
+    )
+    if fund_result.rowcount == 0:
+        rebuild_aggregates(session, [company.fund_id])
+        return
+    session.add(CompanyAggregate(
+        company_id=company.id,
+        fund_id=company.fund_id,
+        unrealized_value=unrealized_value,
+    ))
+
+def apply_mark(session: Session, company: PortfolioCompany, previous_value: float):
+    # After the company's current valuation changed from `previous_value`:
+    # the fund's unrealized value moves by the difference, the company's
+    # unrealized value and MOIC follow
+    unrealized_value = current_value(company)
+    now = datetime.utcnow()
+    fund_result = session.exec(
+        update(FundAggregate)
+        .where(FundAggregate.fund_id == company.fund_id)
+        .values(
+            fund_unrealized_value=round_cents(
+                FundAggregate.fund_unrealized_value + units(cents(unrealized_value) - cents(previous_value))
+            ),
+            updated_at=now,
+        )
+    )
+    if fund_result.rowcount == 0:
+        rebuild_aggregates(session, [company.fund_id])
+        return
+    company_result = session.exec(
+        update(CompanyAggregate)
+        .where(CompanyAggregate.company_id == company.id)
+        .values(
+            unrealized_value=unrealized_value,
+            moic=func.coalesce(
+                (CompanyAggregate.realized_proceeds + unrealized_value) / func.nullif(CompanyAggregate.total_invested, 0), 0
+            ),
+            updated_at=now,
+        )
+    )
+    if company_result.rowcount == 0:
+        rebuild_aggregates(session, [company.fund_id])
+
+def refresh_waterfall_totals(session: Session, fund_id: uuid.UUID):
+    # Called after the allocations for the fund have been rewritten
+    lp_cents, gp_cents = session.exec(
+        select(
+            sum_cents(WaterfallAllocation.lp_distribution),
+            sum_cents(WaterfallAllocation.gp_distribution),
+        ).where(WaterfallAllocation.fund_id == fund_id)
+    ).one()
+    lp_total_distributions, total_gp_carry = lp_cents / CENTS, gp_cents / CENTS
+    result = session.exec(
+        update(FundAggregate)
+        .where(FundAggregate.fund_id == fund_id)
+        .values(
+            lp_total_distributions=lp_total_distributions,
+            total_gp_carry=total_gp_carry,
+            updated_at=datetime.utcnow(),
+        )
+    )
+    if result.rowcount == 0:
+        rebuild_aggregates(session, [fund_id])
@@ -0,0 +1,257 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+import asyncio
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from ..config import settings
+
+# Results are cached under "<name>:<fund_id>:<version>". Every write to a fund
+# bumps its version, so stale entries simply stop being addressed and age out
+# of the LRU; there is no explicit invalidation pass.
+
+class CacheBackend(ABC):
+    # Storage behind MetricsCache. A backend shared between processes (the
+    # SQLite file below, or Redis later) lets several uvicorn workers see the
+    # same entries and, more importantly, the same fund versions.
+
+    @abstractmethod
+    def get(self, key: str) -> Tuple[bool, Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> int:
+        # Returns how many entries were evicted to make room
+        ...
+
+    @abstractmethod
+    def get_version(self, fund_id: uuid.UUID) -> int:
+        ...
+
+    @abstractmethod
+    def bump_version(self, fund_id: uuid.UUID) -> int:
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+class LocalBackend(CacheBackend):
+    # Per-process LRU; versions are only visible to this worker
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def set(self, key: str, value: Any) -> int:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def get_version(self, fund_id: uuid.UUID) -> int:
+        with self._lock:
+            return self._versions.get(fund_id, 0)
+
+    def bump_version(self, fund_id: uuid.UUID) -> int:
+        with self._lock:
+            self._versions[fund_id] = self._versions.get(fund_id, 0) + 1
+            return self._versions[fund_id]
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+class SQLiteBackend(CacheBackend):
+    # Shared LRU in a local SQLite file, usable by every worker on the host
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB, accessed_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries(accessed_at)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_versions (fund_id TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            self._conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return True, pickle.loads(row[0])
+
+    def set(self, key: str, value: Any) -> int:
+        blob = pickle.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, accessed_at) VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+            overflow = count - self.max_entries
+            if overflow <= 0:
+                return 0
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE key IN "
+                "(SELECT key FROM cache_entries ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            return overflow
+
+    def get_version(self, fund_id: uuid.UUID) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM cache_versions WHERE fund_id = ?", (str(fund_id),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, fund_id: uuid.UUID) -> int:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cache_versions (fund_id, version) VALUES (?, 1) "
+                "ON CONFLICT(fund_id) DO UPDATE SET version = version + 1",
+                (str(fund_id),),
+            )
+        return self.get_version(fund_id)
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries")
+            self._conn.execute("DELETE FROM cache_versions")
+
+class MetricsCache:
+    def __init__(self, backend: CacheBackend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        # Computations in flight (aget_or_compute), by key
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def version(self, fund_id: uuid.UUID) -> int:
+        return self.backend.get_version(fund_id)
+
+    def bump(self, fund_id: uuid.UUID) -> int:
+        return self.backend.bump_version(fund_id)
+
+    def _lookup(self, name: str, fund_id: uuid.UUID) -> Tuple[str, bool, Any]:
+        # Read the version before computing: if a write lands meanwhile the
+        # result is stored under the old version and never served again
+        key = f"{name}:{fund_id}:{self.version(fund_id)}"
+        found, value = self.backend.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return key, found, value
+
+    def _store(self, key: str, value: Any):
+        if value is None:
+            return
+        evicted = self.backend.set(key, value)
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def get_or_compute(self, name: str, fund_id: uuid.UUID, compute: Callable[[], Any]):
+        if not self.enabled:
+            return compute()
+        key, found, value = self._lookup(name, fund_id)
+        if found:
+            return value
+        value = compute()
+        self._store(key, value)
+        return value
+
+    async def aget_or_compute(self, name: str, fund_id: uuid.UUID, compute: Callable[[], Awaitable[Any]]):
+        # Concurrent misses on the same key (in this process) share the first
+        # one's computation instead of each running their own
+        if not self.enabled:
+            return await compute()
+        key, found, value = self._lookup(name, fund_id)
+        if found:
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            with self._lock:
+                self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request computing it was cancelled, not this one
+                return await compute()
+
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Retrieved here, so a failure nobody else waited for isn't logged
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            del self._pending[key]
+        self._store(key, value)
+        return value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "entries": self.backend.size(),
+        }
+
+def _create_backend() -> CacheBackend:
+    if settings.CACHE_BACKEND == "sqlite":
+        return SQLiteBackend(settings.CACHE_SQLITE_PATH, settings.CACHE_MAX_ENTRIES)
+    return LocalBackend(settings.CACHE_MAX_ENTRIES)
+
+metrics_cache = MetricsCache(_create_backend(), enabled=settings.CACHE_BACKEND != "none")
@@ -0,0 +1,41 @@
+from typing import Dict, List, Optional
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+from ..models import Fund
+import uuid
+
+# Per-fund change sequence. A write takes the fund's next number from
+# funds.change_seq and stamps it on every company, transaction and waterfall
+# allocation it inserts or updates, so "what changed since N" is a range
+# scan on (fund_id, change_seq) and N itself identifies the fund's state.
+#
+# The number comes from an UPDATE of the fund row, which stays locked until
+# the write commits: writes to a fund commit in sequence order, and once a
+# reader sees sequence N, every row stamped N or lower is visible too. Take
+# it after any slow work in the transaction, and before touching the
+# aggregates, so every writer locks in the same order. Waterfall recomputes
+# take it before reading their inputs instead: two of them (in different
+# processes) must not compute from the same stale state.
+
+def next_change_seq(session: Session, fund_id: uuid.UUID) -> int:
+    # 0 for an unknown fund; the write itself fails on its foreign key
+    stmt = update(Fund).where(Fund.id == fund_id).values(change_seq=Fund.change_seq + 1).returning(Fund.change_seq)
+    return session.execute(stmt).scalar() or 0
+
+def next_change_seqs(session: Session, fund_ids: List[uuid.UUID]) -> Dict[uuid.UUID, int]:
+    stmt = (
+        update(Fund)
+        .where(Fund.id.in_(fund_ids))
+        .values(change_seq=Fund.change_seq + 1)
+        .returning(Fund.id, Fund.change_seq)
+    )
+    return dict(session.execute(stmt).all())
+
+def current_change_seq(session: Session, fund_id: uuid.UUID) -> Optional[int]:
+    # None if the fund doesn't exist
+    return session.exec(select(Fund.change_seq).where(Fund.id == fund_id)).first()
+
+def funds_change_version(session: Session) -> str:
+    # Changes whenever a fund is added or any fund's sequence moves
+    count, total = session.exec(select(func.count(Fund.id), func.coalesce(func.sum(Fund.change_seq), 0))).one()
+    return f"{count}.{total}"
@@ -0,0 +1,133 @@
+from collections import defaultdict
+from datetime import date
+from typing import List, Optional
+import numpy as np
+from sqlmodel import Session, select
+from ..models import Fund, PortfolioCompany, Transaction, TransactionType
+from .irr import xirr_batch
+from .money import cents, sum_cents, units
+import uuid
+
+# Per-investment metrics (one company row = one investment) and the fund's
+# gross IRR. Gross means at the investment level, before fees and carry:
+# capital calls tagged with a company are paid in, distributions tagged with
+# it are proceeds, and the current mark is a terminal value dated today.
+# Totals are summed in integer cents (money.py).
+
+GROSS_TYPES = [TransactionType.capital_call, TransactionType.distribution]
+
+def _company_cashflows(
+    session: Session, fund_id: uuid.UUID, company_ids: Optional[List[uuid.UUID]] = None, as_of: Optional[date] = None
+):
+    # One grouped scan for every company of the fund: a row per
+    # (company, date, tx_type), already summed (in cents)
+    stmt = select(
+        Transaction.company_id,
+        Transaction.transaction_date,
+        Transaction.tx_type,
+        sum_cents(Transaction.amount),
+    ).where(
+        Transaction.fund_id == fund_id,
+        Transaction.company_id.is_not(None),
+        Transaction.tx_type.in_(GROSS_TYPES),
+    ).group_by(Transaction.company_id, Transaction.transaction_date, Transaction.tx_type)
+    if company_ids is not None:
+        stmt = stmt.where(Transaction.company_id.in_(company_ids))
+    if as_of is not None:
+        stmt = stmt.where(Transaction.transaction_date <= as_of)
+    return session.exec(stmt).all()
+
+def gross_cashflows(session: Session, fund_id: uuid.UUID, as_of: Optional[date] = None):
+    # The fund's gross series without the terminal value, for fund metrics
+    rows = _company_cashflows(session, fund_id, as_of=as_of)
+    dates = [transaction_date for _, transaction_date, _, _ in rows]
+    amounts = [_signed(tx_type, total) for _, _, tx_type, total in rows]
+    return dates, amounts
+
+def _signed(tx_type, total) -> float:
+    # Cents to a cashflow: paid in (capital call) negative, proceeds positive
+    amount = units(total)
+    return -amount if TransactionType(tx_type) == TransactionType.capital_call else amount
+
+def load_company_metrics_inputs(session: Session, fund_id: uuid.UUID, company_ids: Optional[List[uuid.UUID]] = None):
+    # Database phase: two queries whatever the number of companies
+    if not session.get(Fund, fund_id):
+        return None
+    companies_stmt = select(
+        PortfolioCompany.id,
+        PortfolioCompany.name,
+        PortfolioCompany.stage,
+        PortfolioCompany.status,
+        PortfolioCompany.latest_post_money,
+        PortfolioCompany.ownership_pct,
+    ).where(PortfolioCompany.fund_id == fund_id).order_by(PortfolioCompany.name, PortfolioCompany.id)
+    if company_ids is not None:
+        companies_stmt = companies_stmt.where(PortfolioCompany.id.in_(company_ids))
+
+    return {
+        "fund_id": fund_id,
+        "companies": session.exec(companies_stmt).all(),
+        "cashflows": _company_cashflows(session, fund_id, company_ids),
+    }
+
+def compute_company_metrics(inputs, as_of: Optional[date] = None):
+    # CPU phase: every company's gross IRR, plus the fund's, in one XIRR batch
+    if inputs is None:
+        return None
+    as_of = as_of or date.today()
+
+    invested = defaultdict(int)
+    proceeds = defaultdict(int)
+    series = defaultdict(lambda: ([], []))
+    for company_id, transaction_date, tx_type, total in inputs["cashflows"]:
+        if TransactionType(tx_type) == TransactionType.capital_call:
+            invested[company_id] += total
+        else:
+            proceeds[company_id] += total
+        amount = _signed(tx_type, total)
+        dates, amounts = series[company_id]
+        dates.append(transaction_date)
+        amounts.append(amount)
+
+    rows = []
+    fund_dates, fund_amounts = [], []
+    for company_id, name, stage, status, latest_post_money, ownership_pct in inputs["companies"]:
+        unrealized = cents(latest_post_money * ownership_pct) if (latest_post_money and ownership_pct) else 0
+        dates, amounts = series[company_id]
+        if unrealized > 0:
+            dates = dates + [as_of]
+            amounts = amounts + [units(unrealized)]
+        fund_dates += dates
+        fund_amounts += amounts
+        rows.append({
+            "company_id": company_id,
+            "name": name,
+            "stage": stage,
+            "status": status,
+            "total_invested": invested[company_id],
+            "realized_proceeds": proceeds[company_id],
+            "unrealized_value": unrealized,
+            "total_value": proceeds[company_id] + unrealized,
+            "dates": dates,
+            "amounts": amounts,
+        })
+
+    # The fund's gross series is all of its investments' flows together;
+    # it rides in the same batch as the last row
+    result = xirr_batch([(row.pop("dates"), row.pop("amounts")) for row in rows] + [(fund_dates, fund_amounts)])
+    rates = [float(rate) if np.isfinite(rate) else None for rate in result["rates"]]
+
+    for row, rate in zip(rows, rates):
+        row["moic"] = round(row["total_value"] / row["total_invested"], 3) if row["total_invested"] > 0 else 0
+        row["gross_irr"] = round(rate, 4) if rate is not None else None
+        for column in ("total_invested", "realized_proceeds", "unrealized_value", "total_value"):
+            row[column] = units(row[column])
+    return {
+        "fund_id": inputs["fund_id"],
+        "as_of": as_of,
+        "fund_gross_irr": round(rates[-1], 4) if rates[-1] is not None else None,
+        "companies": rows,
+    }
+
+def calculate_company_metrics(session: Session, fund_id: uuid.UUID, company_ids: Optional[List[uuid.UUID]] = None):
+    return compute_company_metrics(load_company_metrics_inputs(session, fund_id, company_ids))
@@ -0,0 +1,191 @@
+from enum import Enum
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from sqlmodel import Session
+from .. import crud
+from ..schemas import TransactionRead, WaterfallAllocationRead
+from .company_metrics import calculate_company_metrics
+from .metrics import calculate_fund_metrics
+
+# Fund exports (readme 8.6): CSV, XLSX or Parquet of a dataset, produced as
+# a stream of byte chunks. Row datasets come off a server-side cursor
+# (crud.stream_*) and every writer works in batches, so memory stays flat
+# however long the history is.
+
+CSV = "csv"
+XLSX = "xlsx"
+PARQUET = "parquet"
+
+MEDIA_TYPES = {
+    CSV: "text/csv; charset=utf-8",
+    XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    PARQUET: "application/vnd.apache.parquet",
+}
+
+# Rows per CSV chunk / Parquet row group
+EXPORT_BATCH_SIZE = 10_000
+# Excel's sheet limit, less the header row; longer exports continue on a new sheet
+XLSX_MAX_ROWS = 1_048_575
+# Bytes per chunk when streaming the finished XLSX file
+FILE_CHUNK_SIZE = 1 << 20
+
+def _stream_rows(stream: Callable[..., Iterator[dict]], schema):
+    def rows(session: Session, fund_id: uuid.UUID):
+        return list(schema.model_fields), (tuple(row.values()) for row in stream(session, fund_id))
+    return rows
+
+def _metrics_rows(session: Session, fund_id: uuid.UUID):
+    metrics = calculate_fund_metrics(session, fund_id) or {}
+    return list(metrics), [tuple(metrics.values())] if metrics else []
+
+def _investment_rows(session: Session, fund_id: uuid.UUID):
+    companies = (calculate_company_metrics(session, fund_id) or {}).get("companies", [])
+    columns = list(companies[0]) if companies else ["company_id"]
+    return columns, (tuple(company.values()) for company in companies)
+
+# dataset -> (session, fund_id) -> (column names, row tuples)
+DATASETS: Dict[str, Callable[[Session, uuid.UUID], Tuple[List[str], Iterable[tuple]]]] = {
+    "transactions": _stream_rows(crud.stream_transactions, TransactionRead),
+    "waterfall": _stream_rows(crud.stream_waterfall, WaterfallAllocationRead),
+    "investments": _investment_rows,
+    "metrics": _metrics_rows,
+}
+
+def _json(value) -> str:
+    return json.dumps(value, default=str)
+
+def _converter(values: list) -> Optional[Callable]:
+    # One representation per type for every format, picked once per column;
+    # JSON columns stay JSON so a CSV export can be fed back to the bulk
+    # transaction import
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, Enum):
+        return lambda value: value.value
+    if isinstance(sample, uuid.UUID):
+        return str
+    if isinstance(sample, (dict, list)):
+        return _json
+    return None
+
+def _batches(rows: Iterable[tuple]) -> Iterator[List[list]]:
+    # Column lists of up to EXPORT_BATCH_SIZE rows
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, EXPORT_BATCH_SIZE))
+        if not batch:
+            return
+        columns = [list(values) for values in zip(*batch)]
+        for i, values in enumerate(columns):
+            convert = _converter(values)
+            if convert is not None:
+                columns[i] = [None if value is None else convert(value) for value in values]
+        yield columns
+
+def csv_chunks(columns: Sequence[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in _batches(rows):
+        writer.writerows(zip(*batch))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def xlsx_chunks(columns: Sequence[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    # XLSX is a zip, so the workbook is written to a temporary file first;
+    # constant_memory flushes each row to disk as soon as it is complete
+    import xlsxwriter
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "export.xlsx")
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "default_date_format": "yyyy-mm-dd"})
+        sheet = None
+        row_number = XLSX_MAX_ROWS
+        for batch in _batches(rows):
+            for row in zip(*batch):
+                if row_number >= XLSX_MAX_ROWS:
+                    sheet = workbook.add_worksheet()
+                    sheet.write_row(0, 0, columns)
+                    row_number = 0
+                row_number += 1
+                sheet.write_row(row_number, 0, row)
+        if sheet is None:
+            workbook.add_worksheet().write_row(0, 0, columns)
+        workbook.close()
+
+        with open(path, "rb") as f:
+            while chunk := f.read(FILE_CHUNK_SIZE):
+                yield chunk
+
+class _Drain(io.RawIOBase):
+    # Write-only file that hands over whatever was written since the last take()
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_chunks(columns: Sequence[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    # One row group per batch. The schema is taken from the first batch
+    # (all-empty columns as strings) and later batches are cast to it.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Drain()
+    writer = None
+    for batch in _batches(rows):
+        table = pa.Table.from_pydict(dict(zip(columns, batch)))
+        if writer is None:
+            schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema
+            ])
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(table.cast(writer.schema))
+        yield sink.take()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, pa.schema([(column, pa.string()) for column in columns]))
+    writer.close()
+    yield sink.take()
+
+WRITERS = {CSV: csv_chunks, XLSX: xlsx_chunks, PARQUET: parquet_chunks}
+
+def export_chunks(session: Session, fund_id: uuid.UUID, dataset: str, fmt: str) -> Iterator[bytes]:
+    columns, rows = DATASETS[dataset](session, fund_id)
+    return WRITERS[fmt](columns, rows)
+
+def export_to_file(session: Session, fund_id: uuid.UUID, dataset: str, fmt: str, path: str) -> int:
+    # Returns the bytes written
+    written = 0
+    with open(path, "wb") as f:
+        for chunk in export_chunks(session, fund_id, dataset, fmt):
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+def export_filename(fund_code: Optional[str], fund_id: uuid.UUID, dataset: str, fmt: str) -> str:
+    # fund_code is not unique, so the id is always part of the name
+    stem = f"{fund_code}_{str(fund_id)[:8]}" if fund_code else str(fund_id)
+    stem = "".join(c if c.isalnum() or c in "-_" else "_" for c in stem)
+    return f"{stem}-{dataset}.{fmt}"
@@ -0,0 +1,249 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+from ..models import Fund, Transaction, TransactionType
+from .aggregates import rebuild_aggregates
+from .cache import metrics_cache
+from .changes import next_change_seqs
+from .ingest import BULK_INSERT_CHUNK_SIZE
+from .money import from_cents, sum_cents, to_cents
+from .valuations import MarkIndex, as_days, load_marks, running_totals_at
+import uuid
+
+# Quarterly management fees for every fund, computed in one vectorized pass
+# over (fund x quarter) and posted as management_fee transactions.
+#
+# Quarters run from fund_start_date for fund_tenor_years, and each fee is
+# charged in advance on the quarter's first day: management_fee_pct / 4 of
+# the fund's fee basis on that day. fee_calc_method picks the basis:
+#   committed  total_commitment
+#   called     capital called so far
+#   nav        the companies' values that day (valuation marks, valuations.py)
+# After the investment period the fee steps down, configured per fund in
+# Fund.extra_metadata["fees"], e.g.
+#   {"step_down_pct": 0.015, "step_down_basis": "called"}
+# Without it the rate stays and a committed basis moves to called capital.
+#
+# Generated fees carry a FEE_REFERENCE_PREFIX reference, so a run only posts
+# the quarters not posted before; fees entered by hand are left alone, and
+# a quarter already posted keeps its amount. Their ids are derived from
+# (fund, quarter) as well: when two runs race each other the second one
+# skips the quarters the first has posted instead of inserting them again.
+
+FEE_BASES = ("committed", "called", "nav")
+DEFAULT_STEP_DOWN_BASIS = {"committed": "called", "called": "called", "nav": "nav"}
+QUARTERS_PER_YEAR = 4
+# Namespace of the generated fee transaction ids (uuid5 of fund and quarter start)
+FEE_ID_NAMESPACE = uuid.UUID("6f1c2d0e-8a4b-4f5e-9c3d-2b7a1e0f4d21")
+FEE_REFERENCE_PREFIX = "fee-schedule:"
+
+SCHEDULE_COLUMNS = [
+    "fund_id", "quarter", "period_start", "period_end", "stepped_down",
+    "basis", "basis_amount", "rate", "amount", "posted",
+]
+
+def fee_transaction_id(fund_id: uuid.UUID, period_start: date) -> uuid.UUID:
+    return uuid.uuid5(FEE_ID_NAMESPACE, f"{fund_id}:{period_start.isoformat()}")
+
+def _step_down(fund_id: uuid.UUID, fee_calc_method: str, management_fee_pct: float, extra_metadata: Optional[dict]):
+    config = (extra_metadata or {}).get("fees") or {}
+    rate = config.get("step_down_pct")
+    basis = config.get("step_down_basis") or DEFAULT_STEP_DOWN_BASIS.get(fee_calc_method)
+    if basis not in FEE_BASES:
+        raise ValueError(f"Fund {fund_id}: unsupported step_down_basis {basis!r}")
+    return (management_fee_pct if rate is None else float(rate)), basis
+
+def load_fee_inputs(session: Session, fund_ids: Optional[List[uuid.UUID]] = None):
+    # Database phase: set-based queries for every requested fund; calls come
+    # summed per fund and day, in cents
+    funds_stmt = select(
+        Fund.id,
+        Fund.fund_start_date,
+        Fund.fund_tenor_years,
+        Fund.investment_period_years,
+        Fund.total_commitment,
+        Fund.management_fee_pct,
+        Fund.fee_calc_method,
+        Fund.extra_metadata,
+    )
+    if fund_ids is not None:
+        funds_stmt = funds_stmt.where(Fund.id.in_(fund_ids))
+    funds = pd.DataFrame(session.exec(funds_stmt).all(), columns=[
+        "fund_id", "fund_start_date", "fund_tenor_years", "investment_period_years",
+        "total_commitment", "management_fee_pct", "fee_calc_method", "extra_metadata",
+    ])
+    if funds.empty:
+        return None
+    ids = funds["fund_id"].tolist()
+
+    calls = pd.DataFrame(session.exec(
+        select(Transaction.fund_id, Transaction.transaction_date, sum_cents(Transaction.amount)).where(
+            Transaction.fund_id.in_(ids), Transaction.tx_type == TransactionType.capital_call
+        ).group_by(Transaction.fund_id, Transaction.transaction_date)
+    ).all(), columns=["fund_id", "date", "cents"])
+
+    # Quarters posted by earlier runs, by fund and fee date
+    posted = pd.DataFrame(session.exec(
+        select(Transaction.fund_id, Transaction.transaction_date).where(
+            Transaction.fund_id.in_(ids),
+            Transaction.tx_type == TransactionType.management_fee,
+            Transaction.reference.startswith(FEE_REFERENCE_PREFIX),
+        )
+    ).all(), columns=["fund_id", "date"])
+
+    return {"funds": funds, "calls": calls, "marks": load_marks(session, ids), "posted": posted}
+
+def compute_fee_schedule(inputs, through: Optional[date] = None) -> pd.DataFrame:
+    # CPU phase: every fund's quarters that start on or before `through`
+    # (default today), as a frame in SCHEDULE_COLUMNS; amounts in units
+    if inputs is None:
+        return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+    through = np.datetime64(through or date.today(), "D")
+    funds = inputs["funds"]
+    methods = funds["fee_calc_method"].to_numpy(dtype=object)
+    unsupported = ~np.isin(methods, FEE_BASES)
+    if unsupported.any():
+        raise ValueError(f"Unsupported fee_calc_method for funds: {', '.join(str(i) for i in funds['fund_id'][unsupported])}")
+    step_downs = [
+        _step_down(fund_id, method, pct, extra_metadata)
+        for fund_id, method, pct, extra_metadata in zip(
+            funds["fund_id"], methods, funds["management_fee_pct"], funds["extra_metadata"]
+        )
+    ]
+
+    # (fund x quarter) grid, one row per quarter of each fund's tenor
+    quarters_per_fund = np.maximum(funds["fund_tenor_years"].to_numpy(dtype=np.int64), 0) * QUARTERS_PER_YEAR
+    fund_index = np.repeat(np.arange(len(funds)), quarters_per_fund)
+    quarter = np.arange(len(fund_index)) - np.repeat(np.cumsum(quarters_per_fund) - quarters_per_fund, quarters_per_fund)
+
+    # Quarter k starts 3k months after the fund, on the same day of the
+    # month or the month's last day if it is shorter (Nov 30 -> Feb 28)
+    start = as_days(funds["fund_start_date"])
+    day_of_month = (start - start.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64)
+
+    def quarter_start(k: np.ndarray) -> np.ndarray:
+        month = start.astype("datetime64[M]")[fund_index] + 3 * k
+        month_end = (month + 1).astype("datetime64[D]") - 1
+        return np.minimum(month.astype("datetime64[D]") + day_of_month[fund_index], month_end)
+
+    period_start = quarter_start(quarter)
+    period_end = quarter_start(quarter + 1) - 1
+    due = period_start <= through
+    fund_index, quarter, period_start, period_end = fund_index[due], quarter[due], period_start[due], period_end[due]
+
+    stepped_down = quarter >= funds["investment_period_years"].to_numpy(dtype=np.int64)[fund_index] * QUARTERS_PER_YEAR
+    rate = np.where(
+        stepped_down,
+        np.array([rate for rate, _ in step_downs], dtype=float)[fund_index],
+        funds["management_fee_pct"].to_numpy(dtype=float)[fund_index],
+    )
+    basis = np.where(stepped_down, np.array([basis for _, basis in step_downs], dtype=object)[fund_index], methods[fund_index])
+
+    # Each basis as of every quarter start, in cents; the row picks its own
+    fund_positions = pd.Index(funds["fund_id"])
+    calls = inputs["calls"]
+    called = running_totals_at(
+        fund_positions.get_indexer(calls["fund_id"]),
+        as_days(calls["date"]),
+        calls["cents"].to_numpy(dtype=np.int64),
+        fund_index,
+        period_start,
+    )
+    nav = MarkIndex(inputs["marks"]).fund_nav(funds["fund_id"].to_numpy(dtype=object)[fund_index], period_start)
+    committed = to_cents(funds["total_commitment"].to_numpy(dtype=float))[fund_index]
+    basis_cents = np.select([basis == "committed", basis == "called", basis == "nav"], [committed, called, nav]).astype(np.int64)
+    amount_cents = np.rint(basis_cents * rate / QUARTERS_PER_YEAR).astype(np.int64)
+
+    posted = pd.MultiIndex.from_arrays([fund_index, period_start]).isin(pd.MultiIndex.from_arrays([
+        fund_positions.get_indexer(inputs["posted"]["fund_id"]), as_days(inputs["posted"]["date"]),
+    ]))
+
+    return pd.DataFrame({
+        "fund_id": funds["fund_id"].to_numpy(dtype=object)[fund_index],
+        "quarter": quarter + 1,
+        "period_start": period_start.astype(object),
+        "period_end": period_end.astype(object),
+        "stepped_down": stepped_down,
+        "basis": basis,
+        "basis_amount": from_cents(basis_cents),
+        "rate": rate,
+        "amount": from_cents(amount_cents),
+        "posted": posted,
+    }, columns=SCHEDULE_COLUMNS)
+
+def _insert_ignoring_duplicates(session: Session):
+    # INSERT ... ON CONFLICT (id) DO NOTHING RETURNING id, so the rows
+    # actually written can be counted
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(Transaction).on_conflict_do_nothing(index_elements=["id"]).returning(Transaction.id)
+
+def post_fee_schedule(session: Session, schedule: pd.DataFrame) -> Tuple[int, int]:
+    # Inserts the quarters not posted yet (zero fees are skipped, so a
+    # quarter with no basis yet is picked up if calls are backdated into it),
+    # commits and marks them posted in `schedule`. Returns (inserted, skipped):
+    # skipped are the quarters another run posted after the schedule was read
+    if schedule.empty:
+        return 0, 0
+    unposted = ~schedule["posted"].astype(bool) & (schedule["amount"] > 0)
+    pending = schedule[unposted]
+    if pending.empty:
+        return 0, 0
+    fund_ids = list(dict.fromkeys(pending["fund_id"]))
+    # One change per fund for the whole run (logic/changes.py)
+    change_seqs = next_change_seqs(session, fund_ids)
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            "id": fee_transaction_id(row.fund_id, row.period_start),
+            "fund_id": row.fund_id,
+            "company_id": None,
+            "transaction_date": row.period_start,
+            "amount": float(row.amount),
+            "tx_type": TransactionType.management_fee,
+            "reference": f"{FEE_REFERENCE_PREFIX}{row.period_start.isoformat()}",
+            "extra_metadata": {"fee_schedule": {
+                "quarter": int(row.quarter),
+                "period_end": row.period_end.isoformat(),
+                "basis": row.basis,
+                "basis_amount": float(row.basis_amount),
+                "rate": float(row.rate),
+            }},
+            "created_at": created_at + timedelta(microseconds=i),
+            "updated_at": created_at + timedelta(microseconds=i),
+            "change_seq": change_seqs.get(row.fund_id, 0),
+        }
+        for i, row in enumerate(pending.itertuples(index=False))
+    ]
+    # The change_seq bump above locks the funds, so a concurrent run waits
+    # here for this one to commit and then finds its ids taken
+    statement = _insert_ignoring_duplicates(session)
+    inserted = 0
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        inserted += len(session.execute(statement, rows[start:start + BULK_INSERT_CHUNK_SIZE]).all())
+    schedule.loc[unposted, "posted"] = True
+    if not inserted:
+        session.rollback()
+        return 0, len(rows)
+
+    # Fees are outside the waterfall, so only the aggregates need refreshing
+    rebuild_aggregates(session, fund_ids)
+    session.commit()
+    for fund_id in fund_ids:
+        metrics_cache.bump(fund_id)
+    return inserted, len(rows) - inserted
+
+def generate_management_fees(
+    session: Session,
+    fund_ids: Optional[List[uuid.UUID]] = None,
+    through: Optional[date] = None,
+    dry_run: bool = False,
+) -> Tuple[pd.DataFrame, int, int]:
+    # The schedule for the requested funds (all by default) and the numbers of
+    # fee transactions posted from it and skipped as already posted by a
+    # concurrent run; nothing is written with dry_run
+    schedule = compute_fee_schedule(load_fee_inputs(session, fund_ids), through)
+    inserted, skipped = (0, 0) if dry_run else post_fee_schedule(session, schedule)
+    return schedule, inserted, skipped
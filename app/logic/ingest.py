@@ -0,0 +1,66 @@
+import csv
+import json
+from typing import Iterable, Iterator, Optional, Union
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+# Rows per executemany INSERT when writing in bulk (transaction uploads,
+# generated fees, synthetic data)
+BULK_INSERT_CHUNK_SIZE = 1000
+
+_CONTENT_TYPES = {
+    "text/csv": CSV,
+    "application/csv": CSV,
+    "application/x-ndjson": NDJSON,
+    "application/ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+    "application/x-jsonlines": NDJSON,
+}
+
+_EXTENSIONS = {
+    ".csv": CSV,
+    ".ndjson": NDJSON,
+    ".jsonl": NDJSON,
+}
+
+def detect_format(content_type: Optional[str], filename: Optional[str] = None) -> Optional[str]:
+    if filename:
+        for extension, fmt in _EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                return fmt
+    if content_type:
+        return _CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+    return None
+
+def _csv_rows(lines: Iterable[str]) -> Iterator[Union[dict, ValueError]]:
+    for record in csv.DictReader(lines):
+        # Empty cells mean "not provided" so schema defaults apply
+        row = {key: value for key, value in record.items() if key and value not in (None, "")}
+        if "extra_metadata" in row:
+            try:
+                row["extra_metadata"] = json.loads(row["extra_metadata"])
+            except ValueError:
+                yield ValueError("extra_metadata is not valid JSON")
+                continue
+        yield row
+
+def _ndjson_rows(lines: Iterable[str]) -> Iterator[Union[dict, ValueError]]:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield ValueError(f"Invalid JSON: {exc}")
+            continue
+        yield row if isinstance(row, dict) else ValueError("Expected a JSON object")
+
+def parse_rows(lines: Iterable[str], fmt: str) -> Iterator[Union[dict, ValueError]]:
+    # Decoded rows in upload order; rows that cannot be decoded are yielded as
+    # the ValueError describing why, so they keep their place in the row count.
+    if fmt == CSV:
+        return _csv_rows(lines)
+    if fmt == NDJSON:
+        return _ndjson_rows(lines)
+    raise ValueError(f"Unsupported format: {fmt}")
@@ -0,0 +1,164 @@
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from ..instrumentation import timed
+
+# Batch XIRR: many cash flow series solved together on a padded
+# (series x cashflow) layout. Padding cells carry a zero amount, so they add
+# nothing to the NPV. Every series gets a status instead of a bare None.
+
+CONVERGED = "converged"            # Newton converged
+BISECTED = "bisected"              # Newton failed, bracketed bisection converged
+TOO_FEW_CASHFLOWS = "too_few_cashflows"
+NO_SIGN_CHANGE = "no_sign_change"  # all flows on one side: no IRR exists
+NO_ROOT_FOUND = "no_root_found"    # no bracket with a sign change on the rate grid
+
+SOLVED = (CONVERGED, BISECTED)
+
+# Same day count as pyxirr / Excel XIRR
+DAYS_PER_YEAR = 365.0
+DEFAULT_GUESS = 0.1
+TOLERANCE = 1e-12
+NEWTON_MAX_ITER = 50
+BISECTION_MAX_ITER = 200
+
+# Rates probed for a sign change when Newton fails, lowest first. The top
+# end covers very short holds: 10x in ten days is an IRR of about 3e36.
+BRACKET_GRID = np.array([
+    -0.9999, -0.999, -0.99, -0.95, -0.9, -0.75, -0.5, -0.25, 0.0, 0.1, 0.25, 0.5,
+    1.0, 2.0, 5.0, 10.0, 100.0, 1e3, 1e4, 1e6, 1e9, 1e12, 1e18, 1e25, 1e35, 1e50, 1e75, 1e100,
+])
+LOG_RATE_BOUNDS = np.log1p(BRACKET_GRID[[0, -1]])
+
+def _npv(rates: np.ndarray, times: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    with np.errstate(all="ignore"):
+        return (amounts * (1.0 + rates[:, None]) ** -times).sum(axis=1)
+
+def _newton(times, amounts, rates, tol, max_iter):
+    # Newton on x = log(1 + rate): NPV(x) = sum(amount * exp(-t * x)) keeps
+    # every iterate inside the domain and needs exp rather than pow.
+    # Returns the final rates, a converged mask and the iterations used per row.
+    x = np.log1p(rates)
+    converged = np.zeros(len(rates), dtype=bool)
+    iterations = np.zeros(len(rates), dtype=np.int64)
+    active = np.arange(len(rates))
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        active_times = times[active]
+        with np.errstate(all="ignore"):
+            discounted = amounts[active] * np.exp(-active_times * x[active, None])
+            step = discounted.sum(axis=1) / -(active_times * discounted).sum(axis=1)
+        updated = x[active] - step
+        iterations[active] += 1
+
+        # A non-finite step (overflow, flat NPV) or an iterate running off past
+        # the bracket grid (NPV creeping towards an asymptote) ends that row's
+        # Newton run; bisection takes over
+        usable = np.isfinite(updated) & (updated >= LOG_RATE_BOUNDS[0]) & (updated <= LOG_RATE_BOUNDS[1])
+        done = usable & (np.abs(step) <= tol * np.maximum(1.0, np.abs(updated)))
+        x[active[usable]] = updated[usable]
+        converged[active[done]] = True
+        active = active[usable & ~done]
+    with np.errstate(over="ignore"):
+        return np.expm1(x), converged, iterations
+
+def _bisect(times, amounts, tol, max_iter):
+    # Bracket the lowest sign change of the NPV on BRACKET_GRID, then bisect.
+    # Returns the rates (NaN where no bracket exists) and a found mask.
+    values = np.stack([_npv(np.full(len(times), rate), times, amounts) for rate in BRACKET_GRID], axis=1)
+    with np.errstate(invalid="ignore"):
+        crossing = np.isfinite(values[:, :-1]) & np.isfinite(values[:, 1:]) & (np.sign(values[:, :-1]) != np.sign(values[:, 1:]))
+    found = crossing.any(axis=1)
+    first = crossing.argmax(axis=1)
+
+    low = BRACKET_GRID[first]
+    high = BRACKET_GRID[first + 1]
+    low_value = values[np.arange(len(times)), first]
+    for _ in range(max_iter):
+        mid = (low + high) / 2
+        mid_value = _npv(mid, times, amounts)
+        same_side = np.sign(mid_value) == np.sign(low_value)
+        low = np.where(same_side, mid, low)
+        low_value = np.where(same_side, mid_value, low_value)
+        high = np.where(same_side, high, mid)
+        if np.all(~found | (high - low <= tol * np.maximum(1.0, np.abs(low)))):
+            break
+    return np.where(found, (low + high) / 2, np.nan), found
+
+@timed("xirr")
+def solve_padded(
+    times: np.ndarray,
+    amounts: np.ndarray,
+    guess=DEFAULT_GUESS,
+    tol: float = TOLERANCE,
+    max_iter: int = NEWTON_MAX_ITER,
+):
+    # `times` are year fractions from any common origin (XIRR does not depend
+    # on it) and `amounts` the flows, both (series x cashflows) with padding
+    # cells set to zero. `guess` is a scalar or one starting rate per series.
+    # Returns {"rates", "status", "iterations"}, one entry per series, with
+    # NaN rates for every series that is not CONVERGED or BISECTED.
+    times = np.asarray(times, dtype=float)
+    amounts = np.asarray(amounts, dtype=float)
+    n = len(amounts)
+    rates = np.full(n, np.nan)
+    status = np.full(n, NO_ROOT_FOUND, dtype=object)
+    iterations = np.zeros(n, dtype=np.int64)
+
+    flows = (amounts != 0).sum(axis=1)
+    has_inflow = (amounts > 0).any(axis=1)
+    has_outflow = (amounts < 0).any(axis=1)
+    status[~(has_inflow & has_outflow)] = NO_SIGN_CHANGE
+    status[flows < 2] = TOO_FEW_CASHFLOWS
+    solvable = np.flatnonzero(has_inflow & has_outflow & (flows >= 2))
+    if not len(solvable):
+        return {"rates": rates, "status": status, "iterations": iterations}
+
+    start = np.broadcast_to(np.asarray(guess, dtype=float), (n,))[solvable].copy()
+    start[~np.isfinite(start) | (start <= -1.0)] = DEFAULT_GUESS
+    newton_rates, converged, newton_iterations = _newton(times[solvable], amounts[solvable], start, tol, max_iter)
+    rates[solvable[converged]] = newton_rates[converged]
+    status[solvable[converged]] = CONVERGED
+    iterations[solvable] = newton_iterations
+
+    retry = solvable[~converged]
+    if len(retry):
+        bisected, found = _bisect(times[retry], amounts[retry], tol, BISECTION_MAX_ITER)
+        rates[retry[found]] = bisected[found]
+        status[retry[found]] = BISECTED
+    return {"rates": rates, "status": status, "iterations": iterations}
+
+def _day_numbers(dates) -> np.ndarray:
+    if isinstance(dates, np.ndarray):
+        return dates.astype("datetime64[D]").astype(np.int64)
+    # date.toordinal() is far cheaper than numpy's per-object datetime parsing
+    return np.fromiter((d.toordinal() for d in dates), dtype=np.int64, count=len(dates))
+
+def pad_series(series: Sequence[Tuple[Sequence, Sequence[float]]]):
+    # Ragged [(dates, amounts), ...] -> padded (times, amounts) in years
+    lengths = np.array([len(amounts) for _, amounts in series], dtype=np.int64)
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    days = np.concatenate([_day_numbers(dates) for dates, _ in series] or [np.empty(0, dtype=np.int64)])
+    flat_amounts = np.concatenate([np.asarray(amounts, dtype=float) for _, amounts in series] or [np.empty(0)])
+
+    rows = np.repeat(np.arange(len(series)), lengths)
+    columns = np.arange(len(flat_amounts)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    times = np.zeros((len(series), width))
+    padded = np.zeros((len(series), width))
+    if len(days):
+        # Each series is measured from its own first date to keep exponents small
+        origin = np.full(len(series), np.iinfo(np.int64).max)
+        np.minimum.at(origin, rows, days)
+        times[rows, columns] = (days - origin[rows]) / DAYS_PER_YEAR
+        padded[rows, columns] = flat_amounts
+    return times, padded
+
+def xirr_batch(series: Sequence[Tuple[Sequence, Sequence[float]]], guess=DEFAULT_GUESS):
+    times, amounts = pad_series(series)
+    return solve_padded(times, amounts, guess=guess)
+
+def xirr(dates: Sequence, amounts: Sequence[float], guess: Optional[float] = None) -> Tuple[Optional[float], str]:
+    # Single series convenience wrapper: (rate or None, status)
+    result = xirr_batch([(dates, amounts)], guess=DEFAULT_GUESS if guess is None else guess)
+    rate = result["rates"][0]
+    return (float(rate) if np.isfinite(rate) else None), result["status"][0]
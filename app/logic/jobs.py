@@ -0,0 +1,287 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, List, Optional
+import threading
+import uuid
+from sqlmodel import Session
+from ..config import settings
+from .waterfall import recompute_waterfall
+
+# Background recomputes (the readme's "Waterfall Job"). A write commits,
+# enqueues a recompute of its fund and returns; worker threads bring the
+# waterfall up to date afterwards. Aggregates are still maintained in the
+# write transaction itself (cheap increments), only the waterfall moves here.
+#
+# Jobs coalesce per fund: while a fund's job is still queued, later writes
+# fold into it (earliest replay date, capital change, full rebuild wins), so
+# a burst of distributions costs one recompute. A fund never has two jobs
+# running at once.
+#
+# Each fund has two counters: the requested version (bumped by every
+# enqueued write) and the computed version (the requested version the last
+# successful job covered). Results are fresh when the two are equal.
+#
+# A failed job may leave the waterfall half-updated, so the fund's next job is
+# a full rebuild: the queued one if a write is waiting, otherwise a retry
+# queued right away. A failed full rebuild is not retried (it would most
+# likely fail the same way); the fund stays stale, and its next write queues
+# another full rebuild.
+
+WATERFALL = "waterfall"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class JobBackend(ABC):
+    # Queue and job state behind JobQueue. The in-process backend below
+    # coalesces within one server process; a shared backend (Redis later)
+    # would coalesce across workers and let any process report status.
+
+    @abstractmethod
+    def enqueue(self, fund_id: uuid.UUID, since: Optional[date], capital_changed: bool, full: bool) -> dict:
+        # Folds into the fund's queued job if there is one
+        ...
+
+    @abstractmethod
+    def claim(self, fund_id: Optional[uuid.UUID] = None, timeout: Optional[float] = None) -> Optional[dict]:
+        # The oldest queued job (of `fund_id`, if given) whose fund has no
+        # job running; None if there is none within `timeout` seconds
+        ...
+
+    @abstractmethod
+    def finish(self, job_id: uuid.UUID, error: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def get(self, job_id: uuid.UUID) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def fund_status(self, fund_id: uuid.UUID) -> dict:
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+class LocalJobBackend(JobBackend):
+    def __init__(self, history: int):
+        self.history = history
+        # Every job still queued or running, then the last `history` finished ones
+        self._jobs: "OrderedDict[uuid.UUID, dict]" = OrderedDict()
+        self._queued: Dict[uuid.UUID, dict] = {}
+        self._running: Dict[uuid.UUID, uuid.UUID] = {}
+        self._requested: Dict[uuid.UUID, int] = {}
+        self._computed: Dict[uuid.UUID, int] = {}
+        # Funds whose last job failed: the waterfall may be half-updated, so
+        # their next job is a full rebuild
+        self._rebuild = set()
+        self._coalesced = 0
+        self._cond = threading.Condition()
+
+    def _queue(self, fund_id: uuid.UUID, since: Optional[date], capital_changed: bool, full: bool, version: int, writes: int) -> dict:
+        job = {
+            "id": uuid.uuid4(),
+            "kind": WATERFALL,
+            "fund_id": fund_id,
+            "status": QUEUED,
+            "since": since,
+            "capital_changed": capital_changed,
+            "full": full,
+            "version": version,
+            "writes": writes,
+            "enqueued_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        self._queued[fund_id] = self._jobs[job["id"]] = job
+        self._cond.notify()
+        return job
+
+    def enqueue(self, fund_id: uuid.UUID, since: Optional[date], capital_changed: bool, full: bool) -> dict:
+        with self._cond:
+            version = self._requested[fund_id] = self._requested.get(fund_id, 0) + 1
+            job = self._queued.get(fund_id)
+            if job is None:
+                job = self._queue(fund_id, since, capital_changed, full or fund_id in self._rebuild, version, 1)
+                self._rebuild.discard(fund_id)
+            else:
+                if since is not None:
+                    job["since"] = since if job["since"] is None else min(job["since"], since)
+                job["capital_changed"] = job["capital_changed"] or capital_changed
+                job["full"] = job["full"] or full
+                job["version"] = version
+                job["writes"] += 1
+                self._coalesced += 1
+            return dict(job)
+
+    def _next(self, fund_id: Optional[uuid.UUID]) -> Optional[dict]:
+        if fund_id is not None:
+            job = self._queued.get(fund_id)
+            return job if fund_id not in self._running else None
+        # _queued keeps insertion order, so this is the oldest runnable job
+        return next((job for fund, job in self._queued.items() if fund not in self._running), None)
+
+    def claim(self, fund_id: Optional[uuid.UUID] = None, timeout: Optional[float] = None) -> Optional[dict]:
+        with self._cond:
+            job = self._next(fund_id)
+            if job is None and timeout:
+                self._cond.wait_for(lambda: self._next(fund_id) is not None, timeout)
+                job = self._next(fund_id)
+            if job is None:
+                return None
+            del self._queued[job["fund_id"]]
+            self._running[job["fund_id"]] = job["id"]
+            job["status"] = RUNNING
+            job["started_at"] = datetime.utcnow()
+            return dict(job)
+
+    def finish(self, job_id: uuid.UUID, error: Optional[str] = None):
+        with self._cond:
+            job = self._jobs[job_id]
+            fund_id = job["fund_id"]
+            self._running.pop(fund_id, None)
+            job["finished_at"] = datetime.utcnow()
+            if error is None:
+                job["status"] = SUCCEEDED
+                self._computed[fund_id] = max(self._computed.get(fund_id, 0), job["version"])
+            else:
+                job["status"] = FAILED
+                job["error"] = error
+                queued = self._queued.get(fund_id)
+                if queued is not None:
+                    queued["full"] = True
+                elif not job["full"]:
+                    # Retried as a full rebuild, covering the same writes
+                    self._queue(fund_id, None, False, True, job["version"], 0)
+                else:
+                    self._rebuild.add(fund_id)
+            self._trim()
+            # The fund's next job may be waiting on this one
+            self._cond.notify_all()
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: uuid.UUID) -> Optional[dict]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def fund_status(self, fund_id: uuid.UUID) -> dict:
+        with self._cond:
+            requested = self._requested.get(fund_id, 0)
+            computed = self._computed.get(fund_id, 0)
+            jobs = [dict(job) for job in reversed(self._jobs.values()) if job["fund_id"] == fund_id]
+        return {
+            "fund_id": fund_id,
+            "requested_version": requested,
+            "computed_version": computed,
+            "fresh": computed >= requested,
+            "jobs": jobs,
+        }
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"queued": len(self._queued), "running": len(self._running), "coalesced": self._coalesced}
+
+class JobQueue:
+    def __init__(self, backend: JobBackend, workers: int):
+        self.backend = backend
+        self.workers = workers
+        self._engine = None
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def start(self, engine):
+        # Without started workers (scripts, JOB_BACKEND=inline) every job runs
+        # in the writer's session before enqueue returns, as it used to
+        if self._threads or self.workers <= 0:
+            return
+        self._engine = engine
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        # Workers drain what is queued before they exit
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def enqueue_waterfall(
+        self,
+        session: Session,
+        fund_id: uuid.UUID,
+        since: Optional[date] = None,
+        capital_changed: bool = False,
+        full: bool = False,
+    ) -> dict:
+        job = self.backend.enqueue(fund_id, since, capital_changed, full)
+        if self._threads:
+            return job
+        # Inline: run the fund's jobs until none is queued. While another
+        # request is running the fund's job, claim returns None and that
+        # request picks this job up once it finishes. The error of the last
+        # job run (e.g. a retry failing too) is raised to the writer.
+        # The jobs get their own session on the writer's bind: a job that
+        # rolls back (nothing to rewrite, or a failure) would otherwise expire
+        # the objects the writer is about to return.
+        error = None
+        with Session(session.get_bind()) as job_session:
+            while True:
+                claimed = self.backend.claim(fund_id)
+                if claimed is None:
+                    break
+                error = self._run(job_session, claimed)
+        if error is not None:
+            raise error
+        return self.backend.get(job["id"]) or job
+
+    def _run(self, session: Session, job: dict) -> Optional[Exception]:
+        # Returns the job's error, if it failed
+        try:
+            recompute_waterfall(
+                session, job["fund_id"], since=job["since"], capital_changed=job["capital_changed"], full=job["full"]
+            )
+        except Exception as exc:
+            session.rollback()
+            self.backend.finish(job["id"], f"{type(exc).__name__}: {exc}")
+            return exc
+        self.backend.finish(job["id"])
+        return None
+
+    def _work(self):
+        while True:
+            job = self.backend.claim(timeout=0.5)
+            if job is None:
+                if self._stopping.is_set():
+                    return
+                continue
+            with Session(self._engine) as session:
+                self._run(session, job)
+
+    def get(self, job_id: uuid.UUID) -> Optional[dict]:
+        return self.backend.get(job_id)
+
+    def fund_status(self, fund_id: uuid.UUID) -> dict:
+        return self.backend.fund_status(fund_id)
+
+JOB_BACKENDS = ("memory", "inline")
+
+def _create_backend() -> JobBackend:
+    if settings.JOB_BACKEND not in JOB_BACKENDS:
+        raise ValueError(f"Unknown JOB_BACKEND {settings.JOB_BACKEND!r}, expected one of: {', '.join(JOB_BACKENDS)}")
+    return LocalJobBackend(settings.JOB_HISTORY)
+
+job_queue = JobQueue(_create_backend(), workers=settings.JOB_WORKERS if settings.JOB_BACKEND != "inline" else 0)
@@ -1,117 +1,363 @@
-from typing import List, Optional
+from datetime import date
+from typing import Dict, List, Optional
+import numpy as np
 import pandas as pd
-from pyxirr import xirr
+from sqlalchemy import union_all
 from sqlmodel import Session, select
-from ..models import Fund, Transaction, WaterfallAllocation, TransactionType, PortfolioCompany
+from ..models import Fund, FundAggregate, Transaction, WaterfallAllocation, TransactionType, PortfolioCompany
+from .company_metrics import GROSS_TYPES, gross_cashflows
+from .irr import xirr_batch
+from .money import CENTS, cents, from_cents, sum_cents, to_cents, units
+from .valuations import fund_nav_at
+from .waterfall_engine import as_days, fund_tiers, is_incremental, run_waterfall
 import uuid
 
-def calculate_fund_metrics(session: Session, fund_id: uuid.UUID):
-    fund = session.get(Fund, fund_id)
-    if not fund:
-        return None
+FEE_TYPES = [TransactionType.management_fee, TransactionType.other_fee]
+OUTFLOW_TYPES = [TransactionType.capital_call] + FEE_TYPES
 
-    # Total Contributed
-    contributed_stmt = select(Transaction).where(
-        Transaction.fund_id == fund_id,
-        Transaction.tx_type == TransactionType.capital_call
-    )
-    total_contributed = sum(tx.amount for tx in session.exec(contributed_stmt).all())
+# Money is handled in int64 cents (money.py) from the queries to
+# _build_metrics, which converts the results back to units
 
-    # Total Distributions (Gross)
-    dist_stmt = select(Transaction).where(
-        Transaction.fund_id == fund_id,
-        Transaction.tx_type == TransactionType.distribution
+def _transaction_totals(session: Session, fund_id: uuid.UUID, as_of: Optional[date] = None) -> Dict[TransactionType, int]:
+    # One grouped scan instead of one query (and one ORM object per row) per tx_type
+    stmt = select(Transaction.tx_type, sum_cents(Transaction.amount)).where(
+        Transaction.fund_id == fund_id
+    ).group_by(Transaction.tx_type)
+    if as_of is not None:
+        stmt = stmt.where(Transaction.transaction_date <= as_of)
+    return {TransactionType(tx_type): total for tx_type, total in session.exec(stmt).all()}
+
+def _waterfall_totals(session: Session, fund_id: uuid.UUID):
+    # LP/GP waterfall totals plus the fund's unrealized value in a single round trip
+    unrealized_stmt = select(
+        sum_cents(PortfolioCompany.latest_post_money * PortfolioCompany.ownership_pct)
+    ).where(PortfolioCompany.fund_id == fund_id).scalar_subquery()
+
+    stmt = select(
+        sum_cents(WaterfallAllocation.lp_distribution),
+        sum_cents(WaterfallAllocation.gp_distribution),
+        unrealized_stmt,
+    ).where(WaterfallAllocation.fund_id == fund_id)
+    return session.exec(stmt).one()
+
+def _waterfall_as_of(session: Session, fund: Fund, as_of: date, contributed: int):
+    # The waterfall as it stood on `as_of`: the distributions dated by then,
+    # rerun through the fund's tiers against the capital called by then
+    # (`contributed`, in cents). The stored allocations can't be filtered by
+    # date instead: they return all the capital called so far, so a call
+    # dated after `as_of` changes the split of earlier distributions.
+    # Returns the distribution dates and run_waterfall's columns.
+    tiers = fund_tiers(fund.extra_metadata)
+    distributions = session.exec(select(Transaction.transaction_date, Transaction.amount).where(
+        Transaction.fund_id == fund.id,
+        Transaction.tx_type == TransactionType.distribution,
+        Transaction.transaction_date <= as_of,
+    ).order_by(Transaction.transaction_date.asc(), Transaction.created_at.asc(), Transaction.id.asc())).all()
+    calls = [] if is_incremental(tiers) else session.exec(select(Transaction.transaction_date, Transaction.amount).where(
+        Transaction.fund_id == fund.id,
+        Transaction.tx_type == TransactionType.capital_call,
+        Transaction.transaction_date <= as_of,
+    )).all()
+    dates = [row[0] for row in distributions]
+    allocation = run_waterfall(
+        as_days(dates),
+        to_cents([row[1] for row in distributions]),
+        contributed,
+        fund.carry_pct,
+        tiers,
+        as_days([row[0] for row in calls]),
+        to_cents([row[1] for row in calls]),
     )
-    total_distributions = sum(tx.amount for tx in session.exec(dist_stmt).all())
+    return dates, allocation
 
-    # Total Fees
-    fees_stmt = select(Transaction).where(
+def _net_cashflows(
+    session: Session, fund_id: uuid.UUID, as_of: Optional[date] = None, lp_distributions: Optional[tuple] = None
+):
+    # LP cashflow series for the net IRR, selecting only the date/amount columns:
+    # - Capital calls and fees (negative)
+    # - LP Distributions (positive); the stored allocations unless
+    #   `lp_distributions` (dates, amounts) gives them (see _waterfall_as_of)
+    outflows_stmt = select(
+        Transaction.transaction_date.label("date"),
+        (-Transaction.amount).label("amount"),
+    ).where(
         Transaction.fund_id == fund_id,
-        Transaction.tx_type.in_([TransactionType.management_fee, TransactionType.other_fee])
+        Transaction.tx_type.in_(OUTFLOW_TYPES)
     )
-    total_fees = sum(tx.amount for tx in session.exec(fees_stmt).all())
+    inflows_stmt = select(
+        WaterfallAllocation.distribution_date.label("date"),
+        WaterfallAllocation.lp_distribution.label("amount"),
+    ).where(WaterfallAllocation.fund_id == fund_id)
+    if as_of is not None:
+        outflows_stmt = outflows_stmt.where(Transaction.transaction_date <= as_of)
+        inflows_stmt = inflows_stmt.where(WaterfallAllocation.distribution_date <= as_of)
 
-    # Fund Unrealized Value
-    companies_stmt = select(PortfolioCompany).where(PortfolioCompany.fund_id == fund_id)
-    companies = session.exec(companies_stmt).all()
-    fund_unrealized_value = sum(
-        (c.latest_post_money * c.ownership_pct) if (c.latest_post_money and c.ownership_pct) else 0 
-        for c in companies
-    )
+    if lp_distributions is not None:
+        rows = session.execute(outflows_stmt).all()
+        inflow_dates, inflow_amounts = lp_distributions
+        return [row.date for row in rows] + list(inflow_dates), [row.amount for row in rows] + list(inflow_amounts)
+    rows = session.execute(union_all(outflows_stmt, inflows_stmt)).all()
+    return [row.date for row in rows], [row.amount for row in rows]
+
+def _irrs(*series) -> List[Optional[float]]:
+    # One XIRR batch for the given (dates, cashflows) series; None where a
+    # series has no IRR (e.g. nothing distributed or marked yet)
+    rates = xirr_batch(series)["rates"]
+    return [float(rate) if np.isfinite(rate) else None for rate in rates]
+
+def _build_metrics(
+    fund_id: uuid.UUID,
+    totals: Dict[TransactionType, int],
+    lp_total_distributions: int,
+    total_gp_carry: int,
+    fund_unrealized_value: int,
+    fund_net_irr: Optional[float],
+    fund_gross_irr: Optional[float] = None,
+):
+    # Amounts in cents
+    total_contributed = totals.get(TransactionType.capital_call, 0)
+    total_distributions = totals.get(TransactionType.distribution, 0)
+    total_fees = sum(totals.get(tx_type, 0) for tx_type in FEE_TYPES)
 
     # Gross MOIC
     gross_moic = total_distributions / total_contributed if total_contributed > 0 else 0
 
     # LP Net Metrics (after waterfall)
-    waterfall_stmt = select(WaterfallAllocation).where(WaterfallAllocation.fund_id == fund_id)
-    waterfall_allocs = session.exec(waterfall_stmt).all()
-    lp_total_distributions = sum(a.lp_distribution for a in waterfall_allocs)
-    total_gp_carry = sum(a.gp_distribution for a in waterfall_allocs)
-
     lp_net_moic = (lp_total_distributions + fund_unrealized_value) / total_contributed if total_contributed > 0 else 0
 
-    # IRR Calculation
-    # Cashflows for Net IRR:
-    # - Capital calls (negative)
-    # - Fees (negative)
-    # - LP Distributions (positive)
-    # - Unrealized value (positive, as of today)
-    
-    cashflows = []
-    dates = []
-
-    # Outflows
-    outflows_stmt = select(Transaction).where(
-        Transaction.fund_id == fund_id,
-        Transaction.tx_type.in_([TransactionType.capital_call, TransactionType.management_fee, TransactionType.other_fee])
-    )
-    for tx in session.exec(outflows_stmt).all():
-        cashflows.append(-tx.amount)
-        dates.append(tx.transaction_date)
-
-    # Inflows (LP Share)
-    for alloc in waterfall_allocs:
-        cashflows.append(alloc.lp_distribution)
-        dates.append(alloc.distribution_date)
-
-    # Terminal Value (Unrealized)
-    if fund_unrealized_value > 0:
-        cashflows.append(fund_unrealized_value)
-        dates.append(pd.Timestamp.now().date())
-
-    fund_net_irr = None
-    if len(cashflows) > 1:
-        try:
-            fund_net_irr = xirr(dates, cashflows)
-        except:
-            fund_net_irr = None
-
     # Standard Industry Metrics
     tvpi = (total_distributions + fund_unrealized_value) / total_contributed if total_contributed > 0 else 0
     dpi = total_distributions / total_contributed if total_contributed > 0 else 0
     rvpi = fund_unrealized_value / total_contributed if total_contributed > 0 else 0
-    
+
     # For realized/unrealized gains, we'll use simple definitions for the dashboard
     realized_gains = total_distributions - total_contributed if total_contributed > 0 else 0
     unrealized_gains = fund_unrealized_value
 
     return {
         "fund_id": fund_id,
-        "total_contributed": total_contributed,
-        "total_distributions": total_distributions,
-        "total_fees": total_fees,
+        "total_contributed": units(total_contributed),
+        "total_distributions": units(total_distributions),
+        "total_fees": units(total_fees),
         "gross_moic": round(gross_moic, 3),
         "lp_net_moic": round(lp_net_moic, 4),
+        "fund_gross_irr": round(fund_gross_irr, 4) if fund_gross_irr is not None else None,
         "fund_net_irr": round(fund_net_irr, 4) if fund_net_irr is not None else None,
-        "total_gp_carry": total_gp_carry,
-        "fund_unrealized_value": fund_unrealized_value,
+        "total_gp_carry": units(total_gp_carry),
+        "fund_unrealized_value": units(fund_unrealized_value),
         "tvpi": round(tvpi, 3),
         "dpi": round(dpi, 3),
         "rvpi": round(rvpi, 3),
         "moic": round(lp_net_moic, 3), # Using Net MOIC for the dashboard
-        "realized_gains": realized_gains,
-        "unrealized_gains": unrealized_gains,
-        "total_invested": total_contributed,
-        "total_value": total_distributions + fund_unrealized_value,
+        "realized_gains": units(realized_gains),
+        "unrealized_gains": units(unrealized_gains),
+        "total_invested": units(total_contributed),
+        "total_value": units(total_distributions + fund_unrealized_value),
         "irr": round(fund_net_irr * 100, 2) if fund_net_irr is not None else 0
     }
+
+def load_fund_metrics_inputs(session: Session, fund_id: uuid.UUID, as_of: Optional[date] = None):
+    # Database phase of calculate_fund_metrics; the result feeds compute_fund_metrics
+    fund = session.get(Fund, fund_id)
+    if not fund:
+        return None
+
+    aggregate = session.get(FundAggregate, fund_id) if as_of is None else None
+    lp_distributions = None
+    if as_of is not None:
+        # The fund as it stood on `as_of`: what was dated by then, its
+        # waterfall rerun on that, and the companies' marks from the
+        # valuation history
+        totals = _transaction_totals(session, fund_id, as_of)
+        distribution_dates, allocation = _waterfall_as_of(
+            session, fund, as_of, totals.get(TransactionType.capital_call, 0)
+        )
+        lp_total_distributions = int(allocation["lp_distribution"].sum())
+        total_gp_carry = int(allocation["gp_distribution"].sum())
+        lp_distributions = (distribution_dates, from_cents(allocation["lp_distribution"]).tolist())
+        fund_unrealized_value = fund_nav_at(session, fund_id, as_of)
+    elif aggregate:
+        # Running totals maintained on write (mv_fund_aggregates)
+        totals = {
+            TransactionType.capital_call: cents(aggregate.total_contributed),
+            TransactionType.distribution: cents(aggregate.total_distributions),
+            TransactionType.management_fee: cents(aggregate.total_fees),
+        }
+        lp_total_distributions = cents(aggregate.lp_total_distributions)
+        total_gp_carry = cents(aggregate.total_gp_carry)
+        fund_unrealized_value = cents(aggregate.fund_unrealized_value)
+    else:
+        # Not materialized yet: contributed, distributed and fee totals from one GROUP BY tx_type
+        totals = _transaction_totals(session, fund_id)
+
+        # LP/GP waterfall totals and Fund Unrealized Value
+        lp_total_distributions, total_gp_carry, fund_unrealized_value = _waterfall_totals(session, fund_id)
+
+    # IRR Calculation
+    # Cashflows for Net IRR:
+    # - Capital calls (negative)
+    # - Fees (negative)
+    # - LP Distributions (positive)
+    # - Unrealized value (positive, as of today or `as_of`)
+    dates, cashflows = _net_cashflows(session, fund_id, as_of, lp_distributions)
+    # Gross IRR: company-level calls and proceeds (see company_metrics)
+    gross_dates, gross_amounts = gross_cashflows(session, fund_id, as_of)
+
+    return {
+        "fund_id": fund_id,
+        "as_of": as_of,
+        "totals": totals,
+        "lp_total_distributions": lp_total_distributions,
+        "total_gp_carry": total_gp_carry,
+        "fund_unrealized_value": fund_unrealized_value,
+        "dates": dates,
+        "cashflows": cashflows,
+        "gross_dates": gross_dates,
+        "gross_cashflows": gross_amounts,
+    }
+
+def compute_fund_metrics(inputs):
+    # CPU phase (XIRR); needs no session, so it can run off the event loop
+    if inputs is None:
+        return None
+    dates = list(inputs["dates"])
+    cashflows = list(inputs["cashflows"])
+    gross_dates = list(inputs["gross_dates"])
+    gross_amounts = list(inputs["gross_cashflows"])
+    fund_unrealized_value = inputs["fund_unrealized_value"]
+
+    # Terminal Value (Unrealized), in both the net and the gross series
+    if fund_unrealized_value > 0:
+        terminal_date = inputs.get("as_of") or pd.Timestamp.now().date()
+        cashflows.append(units(fund_unrealized_value))
+        dates.append(terminal_date)
+        gross_amounts.append(units(fund_unrealized_value))
+        gross_dates.append(terminal_date)
+
+    fund_net_irr, fund_gross_irr = _irrs((dates, cashflows), (gross_dates, gross_amounts))
+
+    metrics = _build_metrics(
+        inputs["fund_id"],
+        inputs["totals"],
+        inputs["lp_total_distributions"],
+        inputs["total_gp_carry"],
+        fund_unrealized_value,
+        fund_net_irr,
+        fund_gross_irr,
+    )
+    metrics["as_of"] = inputs.get("as_of")
+    return metrics
+
+def calculate_fund_metrics(session: Session, fund_id: uuid.UUID, as_of: Optional[date] = None):
+    # Current metrics, or the fund's metrics as they stood on `as_of`
+    return compute_fund_metrics(load_fund_metrics_inputs(session, fund_id, as_of))
+
+def _batch_irr(cashflows: pd.DataFrame) -> Dict[uuid.UUID, Optional[float]]:
+    # Every fund's XIRR solved together as one padded batch
+    groups = list(cashflows.groupby("fund_id", sort=False))
+    result = xirr_batch([(group["date"].tolist(), group["amount"].to_numpy()) for _, group in groups])
+    return {
+        fund_id: float(rate) if np.isfinite(rate) else None
+        for (fund_id, _), rate in zip(groups, result["rates"])
+    }
+
+def load_portfolio_frames(session: Session, fund_ids: Optional[List[uuid.UUID]] = None):
+    # Four set-based queries for every requested fund, instead of four per fund
+    funds_stmt = select(Fund.id)
+    if fund_ids is not None:
+        funds_stmt = funds_stmt.where(Fund.id.in_(fund_ids))
+    funds = session.exec(funds_stmt).all()
+    if not funds:
+        return None
+
+    transactions_stmt = select(
+        Transaction.fund_id, Transaction.company_id, Transaction.tx_type, Transaction.transaction_date, Transaction.amount
+    ).where(Transaction.fund_id.in_(funds))
+    transactions = pd.DataFrame(
+        session.exec(transactions_stmt).all(), columns=["fund_id", "company_id", "tx_type", "date", "amount"]
+    )
+
+    waterfall_stmt = select(
+        WaterfallAllocation.fund_id,
+        WaterfallAllocation.distribution_date,
+        WaterfallAllocation.lp_distribution,
+        WaterfallAllocation.gp_distribution,
+    ).where(WaterfallAllocation.fund_id.in_(funds))
+    waterfall = pd.DataFrame(
+        session.exec(waterfall_stmt).all(), columns=["fund_id", "date", "lp_distribution", "gp_distribution"]
+    )
+
+    companies_stmt = select(
+        PortfolioCompany.fund_id, PortfolioCompany.latest_post_money, PortfolioCompany.ownership_pct
+    ).where(PortfolioCompany.fund_id.in_(funds))
+    companies = pd.DataFrame(
+        session.exec(companies_stmt).all(), columns=["fund_id", "latest_post_money", "ownership_pct"]
+    )
+
+    return {"funds": funds, "transactions": transactions, "waterfall": waterfall, "companies": companies}
+
+def compute_portfolio_metrics(frames):
+    # Vectorized per-fund metrics over the frames from load_portfolio_frames
+    if frames is None:
+        return {}
+    funds = frames["funds"]
+    transactions = frames["transactions"]
+    waterfall = frames["waterfall"]
+    companies = frames["companies"]
+
+    # Contributed, distributed and fee totals per fund and tx_type, summed as int64 cents
+    transactions["cents"] = to_cents(transactions["amount"])
+    totals = transactions.groupby(["fund_id", "tx_type"])["cents"].sum().unstack(fill_value=0)
+
+    # LP/GP waterfall totals
+    for column in ("lp_distribution", "gp_distribution"):
+        waterfall[column] = to_cents(waterfall[column])
+    waterfall_totals = waterfall.groupby("fund_id")[["lp_distribution", "gp_distribution"]].sum()
+
+    # Fund Unrealized Value
+    companies["unrealized"] = to_cents((
+        companies["latest_post_money"].astype(float) * companies["ownership_pct"].astype(float)
+    ).fillna(0))
+    unrealized = companies.groupby("fund_id")["unrealized"].sum()
+
+    # Net IRR cashflows for every fund: outflows, LP distributions, terminal value
+    outflows = transactions[transactions["tx_type"].isin(OUTFLOW_TYPES)]
+    terminal = unrealized[unrealized > 0]
+    cashflows = pd.concat([
+        pd.DataFrame({"fund_id": outflows["fund_id"], "date": outflows["date"], "amount": -outflows["amount"]}),
+        pd.DataFrame({"fund_id": waterfall["fund_id"], "date": waterfall["date"], "amount": waterfall["lp_distribution"] / CENTS}),
+        pd.DataFrame({"fund_id": terminal.index, "date": pd.Timestamp.now().date(), "amount": terminal.to_numpy() / CENTS}),
+    ], ignore_index=True)
+    net_irrs = _batch_irr(cashflows)
+
+    # Gross IRR cashflows: company-level calls and proceeds, terminal value
+    invested = transactions[transactions["company_id"].notna() & transactions["tx_type"].isin(GROSS_TYPES)]
+    gross = pd.concat([
+        pd.DataFrame({
+            "fund_id": invested["fund_id"],
+            "date": invested["date"],
+            "amount": invested["amount"].where(invested["tx_type"] != TransactionType.capital_call, -invested["amount"]),
+        }),
+        pd.DataFrame({"fund_id": terminal.index, "date": pd.Timestamp.now().date(), "amount": terminal.to_numpy() / CENTS}),
+    ], ignore_index=True)
+    gross_irrs = _batch_irr(gross)
+
+    results = {}
+    for fund_id in funds:
+        fund_totals = totals.loc[fund_id].to_dict() if fund_id in totals.index else {}
+        lp_total_distributions, total_gp_carry = (
+            waterfall_totals.loc[fund_id].to_numpy() if fund_id in waterfall_totals.index else (0, 0)
+        )
+        results[fund_id] = _build_metrics(
+            fund_id,
+            {TransactionType(tx_type): int(total) for tx_type, total in fund_totals.items()},
+            int(lp_total_distributions),
+            int(total_gp_carry),
+            int(unrealized.get(fund_id, 0)),
+            net_irrs.get(fund_id),
+            gross_irrs.get(fund_id),
+        )
+    return results
+
+def calculate_portfolio_metrics(session: Session, fund_ids: Optional[List[uuid.UUID]] = None):
+    return compute_portfolio_metrics(load_portfolio_frames(session, fund_ids))
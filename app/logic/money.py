@@ -0,0 +1,35 @@
+from typing import Union
+import numpy as np
+from sqlalchemy import BigInteger, cast, func
+
+# Money in the compute layer is int64 cents: sums and differences are exact
+# and vectorize as integer adds. Amounts are still stored as floats (readme:
+# NUMERIC(20,2)), so they become cents where they are read and go back to
+# units where they are stored or returned. A float holds every whole number
+# of cents exactly up to 2**53, i.e. about 90 trillion.
+
+CENTS = 100
+
+def to_cents(values) -> np.ndarray:
+    # Amounts (floats, lists or arrays) rounded to the nearest cent
+    return np.rint(np.asarray(values, dtype=float) * CENTS).astype(np.int64)
+
+def from_cents(cents: np.ndarray) -> np.ndarray:
+    return np.asarray(cents, dtype=np.int64) / CENTS
+
+def cents(value: Union[float, int, None]) -> int:
+    return int(round((value or 0) * CENTS))
+
+def units(cents_value: Union[int, np.integer]) -> float:
+    return int(cents_value) / CENTS
+
+def sum_cents(column):
+    # SQL SUM over each value rounded to cents, as an integer: the database
+    # adds integers instead of accumulating float error. Divide by CENTS
+    # (or use units()) on the way out.
+    return func.coalesce(func.sum(cast(func.round(column * CENTS), BigInteger)), 0)
+
+def round_cents(expression):
+    # SQL expression rounded to the cent, for running totals updated in place
+    # (total = total + amount) so they never pick up float residue
+    return func.round(expression * CENTS) / float(CENTS)
@@ -0,0 +1,231 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import repeat
+from typing import Dict, Optional
+import multiprocessing
+import secrets
+import numpy as np
+from sqlmodel import Session, select
+from ..config import settings
+from ..models import Fund, PortfolioCompany, Transaction, TransactionType
+from .irr import DAYS_PER_YEAR, solve_padded
+from .metrics import load_fund_metrics_inputs
+from .money import from_cents, to_cents, units
+from .waterfall_engine import EPOCH_ORDINAL, fund_tiers, run_waterfall
+import uuid
+
+# Monte Carlo exit scenarios: every unrealized company exits once per path at
+# (current mark x sampled multiple) on a sampled date, the exits continue the
+# fund's waterfall through its configured tiers (waterfall_engine, the split
+# compute_waterfall stores), and each path yields a net TVPI, net IRR and GP
+# carry.
+
+PERCENTILES = (5, 25, 50, 75, 95)
+# Companies in these states have no exit left to simulate
+REALIZED_STATUSES = {"exited", "written_off"}
+# Paths are generated in fixed chunks, each with its own child seed, so a seed
+# gives the same result whatever the number of workers
+MAX_CHUNK_PATHS = 5000
+# Bound on the (paths x cashflows) IRR batch of one chunk
+MAX_CHUNK_CELLS = 2_000_000
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    # SIMULATION_WORKERS=1 runs everything in-process; 0 means one worker per CPU
+    global _pool
+    if settings.SIMULATION_WORKERS == 1:
+        return None
+    if _pool is None:
+        # spawn rather than fork: the server process has threads running
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.SIMULATION_WORKERS or None,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+def load_simulation_inputs(session: Session, fund_id: uuid.UUID):
+    inputs = load_fund_metrics_inputs(session, fund_id)
+    if inputs is None:
+        return None
+    fund = session.get(Fund, fund_id)
+
+    # The waterfall's inputs so far: each path's exits are run after the
+    # fund's distributions (in waterfall order), against every call, so
+    # hurdle tiers pick up where the stored allocations left off
+    distributions = session.exec(select(Transaction.transaction_date, Transaction.amount).where(
+        Transaction.fund_id == fund_id,
+        Transaction.tx_type == TransactionType.distribution,
+    ).order_by(Transaction.transaction_date.asc(), Transaction.created_at.asc(), Transaction.id.asc())).all()
+    calls = session.exec(select(Transaction.transaction_date, Transaction.amount).where(
+        Transaction.fund_id == fund_id,
+        Transaction.tx_type == TransactionType.capital_call,
+    )).all()
+
+    companies = session.exec(
+        select(
+            PortfolioCompany.id,
+            PortfolioCompany.stage,
+            PortfolioCompany.status,
+            PortfolioCompany.latest_post_money,
+            PortfolioCompany.ownership_pct,
+            PortfolioCompany.total_invested,
+        ).where(PortfolioCompany.fund_id == fund_id)
+    ).all()
+
+    # Waterfall inputs are in cents, the totals reported back in units
+    return {
+        "fund_id": fund_id,
+        "carry_pct": fund.carry_pct,
+        "tiers": fund_tiers(fund.extra_metadata),
+        "distribution_days": [row[0].toordinal() for row in distributions],
+        "distribution_cents": to_cents([row[1] for row in distributions]),
+        "call_days": [row[0].toordinal() for row in calls],
+        "call_cents": to_cents([row[1] for row in calls]),
+        "contributed_cents": inputs["totals"].get(TransactionType.capital_call, 0),
+        "total_contributed": units(inputs["totals"].get(TransactionType.capital_call, 0)),
+        "lp_total_distributions": units(inputs["lp_total_distributions"] or 0),
+        "total_gp_carry": units(inputs["total_gp_carry"] or 0),
+        "dates": inputs["dates"],
+        "cashflows": inputs["cashflows"],
+        # Exits start from the current mark; unmarked companies from their cost
+        "companies": [
+            {
+                "id": company_id,
+                "stage": stage,
+                "value": (latest_post_money * ownership_pct) if (latest_post_money and ownership_pct) else (total_invested or 0),
+            }
+            for company_id, stage, status, latest_post_money, ownership_pct, total_invested in companies
+            if status not in REALIZED_STATUSES
+        ],
+    }
+
+def _build_model(inputs, default: Dict, stages: Dict[str, Dict], companies: Dict[uuid.UUID, Dict], as_of: date):
+    # Per-company parameter arrays (company override > stage > default) and the
+    # fund's history collapsed to one LP cashflow per day
+    assumptions = [companies.get(c["id"]) or stages.get(c["stage"]) or default for c in inputs["companies"]]
+
+    def column(name):
+        return np.array([assumption[name] for assumption in assumptions], dtype=float)
+
+    history_days = np.fromiter((d.toordinal() for d in inputs["dates"]), dtype=np.int64, count=len(inputs["dates"]))
+    history_days, position = np.unique(history_days, return_inverse=True)
+    history_amounts = np.bincount(position, weights=np.asarray(inputs["cashflows"], dtype=float), minlength=len(history_days))
+    origin = int(history_days[0]) if len(history_days) else as_of.toordinal()
+
+    def days(ordinals):
+        return (np.asarray(ordinals, dtype=np.int64) - EPOCH_ORDINAL).astype("datetime64[D]")
+
+    exit_min = column("exit_years_min")
+    exit_max = column("exit_years_max")
+    return {
+        "carry_pct": inputs["carry_pct"],
+        "tiers": inputs["tiers"],
+        "contributed_cents": int(inputs["contributed_cents"]),
+        "call_dates": days(inputs["call_days"]),
+        "call_cents": np.asarray(inputs["call_cents"], dtype=np.int64),
+        "past_dates": days(inputs["distribution_days"]),
+        "past_cents": np.asarray(inputs["distribution_cents"], dtype=np.int64),
+        "value": np.array([c["value"] for c in inputs["companies"]], dtype=float),
+        "log_median": np.log(column("multiple_median")),
+        "sigma": column("multiple_sigma"),
+        "loss_probability": column("loss_probability"),
+        "exit_min": np.minimum(exit_min, exit_max),
+        "exit_max": np.maximum(exit_min, exit_max),
+        "history_times": (history_days - origin) / DAYS_PER_YEAR,
+        "history_amounts": history_amounts,
+        "origin": origin,
+        "as_of": as_of.toordinal(),
+    }
+
+def _simulate_chunk(model, seed: np.random.SeedSequence, n_paths: int):
+    # Runs in a pool worker: returns (lp_future, gp_future, net_irr) per path
+    rng = np.random.default_rng(seed)
+    n_companies = len(model["value"])
+
+    multiples = np.exp(rng.normal(model["log_median"], model["sigma"], (n_paths, n_companies)))
+    multiples[rng.random((n_paths, n_companies)) < model["loss_probability"]] = 0.0
+    proceeds = model["value"] * multiples
+    # Whole days after as_of, as stored distribution dates would be
+    exit_days = np.round(rng.uniform(model["exit_min"], model["exit_max"], (n_paths, n_companies)) * DAYS_PER_YEAR).astype(np.int64)
+
+    order = np.argsort(exit_days, axis=1, kind="stable")
+    proceeds = np.take_along_axis(proceeds, order, axis=1)
+    exit_days = np.take_along_axis(exit_days, order, axis=1) + model["as_of"]
+    exit_times = (exit_days - model["origin"]) / DAYS_PER_YEAR
+
+    # One waterfall per path (a row each): the fund's distributions so far,
+    # then the path's exits; the allocations of the exits are the future ones
+    past = len(model["past_cents"])
+    dates = np.concatenate([
+        np.broadcast_to(model["past_dates"], (n_paths, past)),
+        (exit_days - EPOCH_ORDINAL).astype("datetime64[D]"),
+    ], axis=1)
+    gross = np.concatenate([np.broadcast_to(model["past_cents"], (n_paths, past)), to_cents(proceeds)], axis=1)
+    allocation = run_waterfall(
+        dates, gross, model["contributed_cents"], model["carry_pct"], model["tiers"],
+        model["call_dates"], model["call_cents"],
+    )
+    lp_distribution = from_cents(allocation["lp_distribution"][:, past:])
+    gp_distribution = from_cents(allocation["gp_distribution"][:, past:])
+
+    history = len(model["history_times"])
+    times = np.concatenate([np.broadcast_to(model["history_times"], (n_paths, history)), exit_times], axis=1)
+    amounts = np.concatenate([np.broadcast_to(model["history_amounts"], (n_paths, history)), lp_distribution], axis=1)
+    net_irr = solve_padded(times, amounts)["rates"]
+    return lp_distribution.sum(axis=1), gp_distribution.sum(axis=1), net_irr
+
+def _distribution(values: np.ndarray, decimals: int):
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {"mean": None, "solved": 0, **{f"p{p}": None for p in PERCENTILES}}
+    bands = np.percentile(values, PERCENTILES)
+    return {
+        "mean": round(float(values.mean()), decimals),
+        "solved": int(len(values)),
+        **{f"p{p}": round(float(band), decimals) for p, band in zip(PERCENTILES, bands)},
+    }
+
+def run_simulation(
+    inputs,
+    paths: int,
+    default: Dict,
+    stages: Optional[Dict[str, Dict]] = None,
+    companies: Optional[Dict[uuid.UUID, Dict]] = None,
+    seed: Optional[int] = None,
+    as_of: Optional[date] = None,
+):
+    if inputs is None:
+        return None
+    seed = secrets.randbits(32) if seed is None else seed
+    as_of = as_of or date.today()
+    model = _build_model(inputs, default, stages or {}, companies or {}, as_of)
+
+    width = len(model["history_times"]) + len(model["past_cents"]) + len(model["value"])
+    chunk = max(1, min(MAX_CHUNK_PATHS, MAX_CHUNK_CELLS // max(width, 1)))
+    sizes = [min(chunk, paths - start) for start in range(0, paths, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    pool = _get_pool() if len(sizes) > 1 else None
+    mapper = pool.map if pool is not None else map
+    results = list(mapper(_simulate_chunk, repeat(model), seeds, sizes))
+    lp_future, gp_future, net_irr = (np.concatenate(parts) for parts in zip(*results))
+
+    contributed = inputs["total_contributed"]
+    net_tvpi = (inputs["lp_total_distributions"] + lp_future) / contributed if contributed > 0 else np.zeros(paths)
+    return {
+        "fund_id": inputs["fund_id"],
+        "as_of": as_of,
+        "paths": paths,
+        "seed": seed,
+        "companies": len(model["value"]),
+        "net_tvpi": _distribution(net_tvpi, 4),
+        "net_irr": _distribution(net_irr, 4),
+        "gp_carry": _distribution(inputs["total_gp_carry"] + gp_future, 2),
+    }
@@ -0,0 +1,162 @@
+from datetime import date
+from typing import Optional
+import numpy as np
+import pandas as pd
+from sqlmodel import Session, select
+from ..models import Fund, Transaction, TransactionType
+from .irr import DAYS_PER_YEAR, solve_padded
+from .metrics import FEE_TYPES, OUTFLOW_TYPES
+from .money import from_cents, to_cents
+from .valuations import MarkIndex, load_marks
+from .waterfall_engine import fund_tiers, run_waterfall
+import uuid
+
+# pandas period-end aliases for the supported ?freq= values
+FREQUENCIES = {"M": "ME", "Q": "QE", "Y": "YE"}
+# Upper bound on the (periods x cashflows) IRR batch held in memory at once
+MAX_IRR_BATCH_CELLS = 2_000_000
+
+def load_timeseries_inputs(session: Session, fund_id: uuid.UUID):
+    # Database phase: the fund's whole history in column-only queries, in
+    # waterfall order (ties broken by insertion order, as compute_waterfall)
+    fund = session.get(Fund, fund_id)
+    if not fund:
+        return None
+
+    transactions = session.exec(
+        select(Transaction.transaction_date, Transaction.tx_type, Transaction.amount).where(
+            Transaction.fund_id == fund_id
+        ).order_by(Transaction.transaction_date.asc(), Transaction.created_at.asc(), Transaction.id.asc())
+    ).all()
+    return {
+        "fund_id": fund_id,
+        "fund_start_date": fund.fund_start_date,
+        "tiers": fund_tiers(fund.extra_metadata),
+        "carry_pct": fund.carry_pct,
+        "transactions": transactions,
+        # Every company's valuation history (valuations.py)
+        "marks": load_marks(session, [fund_id]),
+    }
+
+def _to_days(dates) -> np.ndarray:
+    return np.array(dates, dtype="datetime64[D]")
+
+def _cumulative_at(dates: np.ndarray, amounts: np.ndarray, points: np.ndarray) -> np.ndarray:
+    # Running total of `amounts` (cents) as of each point: one sort, one
+    # cumsum, one searchsorted
+    order = np.argsort(dates, kind="stable")
+    running = np.concatenate([np.zeros(1, dtype=amounts.dtype), np.cumsum(amounts[order])])
+    return running[np.searchsorted(dates[order], points, side="right")]
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), 0.0)
+
+def _period_irrs(flow_dates: np.ndarray, flow_amounts: np.ndarray, points: np.ndarray, nav: np.ndarray) -> np.ndarray:
+    # Row i of the padded batch holds the flows dated on or before points[i],
+    # then that period's NAV as a terminal flow in the next cell
+    rates = np.full(len(points), np.nan)
+    if not len(points) or not len(flow_dates):
+        return rates
+    ends = np.searchsorted(flow_dates, points, side="right")
+    width = int(ends.max()) + 1
+    flow_times = np.append((flow_dates - flow_dates[0]).astype(float) / DAYS_PER_YEAR, 0.0)[:width]
+    flow_amounts = np.append(flow_amounts, 0.0)[:width]
+    point_times = (points - flow_dates[0]).astype(float) / DAYS_PER_YEAR
+
+    rows_per_batch = max(1, MAX_IRR_BATCH_CELLS // width)
+    for start in range(0, len(points), rows_per_batch):
+        batch_ends = ends[start:start + rows_per_batch]
+        rows = np.arange(len(batch_ends))
+        in_prefix = np.arange(width) < batch_ends[:, None]
+        times = np.where(in_prefix, flow_times, 0.0)
+        amounts = np.where(in_prefix, flow_amounts, 0.0)
+        times[rows, batch_ends] = point_times[start:start + rows_per_batch]
+        amounts[rows, batch_ends] = nav[start:start + rows_per_batch]
+        rates[start:start + rows_per_batch] = solve_padded(times, amounts)["rates"]
+    return rates
+
+def compute_metrics_timeseries(inputs, freq: str = "Q", as_of: Optional[date] = None):
+    # CPU phase: metrics as of every period end from fund_start_date to `as_of`
+    if inputs is None:
+        return None
+    as_of = as_of or date.today()
+    period_ends = pd.date_range(inputs["fund_start_date"], as_of, freq=FREQUENCIES[freq])
+    points = _to_days(period_ends.date)
+
+    tx_dates = _to_days([row[0] for row in inputs["transactions"]])
+    tx_types = np.array([TransactionType(row[1]).value for row in inputs["transactions"]], dtype=object)
+    tx_amounts = to_cents([row[2] for row in inputs["transactions"]])
+
+    def cumulative(types):
+        mask = np.isin(tx_types, [tx_type.value for tx_type in types])
+        return _cumulative_at(tx_dates[mask], tx_amounts[mask], points)
+
+    contributed = cumulative([TransactionType.capital_call])
+    distributions = cumulative([TransactionType.distribution])
+    fees = cumulative(FEE_TYPES)
+
+    # NAV at every period end: each company's last mark by then, summed
+    nav = MarkIndex(inputs["marks"]).fund_nav([inputs["fund_id"]] * len(points), points)
+
+    # The LP split as it stood at each period end: the waterfall returns the
+    # capital called by then (metrics._waterfall_as_of), so the periods are
+    # grouped by the calls dated by their end and the distributions are run
+    # once per group. Allocations only depend on the rows before them, so one
+    # run over every distribution serves all of the group's periods.
+    call_mask = tx_types == TransactionType.capital_call.value
+    distribution_mask = tx_types == TransactionType.distribution.value
+    call_dates, call_amounts = tx_dates[call_mask], tx_amounts[call_mask]
+    wf_dates, wf_gross = tx_dates[distribution_mask], tx_amounts[distribution_mask]
+    outflow_mask = np.isin(tx_types, [tx_type.value for tx_type in OUTFLOW_TYPES])
+    calls_by_period = np.searchsorted(call_dates, points, side="right")
+
+    lp_distributions = np.zeros(len(points), dtype=np.int64)
+    net_irrs = np.full(len(points), np.nan)
+    for calls in np.unique(calls_by_period):
+        group = calls_by_period == calls
+        wf_lp = run_waterfall(
+            wf_dates, wf_gross, int(call_amounts[:calls].sum()), inputs["carry_pct"], inputs["tiers"],
+            call_dates[:calls], call_amounts[:calls],
+        )["lp_distribution"]
+        lp_distributions[group] = _cumulative_at(wf_dates, wf_lp, points[group])
+
+        # Net IRR: LP cashflows sorted once per group; each period is that
+        # prefix plus the period's NAV, and the group is solved together
+        flow_dates = np.concatenate([tx_dates[outflow_mask], wf_dates])
+        flow_amounts = from_cents(np.concatenate([-tx_amounts[outflow_mask], wf_lp]))
+        order = np.argsort(flow_dates, kind="stable")
+        net_irrs[group] = _period_irrs(flow_dates[order], flow_amounts[order], points[group], from_cents(nav[group]))
+
+    tvpi = _ratio(distributions + nav, contributed)
+    dpi = _ratio(distributions, contributed)
+    rvpi = _ratio(nav, contributed)
+    lp_net_moic = _ratio(lp_distributions + nav, contributed)
+
+    contributed, distributions, fees, lp_distributions, nav = (
+        from_cents(values) for values in (contributed, distributions, fees, lp_distributions, nav)
+    )
+
+    return {
+        "fund_id": inputs["fund_id"],
+        "freq": freq,
+        "points": [
+            {
+                "as_of": period_ends[i].date(),
+                "total_contributed": float(contributed[i]),
+                "total_distributions": float(distributions[i]),
+                "total_fees": float(fees[i]),
+                "lp_total_distributions": float(lp_distributions[i]),
+                "fund_unrealized_value": float(nav[i]),
+                "tvpi": round(float(tvpi[i]), 3),
+                "dpi": round(float(dpi[i]), 3),
+                "rvpi": round(float(rvpi[i]), 3),
+                "lp_net_moic": round(float(lp_net_moic[i]), 4),
+                "fund_net_irr": round(float(net_irrs[i]), 4) if np.isfinite(net_irrs[i]) else None,
+            }
+            for i in range(len(points))
+        ],
+    }
+
+def calculate_metrics_timeseries(session: Session, fund_id: uuid.UUID, freq: str = "Q"):
+    return compute_metrics_timeseries(load_timeseries_inputs(session, fund_id), freq)
@@ -0,0 +1,131 @@
+from datetime import date
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from sqlmodel import Session, select
+from ..models import Fund, PortfolioCompany, ValuationMark
+from .money import to_cents
+import uuid
+
+# Valuation history and as-of lookups. A company's unrealized value on day D
+# is its last mark dated on or before D (valuation_marks); companies with no
+# recorded marks (created before the table) have one, their current
+# valuation, counted from last_round_date or the initial investment.
+#
+# MarkIndex holds the marks sorted by (company, date) as flat arrays, so an
+# as-of lookup for every company, or a fund's NAV at every period end, is
+# one searchsorted over them instead of a query per company.
+
+def running_totals_at(
+    group_index: np.ndarray, dates: np.ndarray, amounts: np.ndarray, point_index: np.ndarray, points: np.ndarray
+) -> np.ndarray:
+    # Per-group running total of `amounts` (cents) as of each (group, point)
+    # pair, every group in one sort: entries are keyed (group, day) so each
+    # group's history is a contiguous run, and a point's total is the cumsum
+    # at its position minus the cumsum where its group's run starts. Points
+    # of a group with no entries (index -1) are 0.
+    totals = np.zeros(len(points), dtype=np.int64)
+    if not len(dates) or not len(points):
+        return totals
+    days = dates.astype(np.int64)
+    point_days = points.astype(np.int64)
+    origin = min(days.min(), point_days.min())
+    span = max(days.max(), point_days.max()) - origin + 2
+    keys = group_index.astype(np.int64) * span + (days - origin)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    running = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(amounts[order])])
+    known = point_index >= 0
+    groups = point_index[known].astype(np.int64)
+    ends = np.searchsorted(keys, groups * span + (point_days[known] - origin), side="right")
+    starts = np.searchsorted(keys, groups * span, side="left")
+    totals[known] = running[ends] - running[starts]
+    return totals
+
+def as_days(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy().astype("datetime64[D]")
+
+def load_marks(session: Session, fund_ids: List[uuid.UUID], as_of: Optional[date] = None) -> pd.DataFrame:
+    # Every mark of the funds' companies dated on or before `as_of` (all by
+    # default) as (fund_id, company_id, date, cents), recorded marks in entry
+    # order within a day. Two queries whatever the number of companies.
+    marks_stmt = select(
+        ValuationMark.fund_id, ValuationMark.company_id, ValuationMark.mark_date, ValuationMark.value
+    ).where(ValuationMark.fund_id.in_(fund_ids)).order_by(
+        ValuationMark.company_id, ValuationMark.mark_date, ValuationMark.created_at, ValuationMark.id
+    )
+    # Companies without history: their current valuation, dated as before
+    current_date = func.coalesce(
+        PortfolioCompany.last_round_date, PortfolioCompany.initial_investment_date, Fund.fund_start_date
+    )
+    current_stmt = select(
+        PortfolioCompany.fund_id,
+        PortfolioCompany.id,
+        current_date,
+        PortfolioCompany.latest_post_money * PortfolioCompany.ownership_pct,
+    ).join(Fund, Fund.id == PortfolioCompany.fund_id).where(
+        PortfolioCompany.fund_id.in_(fund_ids),
+        PortfolioCompany.id.not_in(select(ValuationMark.company_id).where(ValuationMark.fund_id.in_(fund_ids))),
+    )
+    if as_of is not None:
+        marks_stmt = marks_stmt.where(ValuationMark.mark_date <= as_of)
+        current_stmt = current_stmt.where(current_date <= as_of)
+
+    rows = session.exec(marks_stmt).all() + session.exec(current_stmt).all()
+    marks = pd.DataFrame(rows, columns=["fund_id", "company_id", "date", "value"])
+    marks["cents"] = to_cents(marks["value"].astype(float).fillna(0))
+    return marks.drop(columns="value")
+
+class MarkIndex:
+    def __init__(self, marks: pd.DataFrame):
+        # `marks` as returned by load_marks
+        self.companies = pd.Index(marks["company_id"].unique())
+        self.funds = pd.Index(marks["fund_id"].unique())
+        company = self.companies.get_indexer(marks["company_id"])
+        days = as_days(marks["date"]).astype(np.int64)
+        self._origin = int(days.min()) if len(days) else 0
+        self._span = (int(days.max()) - self._origin + 2) if len(days) else 1
+
+        # Sorted by (company, day); a stable sort keeps same-day marks in entry order
+        keys = company.astype(np.int64) * self._span + (days - self._origin)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._company = company[order]
+        self._days = days[order].astype("datetime64[D]")
+        self._cents = marks["cents"].to_numpy(dtype=np.int64)[order]
+        self.company_funds = self.funds.get_indexer(
+            marks.drop_duplicates("company_id").set_index("company_id")["fund_id"].reindex(self.companies)
+        )
+
+        # What each mark changes the company's value by. A fund's NAV on day D
+        # is then the running total of its companies' changes up to D.
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = self._company[1:] != self._company[:-1]
+        self._deltas = self._cents - np.where(first, 0, np.roll(self._cents, 1))
+
+    def company_values(self, as_of: date) -> np.ndarray:
+        # Each company's value (cents) on `as_of`, in self.companies order:
+        # binary search for its last mark on or before that day
+        n = len(self.companies)
+        day = np.datetime64(as_of, "D").astype(np.int64) - self._origin
+        day = min(max(day, -1), self._span - 2)
+        positions = np.searchsorted(self._keys, np.arange(n, dtype=np.int64) * self._span + day, side="right") - 1
+        found = positions >= 0
+        found[found] = self._company[positions[found]] == np.arange(n)[found]
+        return np.where(found, self._cents[np.maximum(positions, 0)], 0)
+
+    def fund_nav(self, fund_ids, points: np.ndarray) -> np.ndarray:
+        # NAV (cents) of fund_ids[i] on points[i] (datetime64[D]), all pairs in one pass
+        return running_totals_at(
+            self.company_funds[self._company],
+            self._days,
+            self._deltas,
+            self.funds.get_indexer(pd.Index(fund_ids)),
+            np.asarray(points, dtype="datetime64[D]"),
+        )
+
+def fund_nav_at(session: Session, fund_id: uuid.UUID, as_of: date) -> int:
+    # The fund's unrealized value (cents) on `as_of`
+    marks = load_marks(session, [fund_id], as_of)
+    return int(MarkIndex(marks).fund_nav([fund_id], [np.datetime64(as_of, "D")])[0])
@@ -1,69 +1,315 @@
-from typing import List
+from datetime import date, datetime
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+import csv
+import io
+import time
+from sqlalchemy import bindparam, delete, func, insert, update
 from sqlmodel import Session, select
-from ..models import Fund, Transaction, WaterfallAllocation, TransactionType
+from ..instrumentation import timed
+from ..models import Fund, FundAggregate, Transaction, WaterfallAllocation, TransactionType
+from .aggregates import rebuild_aggregates, refresh_waterfall_totals
+from .cache import metrics_cache
+from .changes import next_change_seq, next_change_seqs
+from .money import cents, from_cents, round_cents, sum_cents, to_cents, units
+from .waterfall_engine import as_days, fund_tiers, is_incremental, run_waterfall
 import uuid
 
-def compute_waterfall(session: Session, fund_id: uuid.UUID):
-    # 1. Get fund details
-    fund = session.get(Fund, fund_id)
-    if not fund:
-        return
+# Remaining capital at or below half a cent counts as fully returned (float residue)
+CAPITAL_RETURNED_TOLERANCE = 0.005
+# Rows per executemany INSERT in rebuild_waterfalls
+REBUILD_INSERT_CHUNK_SIZE = 5000
 
-    # 2. Calculate Total Contributed (actual invested amounts)
+def _total_contributed(session: Session, fund_id: uuid.UUID) -> float:
     # According to readme: Total_Contributed = SUM(portfolio_companies.total_invested)
     # Or transaction-based: SUM(CASE WHEN tx.tx_type='capital_call' THEN tx.amount ELSE 0 END)
     # We'll use the transaction-based approach for better audit trail
-    total_contributed_stmt = select(Transaction).where(
+    stmt = select(sum_cents(Transaction.amount)).where(
+        Transaction.fund_id == fund_id,
+        Transaction.tx_type == TransactionType.capital_call
+    )
+    return units(session.exec(stmt).one())
+
+def _remaining_before(session: Session, fund_id: uuid.UUID, since: date) -> Optional[float]:
+    # remaining_capital_to_return never increases along the waterfall, so the
+    # smallest value dated before `since` is the state the replay continues from
+    stmt = select(func.min(WaterfallAllocation.remaining_capital_to_return)).where(
+        WaterfallAllocation.fund_id == fund_id,
+        WaterfallAllocation.distribution_date < since
+    )
+    return session.exec(stmt).one()
+
+def _capital_calls(session: Session, fund_id: uuid.UUID):
+    stmt = select(Transaction.transaction_date, Transaction.amount).where(
         Transaction.fund_id == fund_id,
         Transaction.tx_type == TransactionType.capital_call
     )
-    capital_calls = session.exec(total_contributed_stmt).all()
-    total_contributed = sum(tx.amount for tx in capital_calls)
+    rows = session.exec(stmt).all()
+    return as_days([row[0] for row in rows]), to_cents([row[1] for row in rows])
 
-    # 3. Get all distributions ordered by date
-    distributions_stmt = select(Transaction).where(
+def compute_waterfall(
+    session: Session, fund_id: uuid.UUID, since: Optional[date] = None, change_seq: Optional[int] = None
+):
+    # Full rebuild when `since` is None, otherwise rewrite only the allocations
+    # dated on or after `since`. The split itself is waterfall_engine's; this
+    # function only reads its inputs and persists the result.
+    # 0. Lock the fund before reading anything (changes.py): a recompute
+    # running concurrently in another process, or a write to the fund, waits
+    # for this one to commit instead of interleaving with inputs read before
+    # it. `change_seq` is passed by callers that already hold the lock.
+    if change_seq is None:
+        change_seq = next_change_seq(session, fund_id)
+
+    # 1. Get fund details and its tiers
+    fund = session.get(Fund, fund_id)
+    if not fund:
+        session.rollback()
+        return
+    tiers = fund_tiers(fund.extra_metadata)
+    incremental = is_incremental(tiers)
+
+    # 2. ROC/carry funds continue from the stored allocation state; hurdle
+    # tiers depend on the whole history, so they replay from the start
+    replay_from = since if incremental else None
+    remaining_capital_to_return = None
+    if replay_from is not None:
+        remaining_capital_to_return = _remaining_before(session, fund_id, replay_from)
+    if remaining_capital_to_return is None:
+        remaining_capital_to_return = _total_contributed(session, fund_id)
+
+    # 3. Get the replayed distributions in waterfall order (ties broken by insertion order)
+    distributions_stmt = select(Transaction.id, Transaction.transaction_date, Transaction.amount).where(
         Transaction.fund_id == fund_id,
         Transaction.tx_type == TransactionType.distribution
-    ).order_by(Transaction.transaction_date.asc())
+    )
+    if replay_from is not None:
+        distributions_stmt = distributions_stmt.where(Transaction.transaction_date >= replay_from)
+    distributions_stmt = distributions_stmt.order_by(
+        Transaction.transaction_date.asc(), Transaction.created_at.asc(), Transaction.id.asc()
+    )
     distributions = session.exec(distributions_stmt).all()
+    transaction_ids = [row[0] for row in distributions]
+    distribution_dates = [row[1] for row in distributions]
+
+    # 4. Run Waterfall Algorithm
+    call_dates, call_amounts = (None, None) if incremental else _capital_calls(session, fund_id)
+    with timed("waterfall"):
+        allocation = run_waterfall(
+            as_days(distribution_dates),
+            to_cents([row[2] for row in distributions]),
+            cents(remaining_capital_to_return),
+            fund.carry_pct,
+            tiers,
+            call_dates,
+            call_amounts,
+        )
+
+    # 5. Replace the affected waterfall allocations: one DELETE, one executemany INSERT
+    delete_stmt = delete(WaterfallAllocation).where(WaterfallAllocation.fund_id == fund_id)
+    if since is not None:
+        delete_stmt = delete_stmt.where(WaterfallAllocation.distribution_date >= since)
+    session.exec(delete_stmt)
+
+    columns = {name: from_cents(values).tolist() for name, values in allocation.items()}
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "fund_id": fund_id,
+            "transaction_id": transaction_ids[i],
+            "distribution_date": distribution_dates[i],
+            "created_at": created_at,
+            "change_seq": change_seq,
+            **{name: values[i] for name, values in columns.items()},
+        }
+        for i in range(len(distributions))
+        if since is None or distribution_dates[i] >= since
+    ]
+    if rows:
+        session.execute(insert(WaterfallAllocation), rows)
+    refresh_waterfall_totals(session, fund_id)
 
-    # 4. Clear existing waterfall allocations for this fund
-    existing_allocations_stmt = select(WaterfallAllocation).where(WaterfallAllocation.fund_id == fund_id)
-    existing_allocations = session.exec(existing_allocations_stmt).all()
-    for alloc in existing_allocations:
-        session.delete(alloc)
     session.commit()
+    metrics_cache.bump(fund_id)
+
+def _capital_assumed(session: Session, fund_id: uuid.UUID) -> Optional[float]:
+    # The capital the stored allocations were computed with: the balance
+    # before the first one (None when there are no allocations yet)
+    stmt = select(func.max(WaterfallAllocation.remaining_capital_to_return + WaterfallAllocation.roc_paid)).where(
+        WaterfallAllocation.fund_id == fund_id
+    )
+    return session.exec(stmt).one()
+
+def recompute_waterfall(
+    session: Session,
+    fund_id: uuid.UUID,
+    since: Optional[date] = None,
+    capital_changed: bool = False,
+    full: bool = False,
+):
+    # Brings the stored allocations up to date after committed writes: new
+    # distributions dated on or after `since`, and/or new capital calls.
+    # Several writes fold into one call (see jobs.py); the capital change is
+    # read back from the database, so a call already picked up by an earlier
+    # recompute is not counted twice. Everything is read under the fund's
+    # lock, taken first (see compute_waterfall).
+    change_seq = next_change_seq(session, fund_id)
+    if full:
+        compute_waterfall(session, fund_id, change_seq=change_seq)
+        return
+    shifted = False
+    if capital_changed:
+        fund = session.get(Fund, fund_id)
+        if fund and not is_incremental(fund_tiers(fund.extra_metadata)):
+            # The hurdle covers every call, so every allocation may change
+            compute_waterfall(session, fund_id, change_seq=change_seq)
+            return
+        assumed = _capital_assumed(session, fund_id)
+        added = 0.0 if assumed is None else round(_total_contributed(session, fund_id) - assumed, 2)
+        if added < -CAPITAL_RETURNED_TOLERANCE:
+            compute_waterfall(session, fund_id, change_seq=change_seq)
+            return
+        if added > CAPITAL_RETURNED_TOLERANCE:
+            # More capital to return: allocations before the first one that
+            # fully returned capital were pure ROC and only need their
+            # remaining balance raised; everything from that date on is replayed.
+            pivot_stmt = select(func.min(WaterfallAllocation.distribution_date)).where(
+                WaterfallAllocation.fund_id == fund_id,
+                WaterfallAllocation.remaining_capital_to_return <= CAPITAL_RETURNED_TOLERANCE
+            )
+            pivot = session.exec(pivot_stmt).one()
+
+            shift_stmt = update(WaterfallAllocation).where(WaterfallAllocation.fund_id == fund_id).values(
+                remaining_capital_to_return=round_cents(WaterfallAllocation.remaining_capital_to_return + added),
+                change_seq=change_seq,
+            )
+            if pivot is not None:
+                shift_stmt = shift_stmt.where(WaterfallAllocation.distribution_date < pivot)
+            session.exec(shift_stmt)
+            shifted = True
+            if pivot is not None:
+                since = pivot if since is None else min(since, pivot)
+
+    if since is not None:
+        # A distribution dated on or after the last allocation appends one row;
+        # a backdated one replays the tail from its date.
+        compute_waterfall(session, fund_id, since=since, change_seq=change_seq)
+    elif shifted:
+        session.commit()
+        metrics_cache.bump(fund_id)
+    else:
+        # Nothing to rewrite: give the sequence number back and release the lock
+        session.rollback()
 
-    # 5. Run Waterfall Algorithm
-    remaining_capital_to_return = total_contributed
-    carry_pct = fund.carry_pct
-
-    for dist in distributions:
-        gross = dist.amount
-        
-        roc_paid = min(remaining_capital_to_return, gross)
-        remaining_capital_to_return -= roc_paid
-        profit_portion = gross - roc_paid
-
-        gp_share = round(profit_portion * carry_pct, 2)
-        lp_share_profit = profit_portion - gp_share
-
-        lp_distribution = roc_paid + lp_share_profit
-        gp_distribution = gp_share
-
-        allocation = WaterfallAllocation(
-            fund_id=fund_id,
-            transaction_id=dist.id,
-            distribution_date=dist.transaction_date,
-            gross=gross,
-            roc_paid=roc_paid,
-            profit_portion=profit_portion,
-            lp_share=lp_share_profit, # profit share for LP
-            gp_share=gp_share,
-            lp_distribution=lp_distribution,
-            gp_distribution=gp_distribution,
-            remaining_capital_to_return=remaining_capital_to_return
+def _copy_allocations(session: Session, rows: List[dict]):
+    # COPY ... FROM STDIN through the psycopg2 connection: one round trip
+    # for any number of rows
+    columns = [column.name for column in WaterfallAllocation.__table__.columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {WaterfallAllocation.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
         )
-        session.add(allocation)
+    finally:
+        cursor.close()
 
-    session.commit()
+def _write_allocations(session: Session, rows: List[dict]):
+    bind = session.get_bind()
+    if bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2":
+        _copy_allocations(session, rows)
+        return
+    for start in range(0, len(rows), REBUILD_INSERT_CHUNK_SIZE):
+        session.execute(insert(WaterfallAllocation), rows[start:start + REBUILD_INSERT_CHUNK_SIZE])
+
+def rebuild_waterfalls(session: Session, fund_ids: List[uuid.UUID]) -> Dict[uuid.UUID, Tuple[int, float]]:
+    # Full rebuild of several funds at once: one query each for their funds,
+    # distributions and capital calls, one DELETE, then a bulk INSERT (COPY on
+    # Postgres). Returns fund_id -> (allocations, compute seconds); the caller
+    # commits. Same results as compute_waterfall(session, fund_id) per fund.
+    # One change per fund, which also locks the funds before their inputs are
+    # read (see compute_waterfall)
+    change_seqs = next_change_seqs(session, fund_ids)
+    funds = session.exec(
+        select(Fund.id, Fund.carry_pct, Fund.extra_metadata).where(Fund.id.in_(fund_ids))
+    ).all()
+    distributions = session.exec(
+        select(Transaction.fund_id, Transaction.id, Transaction.transaction_date, Transaction.amount)
+        .where(Transaction.fund_id.in_(fund_ids), Transaction.tx_type == TransactionType.distribution)
+        .order_by(Transaction.fund_id, Transaction.transaction_date, Transaction.created_at, Transaction.id)
+    ).all()
+    calls = session.exec(
+        select(Transaction.fund_id, Transaction.transaction_date, Transaction.amount)
+        .where(Transaction.fund_id.in_(fund_ids), Transaction.tx_type == TransactionType.capital_call)
+        .order_by(Transaction.fund_id)
+    ).all()
+    distributions_by_fund = {fund_id: list(rows) for fund_id, rows in groupby(distributions, key=lambda row: row[0])}
+    calls_by_fund = {fund_id: list(rows) for fund_id, rows in groupby(calls, key=lambda row: row[0])}
+
+    rows = []
+    totals = []
+    results = {}
+    created_at = datetime.utcnow()
+    for fund_id, carry_pct, extra_metadata in funds:
+        started = time.perf_counter()
+        fund_distributions = distributions_by_fund.get(fund_id, [])
+        fund_calls = calls_by_fund.get(fund_id, [])
+        call_amounts = to_cents([row[2] for row in fund_calls])
+        with timed("waterfall"):
+            allocation = run_waterfall(
+                as_days([row[2] for row in fund_distributions]),
+                to_cents([row[3] for row in fund_distributions]),
+                int(call_amounts.sum()),
+                carry_pct,
+                fund_tiers(extra_metadata),
+                as_days([row[1] for row in fund_calls]),
+                call_amounts,
+            )
+        columns = {name: from_cents(values).tolist() for name, values in allocation.items()}
+        rows.extend(
+            {
+                "id": uuid.uuid4(),
+                "fund_id": fund_id,
+                "transaction_id": distribution[1],
+                "distribution_date": distribution[2],
+                "created_at": created_at,
+                "change_seq": change_seqs[fund_id],
+                **{name: values[i] for name, values in columns.items()},
+            }
+            for i, distribution in enumerate(fund_distributions)
+        )
+        totals.append({
+            "aggregate_fund_id": fund_id,
+            "lp_total": units(allocation["lp_distribution"].sum()),
+            "gp_carry": units(allocation["gp_distribution"].sum()),
+        })
+        results[fund_id] = (len(fund_distributions), time.perf_counter() - started)
+
+    found = list(results)
+    session.exec(delete(WaterfallAllocation).where(WaterfallAllocation.fund_id.in_(found)))
+    if rows:
+        _write_allocations(session, rows)
+
+    # Waterfall totals from the arrays, in one executemany UPDATE; funds with
+    # no aggregate row yet get a full aggregate rebuild instead
+    aggregated = set(session.exec(select(FundAggregate.fund_id).where(FundAggregate.fund_id.in_(found))).all())
+    aggregates = FundAggregate.__table__
+    if aggregated:
+        session.execute(
+            update(aggregates)
+            .where(aggregates.c.fund_id == bindparam("aggregate_fund_id"))
+            .values(
+                lp_total_distributions=bindparam("lp_total"),
+                total_gp_carry=bindparam("gp_carry"),
+                updated_at=created_at,
+            ),
+            [row for row in totals if row["aggregate_fund_id"] in aggregated],
+        )
+    missing = [fund_id for fund_id in found if fund_id not in aggregated]
+    if missing:
+        rebuild_aggregates(session, missing)
+    return results
@@ -0,0 +1,172 @@
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+# Pure distribution waterfall over arrays. Each distribution's gross amount
+# passes through the fund's tiers in order; a tier takes what it is owed from
+# what the earlier tiers left and splits it between LP and GP. No per-row
+# branching: every tier is expressed through cumulative sums (see _fill).
+# Amounts are int64 cents (see money.py), so ROC and every LP/GP split add
+# back up to the gross exactly; tiers that scale by a rate round each row to
+# the nearest cent (ties to even).
+#
+# The arrays are one fund's distributions, or 2-D with the distributions on
+# the last axis: one independent waterfall per row sharing the capital and
+# tiers, e.g. one per simulated exit path (simulation.py).
+#
+# Tiers come from Fund.extra_metadata["waterfall"]["tiers"], e.g.
+#   [{"type": "roc"},
+#    {"type": "preferred_return", "rate": 0.08},
+#    {"type": "catch_up", "rate": 1.0},
+#    {"type": "carry"}]
+# and default to ROC then carry (the readme's base case).
+
+DEFAULT_TIERS: List[Dict[str, Any]] = [{"type": "roc"}, {"type": "carry"}]
+DAYS_PER_YEAR = 365.0
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Tier capacity below this (in cents) is float residue of a rate-based target
+FILL_TOLERANCE = 1e-6
+ALLOCATION_COLUMNS = (
+    "gross", "roc_paid", "profit_portion", "lp_share", "gp_share",
+    "lp_distribution", "gp_distribution", "remaining_capital_to_return",
+)
+
+def as_days(dates) -> np.ndarray:
+    if isinstance(dates, np.ndarray):
+        return dates.astype("datetime64[D]")
+    # date.toordinal() is far cheaper than numpy's per-object datetime parsing
+    ordinals = np.fromiter((d.toordinal() for d in dates), dtype=np.int64, count=len(dates))
+    return (ordinals - EPOCH_ORDINAL).astype("datetime64[D]")
+
+def _fill(amounts: np.ndarray, target) -> np.ndarray:
+    # Per-row intake of a tier that absorbs `amounts` until its cumulative
+    # intake reaches `target` (a scalar or a non-decreasing per-row array),
+    # i.e. taken[j] = min(amounts[j], target[j] - taken[:j].sum()). The running
+    # max of the cumulative overshoot gives what was turned away before each row.
+    # Integer (cents) amounts come back as whole cents. Runs along the last axis.
+    if not amounts.shape[-1]:
+        return amounts.copy()
+    if np.ndim(target) == 0:
+        # Fixed target: what is still owed before each row is a running
+        # subtraction, folded left to right exactly like `owed -= taken`
+        start = np.broadcast_to(target, amounts.shape[:-1] + (1,))
+        owed = np.subtract.accumulate(np.concatenate([start, amounts], axis=-1), axis=-1)[..., :-1]
+        return np.clip(owed, 0, amounts)
+    zero = np.zeros(amounts.shape[:-1] + (1,))
+    cumulative = np.cumsum(amounts, axis=-1)
+    before = np.concatenate([zero, cumulative[..., :-1]], axis=-1)
+    turned_away = np.maximum.accumulate(np.maximum(cumulative - target, 0.0), axis=-1)
+    capacity = target - (before - np.concatenate([zero, turned_away[..., :-1]], axis=-1))
+    # Float residue of the cumulative sums must not leave a full tier taking dust
+    capacity = np.where(capacity < FILL_TOLERANCE, 0.0, capacity)
+    taken = np.clip(capacity, 0.0, amounts)
+    return np.rint(taken).astype(amounts.dtype) if np.issubdtype(amounts.dtype, np.integer) else taken
+
+def _roc(ctx: Dict, tier: Dict, available: np.ndarray):
+    # Return of capital: everything to LPs until contributed capital is back
+    roc = _fill(available, ctx["capital_to_return"])
+    ctx["roc"] = roc
+    return roc, np.zeros_like(roc)
+
+def _preferred_return(ctx: Dict, tier: Dict, available: np.ndarray):
+    # Compounding hurdle: everything to LPs until ROC + pref paid so far, valued
+    # at the hurdle rate, covers every capital call at the same rate. In present
+    # value terms that target is a constant, so the tier is one _fill in PV.
+    rate = tier.get("rate", 0.08)
+    origin = ctx["call_dates"].min() if len(ctx["call_dates"]) else ctx["dates"].min()
+
+    def discount(dates):
+        return (1.0 + rate) ** -((dates - origin).astype(float) / DAYS_PER_YEAR)
+
+    hurdle_target = float((ctx["call_amounts"] * discount(ctx["call_dates"])).sum())
+    factor = discount(ctx["dates"])
+    roc = ctx.get("roc", np.zeros_like(available))
+    hurdle_paid = np.rint(_fill((available + roc) * factor, hurdle_target) / factor).astype(np.int64)
+    pref = np.clip(hurdle_paid - roc, 0, available)
+    ctx["pref"] = pref
+    return pref, np.zeros_like(pref)
+
+def _catch_up(ctx: Dict, tier: Dict, available: np.ndarray):
+    # GP takes `rate` of this tier until it holds the carry share of all
+    # profit paid so far: rate * X = carry * (pref + X), so the tier's
+    # capacity is carry * pref / (rate - carry) and grows with the pref paid
+    rate = tier.get("rate", 1.0)
+    carry = tier.get("carry", ctx["carry_pct"])
+    if rate <= carry:
+        raise ValueError("catch_up rate must exceed the carry percentage")
+    pref_paid = np.cumsum(ctx.get("pref", np.zeros_like(available)), axis=-1)
+    flow = _fill(available, carry * pref_paid / (rate - carry))
+    gp = np.rint(flow * rate).astype(np.int64)
+    return flow - gp, gp
+
+def _carry(ctx: Dict, tier: Dict, available: np.ndarray):
+    # Residual profit split; GP share rounded to the cent per distribution
+    gp = np.rint(available * tier.get("rate", ctx["carry_pct"])).astype(np.int64)
+    return available - gp, gp
+
+TIERS: Dict[str, Callable] = {
+    "roc": _roc,
+    "preferred_return": _preferred_return,
+    "catch_up": _catch_up,
+    "carry": _carry,
+}
+
+def fund_tiers(extra_metadata: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    tiers = ((extra_metadata or {}).get("waterfall") or {}).get("tiers") or DEFAULT_TIERS
+    unknown = [tier.get("type") for tier in tiers if tier.get("type") not in TIERS]
+    if unknown:
+        raise ValueError(f"Unknown waterfall tier type(s): {', '.join(map(str, unknown))}")
+    return tiers
+
+def is_incremental(tiers: List[Dict[str, Any]]) -> bool:
+    # ROC and carry only depend on the capital still to return, which the
+    # stored allocations carry forward; hurdle tiers need the whole history
+    return all(tier["type"] in ("roc", "carry") for tier in tiers)
+
+def run_waterfall(
+    dates: np.ndarray,
+    gross: np.ndarray,
+    capital_to_return: int,
+    carry_pct: float,
+    tiers: List[Dict[str, Any]] = DEFAULT_TIERS,
+    call_dates: Optional[np.ndarray] = None,
+    call_amounts: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    # `dates`/`gross` are the distributions in waterfall order; `gross`,
+    # `capital_to_return` and `call_amounts` are in cents. Returns one int64
+    # cents array per WaterfallAllocation column; profit left after the last
+    # tier goes to LPs.
+    gross = np.asarray(gross, dtype=np.int64)
+    ctx = {
+        "dates": as_days(dates),
+        "capital_to_return": int(capital_to_return),
+        "carry_pct": carry_pct,
+        "call_dates": as_days(call_dates if call_dates is not None else np.array([], dtype="datetime64[D]")),
+        "call_amounts": np.asarray(call_amounts if call_amounts is not None else [], dtype=np.int64),
+    }
+    if not gross.shape[-1]:
+        return {column: gross.copy() for column in ALLOCATION_COLUMNS}
+    available = gross.copy()
+    lp_profit = np.zeros_like(gross)
+    gp = np.zeros_like(gross)
+    for tier in tiers:
+        tier_lp, tier_gp = TIERS[tier["type"]](ctx, tier, available)
+        if tier["type"] != "roc":
+            lp_profit += tier_lp
+        gp += tier_gp
+        available = available - tier_lp - tier_gp
+    # Without a final carry tier the leftover profit is the LPs'
+    lp_profit += np.maximum(available, 0)
+
+    roc = ctx.get("roc", np.zeros_like(gross))
+    capital = np.broadcast_to(ctx["capital_to_return"], gross.shape[:-1] + (1,))
+    return {
+        "gross": gross,
+        "roc_paid": roc,
+        "profit_portion": gross - roc,
+        "lp_share": lp_profit,
+        "gp_share": gp,
+        "lp_distribution": roc + lp_profit,
+        "gp_distribution": gp,
+        "remaining_capital_to_return": np.subtract.accumulate(np.concatenate([capital, roc], axis=-1), axis=-1)[..., 1:],
+    }
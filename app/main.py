@@ -1,13 +1,17 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Session, select
-from typing import List
-from .database import engine, get_session, init_db
-from .models import Fund, PortfolioCompany, Transaction, WaterfallAllocation
-from .schemas import FundCreate, FundRead, PortfolioCompanyCreate, PortfolioCompanyRead, TransactionCreate, TransactionRead
-from .api import funds, companies, transactions, metrics
+from fastapi.responses import ORJSONResponse
+from .auth import get_current_user, token_verifier
+from .config import settings
+from .database import ReadAfterWriteMiddleware, engine, init_db, replica_pool
+from .api import funds, companies, transactions, fees, metrics, exports, jobs, changes, internal
+from .instrumentation import InstrumentationMiddleware
+from .logic.jobs import job_queue
+from .logic.simulation import shutdown_pool
 
-app = FastAPI(title="Fund Portfolio Management API")
+# orjson encodes the (already validated) response content several times
+# faster than the stdlib encoder
+app = FastAPI(title="Fund Portfolio Management API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,18 +19,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Fund-Version", "X-Computed-Version", "ETag"],
 )
+# Only with replicas configured: without them every read is on the primary already
+if replica_pool.replicas:
+    app.add_middleware(ReadAfterWriteMiddleware)
+# Added last so it wraps CORS too and times the whole request
+app.add_middleware(InstrumentationMiddleware)
 
 @app.on_event("startup")
 def on_startup():
     init_db()
-    pass
+    job_queue.start(engine)
+    replica_pool.start()
+    if settings.AUTH_VERIFY_JWT:
+        token_verifier.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    job_queue.stop()
+    replica_pool.stop()
+    token_verifier.stop()
+    shutdown_pool()
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Fund Portfolio Management API"}
 
-app.include_router(funds.router)
-app.include_router(companies.router)
-app.include_router(transactions.router)
-app.include_router(metrics.router)
+# Every router requires a bearer token (see auth.py)
+authenticated = [Depends(get_current_user)]
+app.include_router(funds.router, dependencies=authenticated)
+app.include_router(companies.router, dependencies=authenticated)
+app.include_router(transactions.router, dependencies=authenticated)
+app.include_router(fees.router, dependencies=authenticated)
+app.include_router(metrics.router, dependencies=authenticated)
+app.include_router(exports.router, dependencies=authenticated)
+app.include_router(jobs.router, dependencies=authenticated)
+app.include_router(changes.router, dependencies=authenticated)
+app.include_router(internal.router, dependencies=authenticated)
@@ -0,0 +1,52 @@
+from typing import List
+from sqlalchemy import Column, inspect
+from sqlmodel import SQLModel
+# Imported for its side effect: the tables register on SQLModel.metadata
+from . import models
+
+# create_all only creates missing tables. Columns and indexes added to
+# existing tables since (funds/companies/transactions/waterfall change_seq,
+# the keyset and change-feed indexes) are added here, so a database created
+# by an older version upgrades in place. Idempotent: run on every start.
+#
+# Only additive changes are handled: a new column must be nullable or have a
+# scalar default, which fills the existing rows (change_seq starts at 0, and
+# rows written before sequencing show up in since=0 snapshots).
+
+def _column_ddl(column: Column, dialect) -> str:
+    ddl = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        literal = column.type.literal_processor(dialect)
+        ddl += f" DEFAULT {literal(default) if literal else default}"
+    elif not column.nullable:
+        raise RuntimeError(
+            f"Can't add {column.table.name}.{column.name} to an existing table: "
+            "it is NOT NULL without a scalar default"
+        )
+    if not column.nullable:
+        ddl += " NOT NULL"
+    return ddl
+
+def create_schema(bind) -> List[str]:
+    # Creates missing tables, then adds missing columns and indexes to the
+    # existing ones; returns what it added (e.g. "transactions.change_seq")
+    SQLModel.metadata.create_all(bind)
+    added = []
+    with bind.begin() as connection:
+        inspector = inspect(connection)
+        preparer = connection.dialect.identifier_preparer
+        for table in SQLModel.metadata.sorted_tables:
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    connection.exec_driver_sql(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {_column_ddl(column, connection.dialect)}"
+                    )
+                    added.append(f"{table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    added.append(index.name)
+    return added
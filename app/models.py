@@ -2,7 +2,7 @@ from datetime import date, datetime
 from enum import Enum
 from typing import Optional, List, Dict, Any
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, Index, JSON
 import uuid
 
 class TransactionType(str, Enum):
@@ -29,6 +29,8 @@ class FundBase(SQLModel):
 class Fund(FundBase, table=True):
     __tablename__ = "funds"
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    # Latest change sequence number handed out for this fund (logic/changes.py)
+    change_seq: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -57,13 +59,39 @@ class PortfolioCompanyBase(SQLModel):
 
 class PortfolioCompany(PortfolioCompanyBase, table=True):
     __tablename__ = "portfolio_companies"
+    # Serves the fund's change feed (rows stamped after a sequence number)
+    __table_args__ = (Index("idx_company_fund_seq", "fund_id", "change_seq"),)
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    change_seq: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     fund: Fund = Relationship(back_populates="companies")
     transactions: List["Transaction"] = Relationship(back_populates="company")
 
+class ValuationMarkBase(SQLModel):
+    mark_date: date
+    post_money: float
+    # The company's ownership_pct at the time when not given
+    ownership_pct: Optional[float] = None
+
+class ValuationMark(ValuationMarkBase, table=True):
+    # Dated marks per company; the latest is also kept on the company row
+    # (latest_post_money / ownership_pct / last_round_date). See
+    # logic/valuations.py for the as-of lookups.
+    __tablename__ = "valuation_marks"
+    __table_args__ = (
+        Index("idx_mark_fund_company_date", "fund_id", "company_id", "mark_date"),
+        Index("idx_mark_fund_seq", "fund_id", "change_seq"),
+    )
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    fund_id: uuid.UUID = Field(foreign_key="funds.id")
+    company_id: uuid.UUID = Field(foreign_key="portfolio_companies.id")
+    # post_money * ownership_pct: the company's unrealized value from mark_date on
+    value: float = 0
+    change_seq: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class TransactionBase(SQLModel):
     fund_id: uuid.UUID = Field(foreign_key="funds.id")
     company_id: Optional[uuid.UUID] = Field(default=None, foreign_key="portfolio_companies.id")
@@ -77,7 +105,13 @@ class TransactionBase(SQLModel):
 
 class Transaction(TransactionBase, table=True):
     __tablename__ = "transactions"
+    # Serves keyset pagination on (transaction_date, id) within a fund
+    __table_args__ = (
+        Index("idx_tx_fund_date", "fund_id", "transaction_date", "id"),
+        Index("idx_tx_fund_seq", "fund_id", "change_seq"),
+    )
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    change_seq: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -99,5 +133,32 @@ class WaterfallAllocationBase(SQLModel):
 
 class WaterfallAllocation(WaterfallAllocationBase, table=True):
     __tablename__ = "waterfall_allocations"
+    __table_args__ = (
+        Index("idx_wf_fund_date", "fund_id", "distribution_date", "id"),
+        Index("idx_wf_fund_seq", "fund_id", "change_seq"),
+    )
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    change_seq: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Aggregates maintained on write (readme section 6: mv_fund_aggregates / mv_company_aggregates)
+class FundAggregate(SQLModel, table=True):
+    __tablename__ = "mv_fund_aggregates"
+    fund_id: uuid.UUID = Field(foreign_key="funds.id", primary_key=True)
+    total_contributed: float = 0
+    total_distributions: float = 0
+    total_fees: float = 0
+    fund_unrealized_value: float = 0
+    lp_total_distributions: float = 0
+    total_gp_carry: float = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CompanyAggregate(SQLModel, table=True):
+    __tablename__ = "mv_company_aggregates"
+    company_id: uuid.UUID = Field(foreign_key="portfolio_companies.id", primary_key=True)
+    fund_id: uuid.UUID = Field(foreign_key="funds.id", index=True)
+    total_invested: float = 0
+    realized_proceeds: float = 0
+    unrealized_value: float = 0
+    moic: float = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -1,6 +1,7 @@
+from datetime import date, datetime
 from typing import List, Optional, Dict, Any
 from sqlmodel import SQLModel, Field
-from .models import FundBase, PortfolioCompanyBase, TransactionBase, WaterfallAllocationBase
+from .models import FundBase, PortfolioCompanyBase, TransactionBase, ValuationMarkBase, WaterfallAllocationBase
 import uuid
 
 class FundCreate(FundBase):
@@ -8,24 +9,86 @@ class FundCreate(FundBase):
 
 class FundRead(FundBase):
     id: uuid.UUID
+    change_seq: int = 0
 
 class PortfolioCompanyCreate(PortfolioCompanyBase):
     fund_id: Optional[uuid.UUID] = None
 
 class PortfolioCompanyRead(PortfolioCompanyBase):
     id: uuid.UUID
+    change_seq: int = 0
+
+class ValuationMarkCreate(ValuationMarkBase):
+    pass
+
+class ValuationMarkRead(ValuationMarkBase):
+    id: uuid.UUID
+    fund_id: uuid.UUID
+    company_id: uuid.UUID
+    value: float
+    change_seq: int = 0
 
 class TransactionCreate(TransactionBase):
     fund_id: Optional[uuid.UUID] = None
 
 class TransactionRead(TransactionBase):
     id: uuid.UUID
+    change_seq: int = 0
+
+class TransactionBatchError(SQLModel):
+    row: int
+    error: str
+
+class TransactionBatchResult(SQLModel):
+    fund_id: uuid.UUID
+    received: int
+    inserted: int
+    errors: List[TransactionBatchError] = []
+    # Waterfall recompute job for the batch (GET /api/jobs/{job_id})
+    job_id: Optional[uuid.UUID] = None
+
+class FeeSchedulePeriod(SQLModel):
+    quarter: int
+    period_start: date
+    period_end: date
+    stepped_down: bool
+    basis: str
+    basis_amount: float
+    rate: float
+    amount: float
+    posted: bool
+
+class FeeScheduleResult(SQLModel):
+    fund_id: uuid.UUID
+    through: date
+    dry_run: bool
+    # Fee transactions written by this call
+    inserted: int
+    # Fees due that a concurrent call posted first
+    skipped: int = 0
+    periods: List[FeeSchedulePeriod]
 
 class WaterfallAllocationRead(WaterfallAllocationBase):
     id: uuid.UUID
+    change_seq: int = 0
+
+class FundChanges(SQLModel):
+    fund_id: uuid.UUID
+    since: int
+    # Pass as `since` next time. Rows stamped later than this may already be
+    # included and will come again; apply them as upserts.
+    seq: int
+    fund: FundRead
+    companies: List[PortfolioCompanyRead]
+    transactions: List[TransactionRead]
+    # Rewritten allocations get new ids: key them on transaction_id
+    waterfall: List[WaterfallAllocationRead]
+    marks: List[ValuationMarkRead] = []
 
 class FundMetrics(SQLModel):
     fund_id: uuid.UUID
+    # The date the metrics were computed for; None means today
+    as_of: Optional[date] = None
     total_contributed: float
     total_distributions: float
     total_fees: float
@@ -46,3 +109,100 @@ class FundMetrics(SQLModel):
     total_invested: float = 0.0
     total_value: float = 0.0
     irr: float = 0.0
+
+class CompanyMetrics(SQLModel):
+    company_id: uuid.UUID
+    name: str
+    stage: Optional[str] = None
+    status: str
+    total_invested: float
+    realized_proceeds: float
+    unrealized_value: float
+    total_value: float
+    moic: float
+    gross_irr: Optional[float] = None
+
+class FundCompanyMetrics(SQLModel):
+    fund_id: uuid.UUID
+    as_of: date
+    fund_gross_irr: Optional[float] = None
+    companies: List[CompanyMetrics]
+
+class FundMetricsPoint(SQLModel):
+    as_of: date
+    total_contributed: float
+    total_distributions: float
+    total_fees: float
+    lp_total_distributions: float
+    fund_unrealized_value: float
+    tvpi: float
+    dpi: float
+    rvpi: float
+    lp_net_moic: float
+    fund_net_irr: Optional[float] = None
+
+class FundMetricsTimeseries(SQLModel):
+    fund_id: uuid.UUID
+    freq: str
+    points: List[FundMetricsPoint]
+
+class ExitAssumption(SQLModel):
+    # Exit value = current mark (cost when unmarked) x lognormal multiple,
+    # zero with probability loss_probability; exit date uniform in the window
+    multiple_median: float = Field(1.0, gt=0)
+    multiple_sigma: float = Field(0.5, ge=0)
+    loss_probability: float = Field(0.0, ge=0, le=1)
+    exit_years_min: float = Field(1.0, ge=0)
+    exit_years_max: float = Field(5.0, ge=0)
+
+class SimulationRequest(SQLModel):
+    paths: int = Field(10000, ge=1, le=200000)
+    seed: Optional[int] = Field(None, ge=0)
+    default: ExitAssumption = ExitAssumption()
+    # Overrides by PortfolioCompany.stage, then by company id (most specific wins)
+    stages: Dict[str, ExitAssumption] = {}
+    companies: Dict[uuid.UUID, ExitAssumption] = {}
+
+class SimulationDistribution(SQLModel):
+    mean: Optional[float] = None
+    solved: int = 0
+    p5: Optional[float] = None
+    p25: Optional[float] = None
+    p50: Optional[float] = None
+    p75: Optional[float] = None
+    p95: Optional[float] = None
+
+class SimulationResult(SQLModel):
+    fund_id: uuid.UUID
+    as_of: date
+    paths: int
+    seed: int
+    companies: int
+    net_tvpi: SimulationDistribution
+    net_irr: SimulationDistribution
+    gp_carry: SimulationDistribution
+
+class RecomputeJob(SQLModel):
+    id: uuid.UUID
+    kind: str
+    fund_id: uuid.UUID
+    status: str
+    since: Optional[date] = None
+    capital_changed: bool
+    full: bool
+    # The fund's requested version this job brings the results up to
+    version: int
+    # Writes coalesced into this job
+    writes: int
+    enqueued_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class FundJobStatus(SQLModel):
+    fund_id: uuid.UUID
+    requested_version: int
+    computed_version: int
+    fresh: bool
+    # Newest first
+    jobs: List[RecomputeJob] = []
@@ -0,0 +1,488 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from fractions import Fraction
+import numpy as np
+from pyxirr import xirr as pyxirr_xirr
+from app.logic.irr import SOLVED, pad_series, solve_padded, xirr
+from app.logic.money import CENTS, from_cents, to_cents
+from app.logic.waterfall_engine import run_waterfall
+
+# Compute-layer benchmarks, run without a database:
+#   python benchmark.py xirr --series 5000
+#   python benchmark.py waterfall --distributions 1000000
+#   python benchmark.py money --money-rows 5000000
+#   python benchmark.py auth --auth-calls 5000
+# Database benchmarks on generated funds (generate_data.py), one fund per scale:
+#   python benchmark.py fund_metrics compute_waterfall fee_schedule endpoints post_transaction --scale 1 10 100
+# Every run can be saved as JSON and compared with an earlier one:
+#   python benchmark.py --output bench/HEAD.json --compare bench/main.json
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def _latency(fn, repeat: int):
+    # Milliseconds per call over `repeat` calls
+    samples = []
+    for _ in range(repeat):
+        _, seconds = _timed(fn)
+        samples.append(seconds * 1000)
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[max(int(len(samples) * 0.95) - 1, 0)], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+def _fund_cashflows(rng: np.random.Generator, n_series: int, max_flows: int):
+    # Conventional fund histories: calls first, then distributions, so every
+    # series has exactly one IRR and results can be compared to pyxirr
+    series = []
+    start = date(2012, 1, 1)
+    for _ in range(n_series):
+        n = int(rng.integers(4, max_flows + 1))
+        calls = int(rng.integers(1, n))
+        days = np.sort(rng.integers(0, 3650, n))
+        amounts = np.concatenate([
+            -rng.uniform(1e5, 5e6, calls),
+            rng.uniform(1e4, 5e6, n - calls) * rng.uniform(0.1, 4) * calls / (n - calls),
+        ])
+        series.append(([start + timedelta(days=int(day)) for day in days], amounts))
+    return series
+
+def bench_xirr(args):
+    rng = np.random.default_rng(args.seed)
+    series = _fund_cashflows(rng, args.series, args.max_flows)
+
+    (times, amounts), pad_seconds = _timed(pad_series, series)
+    batch, batch_seconds = _timed(solve_padded, times, amounts)
+    reference, pyxirr_seconds = _timed(lambda: np.array([pyxirr_xirr(d, a) or np.nan for d, a in series], dtype=float))
+
+    # The single-series wrapper is slow per call, so time a sample and scale it
+    sample = series[:args.loop_sample]
+    _, loop_seconds = _timed(lambda: [xirr(d, a) for d, a in sample])
+    loop_seconds *= len(series) / max(len(sample), 1)
+
+    solved = np.isin(batch["status"], SOLVED) & np.isfinite(reference)
+    error = np.abs(batch["rates"][solved] - reference[solved]) / np.maximum(1.0, np.abs(reference[solved]))
+
+    print(f"xirr: {len(series)} series, up to {args.max_flows} flows, padded {times.shape[0]}x{times.shape[1]}")
+    print(f"  batch (pad + solve)      {(pad_seconds + batch_seconds) * 1000:10.1f} ms  (pad {pad_seconds * 1000:.1f} ms)")
+    print(f"  per-series loop, irr     {loop_seconds * 1000:10.1f} ms  (estimated from {len(sample)} series)")
+    print(f"  per-series loop, pyxirr  {pyxirr_seconds * 1000:10.1f} ms")
+    print(f"  speedup vs irr loop      {loop_seconds / (pad_seconds + batch_seconds):10.1f}x")
+    print(f"  max rel. error vs pyxirr {error.max() if len(error) else 0.0:10.2e}")
+    print(f"  status                   {dict(Counter(batch['status']))}")
+    print(f"  newton iterations p50/p99/max {np.percentile(batch['iterations'], [50, 99, 100]).astype(int).tolist()}")
+    return {
+        "series": len(series),
+        "batch_ms": round((pad_seconds + batch_seconds) * 1000, 3),
+        "pad_ms": round(pad_seconds * 1000, 3),
+        "irr_loop_ms": round(loop_seconds * 1000, 3),
+        "pyxirr_loop_ms": round(pyxirr_seconds * 1000, 3),
+        "max_rel_error": float(error.max()) if len(error) else 0.0,
+    }
+
+def _waterfall_loop(gross, remaining, carry_pct):
+    # The per-row ROC/carry loop compute_waterfall used to run, minus the ORM
+    rows = []
+    for amount in gross:
+        roc_paid = min(remaining, amount)
+        remaining -= roc_paid
+        profit = amount - roc_paid
+        gp_share = round(profit * carry_pct, 2)
+        lp_share = profit - gp_share
+        rows.append((roc_paid, profit, lp_share, gp_share, roc_paid + lp_share, remaining))
+    return rows
+
+def bench_waterfall(args):
+    rng = np.random.default_rng(args.seed)
+    n = args.distributions
+    dates = np.datetime64("2015-01-01") + np.sort(rng.integers(0, 3650, n))
+    gross = np.round(rng.uniform(1e3, 5e6, n), 2)
+    # The engine works in cents; the loop below in float units
+    gross_cents = to_cents(gross)
+    capital = int(gross_cents[: n // 3].sum())
+    call_dates = dates[: max(n // 10, 1)]
+    call_amounts = np.full(len(call_dates), capital // len(call_dates))
+    hurdle_tiers = [
+        {"type": "roc"},
+        {"type": "preferred_return", "rate": 0.08},
+        {"type": "catch_up", "rate": 1.0},
+        {"type": "carry"},
+    ]
+
+    simple, simple_seconds = _timed(run_waterfall, dates, gross_cents, capital, 0.2)
+    hurdle, hurdle_seconds = _timed(run_waterfall, dates, gross_cents, capital, 0.2, hurdle_tiers, call_dates, call_amounts)
+    loop, loop_seconds = _timed(_waterfall_loop, gross.tolist(), capital / CENTS, 0.2)
+    loop = np.array(loop)
+    columns = ["roc_paid", "profit_portion", "lp_share", "gp_share", "lp_distribution", "remaining_capital_to_return"]
+    diff = max(float(np.abs(from_cents(simple[column]) - loop[:, i]).max()) for i, column in enumerate(columns))
+    # Every distribution splits into LP + GP to the cent, whatever the tiers
+    exact_split = all(
+        np.array_equal(allocation["lp_distribution"] + allocation["gp_distribution"], gross_cents)
+        for allocation in (simple, hurdle)
+    )
+
+    print(f"waterfall: {n} distributions")
+    print(f"  engine, roc + carry          {simple_seconds * 1000:10.1f} ms")
+    print(f"  engine, with pref + catch-up {hurdle_seconds * 1000:10.1f} ms")
+    print(f"  per-row python loop          {loop_seconds * 1000:10.1f} ms")
+    print(f"  max abs diff vs loop         {diff:10.2e}")
+    print(f"  lp + gp == gross (cents)     {exact_split!s:>10}")
+    return {
+        "distributions": n,
+        "engine_ms": round(simple_seconds * 1000, 3),
+        "engine_hurdle_ms": round(hurdle_seconds * 1000, 3),
+        "loop_ms": round(loop_seconds * 1000, 3),
+        "max_abs_diff": diff,
+        "exact_split": exact_split,
+    }
+
+def _running_total(amounts):
+    # How a total kept in a float column grows: one += per transaction
+    total = 0.0
+    for amount in amounts:
+        total += amount
+    return total
+
+def _drift_cents(total: float, expected_cents: int) -> float:
+    # Exact difference between a float total and the true sum, in cents
+    return float(abs(Fraction(total) * CENTS - expected_cents))
+
+def bench_money(args):
+    # Totals over many cent amounts: float += per object (the old metrics and
+    # aggregate paths), a float64 numpy sum, and the int64 cents sum. The
+    # true total is the integer sum of the cents themselves.
+    rng = np.random.default_rng(args.seed)
+    n = args.money_rows
+    exact = rng.integers(1, 500_000_000, n)
+    amounts = exact / CENTS
+    expected = int(exact.sum())
+    values = amounts.tolist()
+
+    running, running_seconds = _timed(_running_total, values)
+    float_sum, float_seconds = _timed(np.sum, amounts)
+    as_cents, convert_seconds = _timed(to_cents, amounts)
+    cents_sum, cents_seconds = _timed(np.sum, as_cents)
+    results = {
+        "float += per object": (running_seconds, _drift_cents(running, expected)),
+        "numpy float64 sum": (float_seconds, _drift_cents(float(float_sum), expected)),
+        "int64 cents sum": (cents_seconds, float(abs(int(cents_sum) - expected))),
+        "to_cents + int64 sum": (convert_seconds + cents_seconds, float(abs(int(cents_sum) - expected))),
+    }
+
+    print(f"money: {n} amounts, true total {expected / CENTS:,.2f}")
+    for label, (seconds, drift) in results.items():
+        print(f"  {label:<26} {seconds * 1000:10.1f} ms   drift {drift:12.4f} cents")
+    return {
+        "amounts": n,
+        **{
+            label.replace(" ", "_").replace("+", "and"): {"ms": round(seconds * 1000, 3), "drift_cents": drift}
+            for label, (seconds, drift) in results.items()
+        },
+        "exact": int(cents_sum) == expected,
+    }
+
+def _per_call_us(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return round((time.perf_counter() - started) / calls * 1e6, 2)
+
+def _signing_jwks(path: str):
+    # An RSA and an EC signing key, published the way Supabase does
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    from jose import jwk
+
+    private = {
+        "RS256": rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        "ES256": ec.generate_private_key(ec.SECP256R1()),
+    }
+    pems, keys = {}, []
+    for algorithm, key in private.items():
+        pems[algorithm] = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        public = jwk.construct(pems[algorithm], algorithm).public_key().to_dict()
+        keys.append({**public, "kid": algorithm.lower(), "alg": algorithm, "use": "sig"})
+    with open(path, "w") as f:
+        json.dump({"keys": keys}, f)
+    return pems
+
+def bench_auth(args):
+    # Per-request cost of get_current_user's checks: the header-only
+    # placeholder, a full signature check per algorithm (cache cleared before
+    # every call) and a verified-token cache hit
+    import tempfile
+    from jose import jwt
+    from app.auth import TokenVerifier
+
+    secret = "benchmark-secret"
+    with tempfile.TemporaryDirectory() as directory:
+        jwks_path = os.path.join(directory, "jwks.json")
+        pems = _signing_jwks(jwks_path)
+        verifier = TokenVerifier(secret, jwks_path, "", "authenticated", cache_entries=10000, refresh_seconds=0)
+    claims = {"sub": "benchmark-user", "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 3600}
+    tokens = {
+        "HS256": jwt.encode(claims, secret, algorithm="HS256"),
+        **{
+            algorithm: jwt.encode(claims, pem, algorithm=algorithm, headers={"kid": algorithm.lower()})
+            for algorithm, pem in pems.items()
+        },
+    }
+    header = f"Bearer {tokens['HS256']}"
+
+    def uncached(token):
+        verifier.cache.clear()
+        verifier.verify(token)
+
+    results = {"header only": _per_call_us(lambda: header.startswith("Bearer ") and header[7:], args.auth_calls)}
+    for algorithm, token in tokens.items():
+        results[f"{algorithm} verify"] = _per_call_us(lambda: uncached(token), args.auth_calls)
+        verifier.verify(token)
+        results[f"{algorithm} cached"] = _per_call_us(lambda: verifier.verify(token), args.auth_calls)
+
+    print(f"auth: microseconds per request ({args.auth_calls} calls each)")
+    for label, us in results.items():
+        print(f"  {label:<24} {us:10.2f} us")
+    return results
+
+# Database cases: the app modules are imported inside each case, once main()
+# has pointed DATABASE_URL at the benchmark database
+
+DEFAULT_DATABASE = "./benchmark.db"
+LIST_ENDPOINTS = [
+    "/api/funds/",
+    "/api/funds/{fund_id}/companies",
+    "/api/funds/{fund_id}/transactions",
+    "/api/funds/{fund_id}/transactions?limit=100",
+    "/api/funds/{fund_id}/waterfall",
+]
+# Any token passes with AUTH_VERIFY_JWT off, which main() sets
+BENCHMARK_HEADERS = {"Authorization": "Bearer benchmark"}
+
+_funds = {}
+
+def _scaled_funds(args):
+    # One generated fund per scale (companies x scale), shared by every case
+    if not _funds:
+        from sqlmodel import Session, SQLModel
+        from app.database import engine
+        from generate_data import generate
+
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            for scale in args.scale:
+                (fund_id,), seconds = _timed(
+                    generate, session, 1, args.companies * scale, args.transactions, args.years, args.seed + scale
+                )
+                _funds[scale] = fund_id
+                print(f"generated {scale}x fund: {args.companies * scale} companies, "
+                      f"{args.companies * scale * args.transactions} company transactions ({seconds:.1f}s)")
+    return _funds
+
+def _print_latencies(title: str, results):
+    print(title)
+    for label, latency in results.items():
+        print(f"  {label:<52} p50 {latency['p50_ms']:9.2f} ms  p95 {latency['p95_ms']:9.2f} ms  max {latency['max_ms']:9.2f} ms")
+
+def bench_fund_metrics(args):
+    from sqlmodel import Session
+    from app.database import engine
+    from app.logic.metrics import calculate_fund_metrics
+
+    def run(fund_id):
+        with Session(engine) as session:
+            return calculate_fund_metrics(session, fund_id)
+
+    results = {f"{scale}x": _latency(lambda: run(fund_id), args.repeat) for scale, fund_id in _scaled_funds(args).items()}
+    _print_latencies("calculate_fund_metrics", results)
+    return results
+
+def bench_compute_waterfall(args):
+    from sqlmodel import Session
+    from app.database import engine
+    from app.logic.waterfall import compute_waterfall
+
+    def run(fund_id):
+        with Session(engine) as session:
+            return compute_waterfall(session, fund_id)
+
+    results = {f"{scale}x": _latency(lambda: run(fund_id), args.repeat) for scale, fund_id in _scaled_funds(args).items()}
+    _print_latencies("compute_waterfall (full rebuild)", results)
+    return results
+
+def bench_fee_schedule(args):
+    # Dry-run fee schedule for every generated fund: one vectorized pass over
+    # all of them against one pass per fund
+    from sqlmodel import Session
+    from app.database import engine
+    from app.logic.fees import compute_fee_schedule, load_fee_inputs
+
+    fund_ids = list(_scaled_funds(args).values())
+
+    def run(ids):
+        with Session(engine) as session:
+            return compute_fee_schedule(load_fee_inputs(session, ids))
+
+    results = {
+        f"{len(fund_ids)} funds, one pass": _latency(lambda: run(fund_ids), args.repeat),
+        f"{len(fund_ids)} funds, per fund": _latency(lambda: [run([fund_id]) for fund_id in fund_ids], args.repeat),
+    }
+    _print_latencies("fee schedule (dry run)", results)
+    return results
+
+def bench_endpoints(args):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    results = {}
+    funds = _scaled_funds(args)
+    with TestClient(app, headers=BENCHMARK_HEADERS) as client:
+        for scale, fund_id in funds.items():
+            for endpoint in LIST_ENDPOINTS:
+                path = endpoint.format(fund_id=fund_id)
+                client.get(path).raise_for_status()
+                results[f"{scale}x GET {endpoint}"] = _latency(lambda: client.get(path), args.repeat)
+    _print_latencies("list endpoints", results)
+    return results
+
+def bench_post_transaction(args):
+    # Appends after every generated date, so the waterfall takes its usual
+    # incremental path; capital calls also move the capital to return
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    results = {}
+    day = iter(range(10**6))
+    funds = _scaled_funds(args)
+    with TestClient(app, headers=BENCHMARK_HEADERS) as client:
+        for scale, fund_id in funds.items():
+            for tx_type in ("distribution", "capital_call"):
+                def post():
+                    response = client.post(f"/api/funds/{fund_id}/transactions", json={
+                        "transaction_date": (date(2045, 1, 1) + timedelta(days=next(day))).isoformat(),
+                        "amount": 10000.0,
+                        "tx_type": tx_type,
+                    })
+                    response.raise_for_status()
+
+                results[f"{scale}x POST {tx_type}"] = _latency(post, args.repeat)
+    _print_latencies("POST /api/funds/{fund_id}/transactions", results)
+    return results
+
+# Run in this order; post_transaction last since it adds rows
+CASES = {
+    "xirr": bench_xirr,
+    "waterfall": bench_waterfall,
+    "money": bench_money,
+    "auth": bench_auth,
+    "fund_metrics": bench_fund_metrics,
+    "compute_waterfall": bench_compute_waterfall,
+    "fee_schedule": bench_fee_schedule,
+    "endpoints": bench_endpoints,
+    "post_transaction": bench_post_transaction,
+}
+
+def _git_commit():
+    def git(*command):
+        return subprocess.run(
+            ["git", *command], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    try:
+        commit = git("rev-parse", "--short", "HEAD")
+        dirty = bool(git("status", "--porcelain"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+def _timings(results, prefix=""):
+    # Flattened {"case / label / p50_ms": value} for every *_ms entry
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_timings(value, f"{name} / "))
+        elif key.endswith("_ms"):
+            flat[name] = value
+    return flat
+
+def compare(previous, current):
+    before = _timings(previous["results"])
+    after = _timings(current["results"])
+    print(f"compared with {previous.get('commit')} ({previous.get('created_at')})")
+    for name, value in after.items():
+        if name in before and before[name]:
+            print(f"  {name:<78} {before[name]:10.2f} -> {value:10.2f} ms  {value / before[name]:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute-layer benchmarks")
+    parser.add_argument("case", nargs="*", choices=[[]] + list(CASES), help="Cases to run (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--series", type=int, default=5000, help="xirr: number of cash flow series")
+    parser.add_argument("--max-flows", type=int, default=120, help="xirr: longest series")
+    parser.add_argument("--loop-sample", type=int, default=500, help="xirr: series timed in the per-series loop")
+    parser.add_argument("--distributions", type=int, default=1_000_000, help="waterfall: number of distributions")
+    parser.add_argument("--money-rows", type=int, default=5_000_000, help="money: amounts summed")
+    parser.add_argument("--auth-calls", type=int, default=5000, help="auth: calls timed per check")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100], help="database: fund sizes to generate")
+    parser.add_argument("--companies", type=int, default=20, help="database: companies in the 1x fund")
+    parser.add_argument("--transactions", type=int, default=10, help="database: transactions per company")
+    parser.add_argument("--years", type=float, default=10, help="database: date spread of each fund")
+    parser.add_argument("--repeat", type=int, default=20, help="database: calls timed per measurement")
+    parser.add_argument("--database-url", help=f"database: target database (default: a fresh {DEFAULT_DATABASE})")
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        if os.path.exists(DEFAULT_DATABASE):
+            os.remove(DEFAULT_DATABASE)
+        args.database_url = f"sqlite:///{DEFAULT_DATABASE}"
+    # Settings are read when the app is first imported: no SQL echo and no
+    # cache unless asked for, so reads measure the queries
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("SQL_ECHO", "false")
+    os.environ.setdefault("CACHE_BACKEND", "none")
+    # The auth case measures verification on its own
+    os.environ["AUTH_VERIFY_JWT"] = "false"
+    # app.config is already loaded (irr imports instrumentation), so re-read
+    # it for the database cases, which import the app only when they run
+    from app.config import Settings, settings
+    for name, value in Settings().model_dump().items():
+        setattr(settings, name, value)
+
+    results = {}
+    for name in [name for name in CASES if name in (args.case or CASES)]:
+        results[name] = CASES[name](args)
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": args.database_url.split(":", 1)[0],
+        "args": {key: value for key, value in vars(args).items() if key not in ("database_url", "output", "compare")},
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+if __name__ == "__main__":
+    main()
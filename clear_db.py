@@ -1,5 +1,5 @@
 from sqlmodel import Session, create_engine, select, delete
-from app.models import Fund, PortfolioCompany, Transaction, WaterfallAllocation
+from app.models import CompanyAggregate, Fund, FundAggregate, PortfolioCompany, Transaction, WaterfallAllocation
 from app.config import settings
 import os
 
@@ -12,6 +12,8 @@ def clear_database():
         print("Clearing database...")
         
         # Delete in order of dependencies
+        session.exec(delete(CompanyAggregate))
+        session.exec(delete(FundAggregate))
         session.exec(delete(WaterfallAllocation))
         session.exec(delete(Transaction))
         session.exec(delete(PortfolioCompany))
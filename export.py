@@ -0,0 +1,63 @@
+from concurrent.futures import ProcessPoolExecutor
+from sqlmodel import Session, create_engine, select
+from app.config import settings
+from app.logic.export import DATASETS, WRITERS, export_filename, export_to_file
+from app.models import Fund
+import argparse
+import os
+import time
+import uuid
+
+# Fund exports to files, one per fund and dataset:
+#   python export.py transactions csv --fund-id <uuid> --out-dir exports
+#   python export.py waterfall parquet --all-funds --workers 4
+# Portfolio-wide runs export each fund in its own worker process.
+
+def _export_fund(database_url: str, fund_id: uuid.UUID, dataset: str, fmt: str, out_dir: str):
+    # Worker entry point: its own engine, as connections can't cross processes
+    engine = create_engine(database_url)
+    try:
+        with Session(engine) as session:
+            fund = session.get(Fund, fund_id)
+            if fund is None:
+                return fund_id, None, 0
+            path = os.path.join(out_dir, export_filename(fund.fund_code, fund_id, dataset, fmt))
+            return fund_id, path, export_to_file(session, fund_id, dataset, fmt, path)
+    finally:
+        engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export fund datasets to CSV, XLSX or Parquet files")
+    parser.add_argument("dataset", choices=list(DATASETS))
+    parser.add_argument("format", choices=list(WRITERS))
+    parser.add_argument("--fund-id", action="append", type=uuid.UUID, help="Fund to export (repeatable)")
+    parser.add_argument("--all-funds", action="store_true", help="Export every fund, one file each")
+    parser.add_argument("--out-dir", default="exports")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel exports with --all-funds")
+    args = parser.parse_args()
+    if not args.fund_id and not args.all_funds:
+        parser.error("pass --fund-id or --all-funds")
+
+    database_url = os.getenv("DATABASE_URL", settings.DATABASE_URL)
+    fund_ids = args.fund_id or []
+    if args.all_funds:
+        engine = create_engine(database_url)
+        with Session(engine) as session:
+            fund_ids = session.exec(select(Fund.id)).all()
+        engine.dispose()
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    jobs = [(database_url, fund_id, args.dataset, args.format, args.out_dir) for fund_id in fund_ids]
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            results = list(pool.map(_export_fund, *zip(*jobs)))
+    else:
+        results = [_export_fund(*job) for job in jobs]
+
+    for fund_id, path, written in results:
+        print(f"{fund_id}: {path} ({written} bytes)" if path else f"{fund_id}: fund not found")
+    print(f"Exported {sum(1 for _, path, _ in results if path)} files in {time.perf_counter() - started:.1f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+from sqlalchemy import insert
+from sqlmodel import Session, create_engine
+from app.config import settings
+from app.logic.aggregates import rebuild_aggregates
+from app.logic.ingest import BULK_INSERT_CHUNK_SIZE
+from app.logic.waterfall import compute_waterfall
+from app.migrations import create_schema
+from app.models import Fund, PortfolioCompany, Transaction, TransactionType
+from datetime import date, datetime, timedelta
+from typing import List
+import argparse
+import numpy as np
+import os
+import time
+import uuid
+
+# Synthetic funds for sizing and benchmarks, written with bulk inserts:
+#   python generate_data.py --funds 10 --companies 50 --transactions 20 --years 10
+# Each company gets its calls in the first half of the date spread and its
+# distributions after that; each fund also pays quarterly management fees.
+
+STAGES = ["pre_seed", "seed", "series_a", "series_b", "series_c", "growth"]
+# Share of a company's transactions that are capital calls (the rest distribute)
+CALL_SHARE = 0.6
+
+def _dates(start: date, days: np.ndarray) -> List[date]:
+    origin = start.toordinal()
+    return [date.fromordinal(origin + day) for day in days.tolist()]
+
+def _insert(session: Session, model, rows: List[dict]):
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        session.execute(insert(model), rows[start:start + BULK_INSERT_CHUNK_SIZE])
+
+def _fund_rows(rng: np.random.Generator, index: int, n_companies: int, n_transactions: int, years: float, created_at: datetime):
+    fund_id = uuid.uuid4()
+    start = date(2010, 1, 1) + timedelta(days=int(rng.integers(0, 3650)))
+    span = max(int(years * 365), 2)
+    fund = {
+        "id": fund_id,
+        "name": f"Synthetic Fund {index + 1}",
+        "fund_code": f"SYN-{index + 1:04d}",
+        "fund_start_date": start,
+        "fund_tenor_years": max(int(np.ceil(years)), 1),
+        "total_commitment": 0.0,
+        "management_fee_pct": 0.02,
+        "carry_pct": 0.2,
+        "investment_period_years": max(int(years // 2), 1),
+        "fee_calc_method": "committed",
+        "extra_metadata": {"synthetic": True},
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+    n_calls = max(1, int(round(n_transactions * CALL_SHARE)))
+    n_distributions = max(n_transactions - n_calls, 0)
+    company_ids = [uuid.uuid4() for _ in range(n_companies)]
+
+    # (companies x transactions) at once: calls in the first half of the
+    # spread, distributions in the second; returns are lognormal per company
+    call_days = np.sort(rng.integers(0, span // 2, (n_companies, n_calls)), axis=1)
+    call_amounts = np.round(rng.lognormal(np.log(1e6), 0.8, (n_companies, n_calls)), 2)
+    invested = call_amounts.sum(axis=1)
+    multiples = rng.lognormal(0.0, 1.0, n_companies)
+    distribution_days = np.sort(rng.integers(span // 2, span, (n_companies, n_distributions)), axis=1)
+    weights = rng.dirichlet(np.ones(n_distributions), n_companies) if n_distributions else np.zeros((n_companies, 0))
+    # Realize part of the value; the rest stays as the current mark
+    realized = rng.uniform(0.2, 1.0, n_companies)
+    distribution_amounts = np.round(weights * (invested * multiples * realized)[:, None], 2)
+
+    companies = []
+    transactions = []
+    for i, company_id in enumerate(company_ids):
+        ownership_pct = float(rng.uniform(0.02, 0.25))
+        unrealized = float(invested[i] * multiples[i] * (1 - realized[i]))
+        companies.append({
+            "id": company_id,
+            "fund_id": fund_id,
+            "name": f"Company {index + 1}-{i + 1}",
+            "stage": STAGES[int(rng.integers(0, len(STAGES)))],
+            "initial_investment_amount": float(call_amounts[i, 0]),
+            "initial_investment_date": start + timedelta(days=int(call_days[i, 0])),
+            "follow_on_reserved_amount": 0.0,
+            "is_follow_on_used": False,
+            "total_invested": float(invested[i]),
+            "ownership_pct": ownership_pct,
+            "latest_post_money": round(unrealized / ownership_pct, 2),
+            "status": "active",
+            "exit_proceeds": 0.0,
+            "extra_metadata": {},
+            "created_at": created_at,
+            "updated_at": created_at,
+        })
+        for tx_type, days, amounts in (
+            (TransactionType.capital_call, call_days[i], call_amounts[i]),
+            (TransactionType.distribution, distribution_days[i], distribution_amounts[i]),
+        ):
+            for transaction_date, amount in zip(_dates(start, days), amounts.tolist()):
+                transactions.append({
+                    "fund_id": fund_id,
+                    "company_id": company_id,
+                    "transaction_date": transaction_date,
+                    "amount": amount,
+                    "tx_type": tx_type,
+                })
+
+    fund["total_commitment"] = float(round(invested.sum() * 1.1, 2))
+    quarterly_fee = round(fund["total_commitment"] * fund["management_fee_pct"] / 4, 2)
+    for transaction_date in _dates(start, np.arange(0, span, 91)):
+        transactions.append({
+            "fund_id": fund_id,
+            "company_id": None,
+            "transaction_date": transaction_date,
+            "amount": quarterly_fee,
+            "tx_type": TransactionType.management_fee,
+        })
+
+    # Offset created_at by row so same-day ties keep a stable waterfall order
+    for row_number, row in enumerate(transactions):
+        row_created_at = created_at + timedelta(microseconds=row_number)
+        row.update({"id": uuid.uuid4(), "extra_metadata": {}, "created_at": row_created_at, "updated_at": row_created_at})
+    return fund, companies, transactions
+
+def generate(
+    session: Session,
+    funds: int = 1,
+    companies: int = 20,
+    transactions: int = 10,
+    years: float = 10,
+    seed: int = 0,
+) -> List[uuid.UUID]:
+    # `transactions` is per company. Returns the new fund ids; aggregates and
+    # waterfalls are computed, so the funds are ready to read.
+    rng = np.random.default_rng(seed)
+    created_at = datetime.utcnow()
+    fund_ids = []
+    for index in range(funds):
+        fund, company_rows, transaction_rows = _fund_rows(rng, index, companies, transactions, years, created_at)
+        _insert(session, Fund, [fund])
+        _insert(session, PortfolioCompany, company_rows)
+        _insert(session, Transaction, transaction_rows)
+        fund_ids.append(fund["id"])
+
+    rebuild_aggregates(session, fund_ids)
+    session.commit()
+    for fund_id in fund_ids:
+        compute_waterfall(session, fund_id)
+    return fund_ids
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic funds with bulk inserts")
+    parser.add_argument("--funds", type=int, default=1)
+    parser.add_argument("--companies", type=int, default=20, help="Companies per fund")
+    parser.add_argument("--transactions", type=int, default=10, help="Transactions per company")
+    parser.add_argument("--years", type=float, default=10, help="Date spread of each fund's transactions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL", settings.DATABASE_URL)
+    engine = create_engine(database_url)
+    create_schema(engine)
+
+    started = time.perf_counter()
+    with Session(engine) as session:
+        fund_ids = generate(session, args.funds, args.companies, args.transactions, args.years, args.seed)
+    print(f"Generated {len(fund_ids)} funds, {len(fund_ids) * args.companies} companies, "
+          f"~{len(fund_ids) * args.companies * args.transactions} company transactions "
+          f"in {time.perf_counter() - started:.1f}s.")
+    for fund_id in fund_ids:
+        print(fund_id)
+
+if __name__ == "__main__":
+    main()
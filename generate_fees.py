@@ -0,0 +1,46 @@
+from sqlmodel import Session, create_engine
+from app.config import settings
+from app.migrations import create_schema
+from app.logic.fees import generate_management_fees
+from datetime import date
+import argparse
+import os
+import time
+import uuid
+
+# Posts the quarterly management fees due for every fund (see app/logic/fees.py);
+# safe to run on a schedule, as quarters already posted are skipped:
+#   python generate_fees.py
+#   python generate_fees.py --dry-run --through 2030-12-31 --out fees.csv
+#   python generate_fees.py --fund-id <uuid> --fund-id <uuid>
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate quarterly management fee transactions")
+    parser.add_argument("--fund-id", action="append", type=uuid.UUID, help="Limit to these funds (repeatable)")
+    parser.add_argument("--through", type=date.fromisoformat, default=None, help="Last fee date to include (default today)")
+    parser.add_argument("--dry-run", action="store_true", help="Only compute the schedule")
+    parser.add_argument("--out", help="Write the schedule to this CSV file")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL", settings.DATABASE_URL)
+    engine = create_engine(database_url)
+    create_schema(engine)
+
+    started = time.perf_counter()
+    with Session(engine) as session:
+        schedule, inserted, skipped = generate_management_fees(session, args.fund_id, args.through, args.dry_run)
+    elapsed = time.perf_counter() - started
+
+    if args.out:
+        schedule.to_csv(args.out, index=False)
+    due = schedule[schedule["amount"] > 0]
+    print(f"{schedule['fund_id'].nunique()} funds, {len(schedule)} quarters, "
+          f"{len(due)} with a fee totalling {float(due['amount'].sum()):,.2f}.")
+    if args.dry_run:
+        print(f"Dry run: {int((~due['posted'].astype(bool)).sum())} fees not posted yet ({elapsed:.1f}s).")
+    else:
+        print(f"Posted {inserted} management fees in {elapsed:.1f}s"
+              + (f", skipped {skipped} already posted by another run." if skipped else "."))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+# Concurrent read load against one or more running API servers.
+#
+# To compare stacks, serve two builds side by side (e.g. the sync build from
+# an older checkout on :8001 and this one on :8000) against the same database:
+#   python load_test.py --fund-id <uuid> \
+#       --base-url http://localhost:8001 --base-url http://localhost:8000
+
+ENDPOINTS = [
+    "/api/funds/",
+    "/api/funds/{fund_id}",
+    "/api/funds/{fund_id}/companies",
+    "/api/funds/{fund_id}/transactions",
+    "/api/funds/{fund_id}/waterfall",
+    "/api/funds/{fund_id}/metrics",
+]
+
+async def _worker(client: httpx.AsyncClient, paths, deadline: float, latencies, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as exc:
+            errors.append(type(exc).__name__)
+        latencies.append(time.perf_counter() - started)
+
+async def run_load(base_url: str, paths, concurrency: int, duration: float, headers=None) -> dict:
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, headers=headers, timeout=60) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(_worker(client, paths, deadline, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "base_url": base_url,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Read throughput under concurrent dashboard-style load")
+    parser.add_argument("--base-url", action="append", required=True, help="Server to test (repeat to compare)")
+    parser.add_argument("--fund-id", required=True)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per server")
+    parser.add_argument("--token", default="load-test", help="Bearer token sent with every request")
+    args = parser.parse_args()
+
+    paths = [endpoint.format(fund_id=args.fund_id) for endpoint in ENDPOINTS]
+    headers = {"Authorization": f"Bearer {args.token}"}
+
+    print(f"{'server':<32}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for base_url in args.base_url:
+        result = asyncio.run(run_load(base_url, paths, args.concurrency, args.duration, headers))
+        print(
+            f"{result['base_url']:<32}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+            f"{result['p50_ms'] or 0:>10.1f}{result['p95_ms'] or 0:>10.1f}{result['max_ms'] or 0:>10.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+from sqlmodel import Session, create_engine
+from app.config import settings
+from app.logic.aggregates import check_aggregates, rebuild_aggregates
+from app.migrations import create_schema
+import argparse
+import os
+import uuid
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify mv_fund_aggregates / mv_company_aggregates")
+    parser.add_argument("--check", action="store_true", help="Only compare stored aggregates with a full recompute")
+    parser.add_argument("--fund-id", action="append", type=uuid.UUID, help="Limit to these funds (repeatable)")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL", settings.DATABASE_URL)
+    engine = create_engine(database_url)
+    create_schema(engine)
+
+    with Session(engine) as session:
+        if args.check:
+            mismatches = check_aggregates(session, args.fund_id)
+            for mismatch in mismatches:
+                print(f"{mismatch['table']} {mismatch['id']} {mismatch['column']}: "
+                      f"stored={mismatch['stored']} expected={mismatch['expected']}")
+            print(f"{len(mismatches)} mismatches found.")
+            raise SystemExit(1 if mismatches else 0)
+
+        rebuilt = rebuild_aggregates(session, args.fund_id)
+        session.commit()
+        print(f"Rebuilt aggregates for {rebuilt} funds.")
+
+if __name__ == "__main__":
+    main()
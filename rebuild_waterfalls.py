@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlmodel import Session, create_engine, select
+from app.config import settings
+from app.logic.cache import metrics_cache
+from app.logic.waterfall import rebuild_waterfalls
+from app.migrations import create_schema
+from app.models import Fund
+from typing import List, Set
+import argparse
+import json
+import os
+import time
+import uuid
+
+# Full rebuild of waterfall_allocations, e.g. after a carry_pct correction or
+# a data migration:
+#   python rebuild_waterfalls.py --workers 4
+#   python rebuild_waterfalls.py --fund-id <uuid> --fund-id <uuid>
+# Funds are sharded across a process pool; each shard is rebuilt and
+# committed on its own (see rebuild_waterfalls in app/logic/waterfall.py).
+# Finished funds are appended to the state file as their shard commits, so an
+# interrupted run picks up where it stopped; the file is removed once every
+# fund is done.
+
+_engine = None
+
+def _init_worker(database_url: str):
+    # One engine per worker process, as connections can't cross processes
+    global _engine
+    _engine = create_engine(database_url)
+
+def _rebuild_shard(fund_ids: List[uuid.UUID]):
+    started = time.perf_counter()
+    with Session(_engine) as session:
+        results = rebuild_waterfalls(session, fund_ids)
+        session.commit()
+    # Reaches other processes with CACHE_BACKEND=sqlite; a per-process cache
+    # in a running server keeps its entries until they age out
+    for fund_id in results:
+        metrics_cache.bump(fund_id)
+    return fund_ids, results, time.perf_counter() - started
+
+def _read_state(path: str) -> Set[uuid.UUID]:
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                done.add(uuid.UUID(json.loads(line)["fund_id"]))
+    return done
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild waterfall_allocations for every fund (or the given ones)")
+    parser.add_argument("--fund-id", action="append", type=uuid.UUID, help="Limit to these funds (repeatable)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shard-size", type=int, default=20, help="Funds per shard (one transaction each)")
+    parser.add_argument("--state-file", default="rebuild_waterfalls.state", help="Progress file for resuming")
+    parser.add_argument("--restart", action="store_true", help="Ignore the state file of an earlier run")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL", settings.DATABASE_URL)
+    engine = create_engine(database_url)
+    create_schema(engine)
+    with Session(engine) as session:
+        stmt = select(Fund.id).order_by(Fund.id)
+        if args.fund_id:
+            stmt = stmt.where(Fund.id.in_(args.fund_id))
+        fund_ids = session.exec(stmt).all()
+    engine.dispose()
+
+    if args.restart and os.path.exists(args.state_file):
+        os.remove(args.state_file)
+    done = _read_state(args.state_file)
+    pending = [fund_id for fund_id in fund_ids if fund_id not in done]
+    if done:
+        print(f"Resuming: {len(fund_ids) - len(pending)} of {len(fund_ids)} funds already rebuilt.")
+    shards = [pending[i:i + args.shard_size] for i in range(0, len(pending), args.shard_size)]
+
+    started = time.perf_counter()
+    finished = len(fund_ids) - len(pending)
+    allocations = 0
+    workers = max(min(args.workers, len(shards)), 1)
+    with open(args.state_file, "a") as state, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(database_url,)
+    ) as pool:
+        futures = [pool.submit(_rebuild_shard, shard) for shard in shards]
+        for future in as_completed(futures):
+            shard, results, seconds = future.result()
+            for fund_id in shard:
+                rows, fund_seconds = results.get(fund_id, (0, 0.0))
+                print(f"  {fund_id}: {rows} allocations, {fund_seconds * 1000:.1f} ms")
+                state.write(json.dumps({"fund_id": str(fund_id), "allocations": rows, "ms": round(fund_seconds * 1000, 3)}) + "\n")
+            state.flush()
+            finished += len(shard)
+            allocations += sum(rows for rows, _ in results.values())
+            print(f"[{finished}/{len(fund_ids)} funds] shard of {len(shard)} in {seconds:.2f}s")
+
+    os.remove(args.state_file)
+    print(f"Rebuilt {len(pending)} funds ({allocations} allocations) in {time.perf_counter() - started:.1f}s.")
+
+if __name__ == "__main__":
+    main()
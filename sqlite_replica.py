@@ -0,0 +1,52 @@
+from app.config import settings
+import argparse
+import os
+import sqlite3
+import time
+
+# Local stand-in for a streaming replica: copies the SQLite primary
+# (DATABASE_URL) into a second file every --interval seconds, so the replica
+# routing and its read-after-write handling can be exercised without Postgres:
+#   python sqlite_replica.py --replica ./replica.db --interval 2
+#   DATABASE_REPLICA_URLS=sqlite:///./replica.db uvicorn app.main:app
+# The copy lags the primary by up to --interval, much as a real replica
+# would under load.
+
+def _sqlite_path(url: str) -> str:
+    if not url.startswith("sqlite:///"):
+        raise SystemExit(f"Not a SQLite URL: {url}")
+    return url[len("sqlite:///"):]
+
+def copy_database(primary_path: str, replica_path: str) -> float:
+    # The backup API takes a consistent snapshot while the primary keeps
+    # taking writes; readers of the replica see the old or the new copy
+    started = time.perf_counter()
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a SQLite copy of the primary database as a local read replica")
+    parser.add_argument("--replica", default="./replica.db", help="Replica file to write")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between copies")
+    parser.add_argument("--once", action="store_true", help="Copy once and exit")
+    args = parser.parse_args()
+
+    primary_path = _sqlite_path(os.getenv("DATABASE_URL", settings.DATABASE_URL))
+    if os.path.abspath(primary_path) == os.path.abspath(args.replica):
+        raise SystemExit("The replica must be a different file from the primary")
+
+    while True:
+        elapsed = copy_database(primary_path, args.replica)
+        print(f"Copied {primary_path} -> {args.replica} in {elapsed * 1000:.1f} ms")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
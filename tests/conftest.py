@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+# Settings are read when app.config is imported: point the app at a scratch
+# database, with the in-process cache and jobs run inline, before any test
+# module imports it
+_scratch = tempfile.mkdtemp(prefix="fund-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_scratch}/app.db",
+    DATABASE_REPLICA_URLS="",
+    CACHE_BACKEND="memory",
+    JOB_BACKEND="inline",
+    SIMULATION_WORKERS="1",
+    AUTH_VERIFY_JWT="false",
+    SQL_ECHO="false",
+    DEBUG="false",
+)
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine
+import app.models  # noqa: F401  (registers the tables)
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
+
+class StatementCounter:
+    # Counts (and keeps) the statements sent on an engine (before_cursor_execute)
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, connection, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.count = 0
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self)
+
+@pytest.fixture
+def client():
+    # The app on the scratch database, with any bearer token accepted
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app, headers={"Authorization": "Bearer test"}) as client:
+        yield client
+
+@pytest.fixture
+def count_statements(engine):
+    return lambda: StatementCounter(engine)
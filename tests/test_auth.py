@@ -0,0 +1,143 @@
+import base64
+import json
+import os
+import time
+import types
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import jwk, jwt, JWTError
+from app import auth
+from app.auth import TokenVerifier
+
+SECRET = "test-secret"
+
+def _pems(private_key):
+    private = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private, public
+
+RSA_PRIVATE, RSA_PUBLIC = _pems(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+EC_PRIVATE, EC_PUBLIC = _pems(ec.generate_private_key(ec.SECP256R1()))
+
+def _jwk(public_pem, algorithm, kid):
+    return {**jwk.construct(public_pem, algorithm).to_dict(), "kid": kid, "use": "sig"}
+
+def _write_jwks(path, *keys):
+    path.write_text(json.dumps({"keys": list(keys)}))
+    # A rewrite within the same mtime tick must still be picked up
+    stamp = time.time() + len(keys) + os.stat(path).st_size
+    os.utime(path, (stamp, stamp))
+
+def _claims(**overrides):
+    return {"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + 3600, **overrides}
+
+def _token(key, algorithm, kid=None, **claims):
+    return jwt.encode(_claims(**claims), key, algorithm=algorithm, headers={"kid": kid} if kid else None)
+
+@pytest.fixture
+def jwks_path(tmp_path):
+    path = tmp_path / "jwks.json"
+    _write_jwks(path, _jwk(RSA_PUBLIC, "RS256", "rsa-1"), _jwk(EC_PUBLIC, "ES256", "ec-1"))
+    return path
+
+@pytest.fixture
+def verifier(jwks_path):
+    return TokenVerifier(SECRET, str(jwks_path), "", "authenticated", cache_entries=100, refresh_seconds=0)
+
+def test_hs256_token_verifies_then_hits_the_cache(verifier):
+    token = _token(SECRET, "HS256")
+    assert verifier.verify(token)["sub"] == "user-1"
+    assert verifier.verify(token)["sub"] == "user-1"
+    assert (verifier.stats()["verified"], verifier.stats()["hits"]) == (1, 1)
+
+@pytest.mark.parametrize("private, algorithm, kid", [
+    (RSA_PRIVATE, "RS256", "rsa-1"),
+    (EC_PRIVATE, "ES256", "ec-1"),
+], ids=["RS256", "ES256"])
+def test_jwks_tokens_verify(verifier, private, algorithm, kid):
+    assert verifier.verify(_token(private, algorithm, kid))["sub"] == "user-1"
+    assert verifier.stats()["signing_keys"] == 2
+
+def test_unknown_kid_is_rejected_and_asks_for_a_refresh(verifier):
+    with pytest.raises(JWTError, match="Unknown signing key"):
+        verifier.verify(_token(RSA_PRIVATE, "RS256", "rsa-2"))
+    assert verifier._refresh_requested.is_set()
+    assert verifier.stats()["rejected"] == 1
+
+def test_rotating_a_key_out_clears_the_cache(verifier, jwks_path):
+    token = _token(RSA_PRIVATE, "RS256", "rsa-1")
+    verifier.verify(token)
+    assert len(verifier.cache) == 1
+
+    _write_jwks(jwks_path, _jwk(EC_PUBLIC, "ES256", "ec-1"))
+    assert verifier.load_jwks()
+    assert len(verifier.cache) == 0
+    with pytest.raises(JWTError, match="Unknown signing key"):
+        verifier.verify(token)
+
+def test_expired_token_is_rejected(verifier):
+    with pytest.raises(JWTError):
+        verifier.verify(_token(SECRET, "HS256", exp=int(time.time()) - 10))
+    assert len(verifier.cache) == 0
+
+def test_cached_token_is_checked_again_once_it_expires(verifier, monkeypatch):
+    expires = int(time.time()) + 60
+    token = _token(SECRET, "HS256", exp=expires)
+    verifier.verify(token)
+    assert verifier.cache.get(token, expires - 1) is not None
+
+    # At its exp the entry is gone, so the token goes back to a full check
+    monkeypatch.setattr(auth, "time", types.SimpleNamespace(time=lambda: expires, monotonic=time.monotonic))
+    verifier.verify(token)
+    assert (verifier.stats()["verified"], verifier.stats()["hits"]) == (2, 0)
+
+def test_wrong_audience_is_rejected(verifier):
+    with pytest.raises(JWTError):
+        verifier.verify(_token(SECRET, "HS256", aud="someone-else"))
+    with pytest.raises(JWTError):
+        verifier.verify(_token(RSA_PRIVATE, "RS256", "rsa-1", aud="someone-else"))
+
+def _unsigned(header, claims):
+    def part(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+    return f"{part(header)}.{part(claims)}."
+
+def test_alg_none_is_rejected(verifier):
+    with pytest.raises(JWTError, match="Unsupported signing algorithm"):
+        verifier.verify(_unsigned({"alg": "none", "typ": "JWT"}, _claims()))
+    with pytest.raises(JWTError):
+        verifier.verify(_unsigned({"alg": "none", "typ": "JWT", "kid": "rsa-1"}, _claims()))
+
+def test_algorithm_is_bound_to_the_key(verifier):
+    # A valid ES256 signature presented under the RSA key's kid
+    with pytest.raises(JWTError):
+        verifier.verify(_token(EC_PRIVATE, "ES256", "rsa-1"))
+    # The RSA key's kid with its own signature but another RSA algorithm
+    with pytest.raises(JWTError):
+        verifier.verify(_token(RSA_PRIVATE, "RS512", "rsa-1"))
+    # HS256 naming the RSA key's kid is still checked against the secret
+    with pytest.raises(JWTError):
+        verifier.verify(jwt.encode(_claims(), "not-the-secret", algorithm="HS256", headers={"kid": "rsa-1"}))
+    assert verifier.stats()["verified"] == 0
+
+def test_hs256_needs_the_secret(jwks_path):
+    verifier = TokenVerifier("", str(jwks_path), "", "authenticated", cache_entries=100, refresh_seconds=0)
+    with pytest.raises(JWTError, match="SUPABASE_JWT_SECRET"):
+        verifier.verify(_token(SECRET, "HS256"))
+
+def test_malformed_jwks_is_recorded_instead_of_raised(tmp_path):
+    path = tmp_path / "jwks.json"
+    path.write_text("{not json")
+    verifier = TokenVerifier(SECRET, str(path), "", "authenticated", cache_entries=100, refresh_seconds=0)
+    assert verifier.stats()["last_refresh_error"].startswith("JSONDecodeError")
+    assert verifier.stats()["signing_keys"] == 0
+    assert verifier.verify(_token(SECRET, "HS256"))["sub"] == "user-1"
+
+    _write_jwks(path, _jwk(RSA_PUBLIC, "RS256", "rsa-1"))
+    assert verifier.load_jwks()
+    assert verifier.verify(_token(RSA_PRIVATE, "RS256", "rsa-1"))["sub"] == "user-1"
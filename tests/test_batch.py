@@ -0,0 +1,142 @@
+from datetime import date
+import json
+import uuid
+import pytest
+from sqlmodel import Session, select
+from app import crud
+from app.database import engine
+from app.logic.jobs import job_queue
+from app.models import Fund, PortfolioCompany, Transaction, WaterfallAllocation
+
+def _fund(client, name="Batch"):
+    return client.post("/api/funds/", json={
+        "name": name, "fund_start_date": "2020-01-01", "total_commitment": 1e7,
+        "management_fee_pct": 0.02, "carry_pct": 0.2,
+    }).json()["id"]
+
+def _company(client, fund_id, name="Co"):
+    return client.post(f"/api/funds/{fund_id}/companies", json={"name": name, "status": "active"}).json()["id"]
+
+@pytest.fixture
+def fund(client):
+    fund_id = _fund(client)
+    return {
+        "id": fund_id,
+        "company": _company(client, fund_id),
+        # A company of another fund
+        "foreign_company": _company(client, _fund(client, "Other")),
+    }
+
+def _rows(fund):
+    # Valid rows: a call on the company, a fund-level call, a distribution
+    return [
+        {"company_id": fund["company"], "transaction_date": "2020-02-01", "amount": 600000.0, "tx_type": "capital_call"},
+        {"transaction_date": "2020-03-01", "amount": 400000.0, "tx_type": "capital_call"},
+        {"transaction_date": "2021-01-01", "amount": 250000.0, "tx_type": "distribution"},
+    ]
+
+def _transactions(fund_id):
+    with Session(engine) as session:
+        return session.exec(select(Transaction).where(Transaction.fund_id == uuid.UUID(fund_id))).all()
+
+def _total_invested(company_id):
+    with Session(engine) as session:
+        return session.get(PortfolioCompany, uuid.UUID(company_id)).total_invested
+
+def _check_inserted(fund, result, received):
+    assert (result["received"], result["inserted"]) == (received, 3)
+    transactions = _transactions(fund["id"])
+    assert sorted(tx.amount for tx in transactions) == [250000.0, 400000.0, 600000.0]
+    # One change for the whole batch
+    assert len({tx.change_seq for tx in transactions}) == 1
+    assert _total_invested(fund["company"]) == 600000.0
+
+    # One waterfall job for the batch, which allocated the distribution
+    status = job_queue.fund_status(uuid.UUID(fund["id"]))
+    assert [job["id"] for job in status["jobs"]] == [uuid.UUID(result["job_id"])]
+    assert status["jobs"][0]["writes"] == 1
+    assert status["fresh"]
+    with Session(engine) as session:
+        allocations = session.exec(select(WaterfallAllocation).where(WaterfallAllocation.fund_id == uuid.UUID(fund["id"]))).all()
+    assert [allocation.gross for allocation in allocations] == [250000.0]
+
+def test_ndjson_reports_bad_rows_and_inserts_the_rest(client, fund):
+    valid = _rows(fund)
+    lines = [
+        json.dumps(valid[0]),
+        '{"transaction_date": "2020-02-01", "amount": ',
+        json.dumps({**valid[1], "fund_id": fund["company"]}),
+        json.dumps(valid[1]),
+        json.dumps({**valid[0], "company_id": fund["foreign_company"]}),
+        json.dumps({"transaction_date": "2020-02-01", "amount": "lots", "tx_type": "capital_call"}),
+        "",
+        json.dumps(valid[2]),
+        "[1, 2]",
+    ]
+    response = client.post(
+        f"/api/funds/{fund['id']}/transactions:batch",
+        content="\n".join(lines), headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    result = response.json()
+    errors = {error["row"]: error["error"] for error in result["errors"]}
+    assert sorted(errors) == [2, 3, 5, 6, 8]
+    assert errors[2].startswith("Invalid JSON")
+    assert errors[3] == "Fund ID mismatch"
+    assert errors[5] == "Company not found in fund"
+    assert errors[6].startswith("amount:")
+    assert errors[8] == "Expected a JSON object"
+    _check_inserted(fund, result, received=8)
+
+def test_csv_upload(client, fund):
+    rows = _rows(fund)
+    lines = ["company_id,transaction_date,amount,tx_type,extra_metadata"]
+    lines.append(f"{rows[0]['company_id']},2020-02-01,600000,capital_call,")
+    lines.append(",2020-02-15,100,capital_call,{broken")
+    lines.append(",2020-03-01,400000,capital_call,\"{\"\"source\"\": \"\"csv\"\"}\"")
+    lines.append(",2020-03-05,100,not_a_type,")
+    lines.append(",2021-01-01,250000,distribution,")
+    files = {"file": ("transactions.csv", "\n".join(lines).encode(), "text/csv")}
+    response = client.post(f"/api/funds/{fund['id']}/transactions:batch", files=files)
+    assert response.status_code == 200
+    result = response.json()
+    errors = {error["row"]: error["error"] for error in result["errors"]}
+    assert sorted(errors) == [2, 4]
+    assert errors[2] == "extra_metadata is not valid JSON"
+    assert errors[4].startswith("tx_type:")
+    _check_inserted(fund, result, received=5)
+    assert [tx.extra_metadata for tx in _transactions(fund["id"]) if tx.amount == 400000.0] == [{"source": "csv"}]
+
+def test_json_array(client, fund):
+    response = client.post(f"/api/funds/{fund['id']}/transactions:batch", json=_rows(fund))
+    assert response.status_code == 200
+    assert response.json()["errors"] == []
+    _check_inserted(fund, response.json(), received=3)
+
+def test_rejected_bodies(client, fund):
+    url = f"/api/funds/{fund['id']}/transactions:batch"
+    assert client.post(url, json={"rows": []}).status_code == 400
+    assert client.post(url, content="x", headers={"Content-Type": "text/plain"}).status_code == 415
+    assert client.post(url, files={"file": ("rows.xlsx", b"x", "application/octet-stream")}).status_code == 415
+    assert client.post(f"/api/funds/{uuid.uuid4()}/transactions:batch", json=[]).status_code == 404
+
+def test_bulk_rows_roll_up_in_chunks(session, monkeypatch):
+    # Several INSERT chunks, still one change and one roll-up per company
+    monkeypatch.setattr(crud, "BULK_INSERT_CHUNK_SIZE", 2)
+    fund = Fund(name="Chunks", fund_start_date=date(2020, 1, 1), total_commitment=1e7, management_fee_pct=0.02, carry_pct=0.2)
+    session.add(fund)
+    session.commit()
+    company = PortfolioCompany(fund_id=fund.id, name="Co", status="active", total_invested=100.0)
+    session.add(company)
+    session.commit()
+    rows = [
+        {"company_id": str(company.id), "transaction_date": f"2020-0{month}-01", "amount": 1000.0 * month, "tx_type": "capital_call"}
+        for month in range(1, 6)
+    ]
+    result = crud.create_transactions_bulk(session, fund.id, iter(rows))
+    assert (result["received"], result["inserted"], result["errors"]) == (5, 5, [])
+    session.refresh(company)
+    assert company.total_invested == 100.0 + 15000.0
+    transactions = session.exec(select(Transaction).where(Transaction.fund_id == fund.id)).all()
+    assert len(transactions) == 5
+    assert {tx.change_seq for tx in transactions} == {company.change_seq}
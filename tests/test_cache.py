@@ -0,0 +1,143 @@
+from datetime import date
+import asyncio
+import uuid
+import pytest
+from app import crud
+from app.logic.cache import CacheBackend, LocalBackend, MetricsCache, SQLiteBackend
+from app.models import Fund
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "cache.db"), max_entries=3)
+    return LocalBackend(max_entries=3)
+
+def test_lru_evicts_least_recently_used(backend):
+    cache = MetricsCache(backend)
+    fund_id = uuid.uuid4()
+    for name in ("a", "b", "c"):
+        cache.get_or_compute(name, fund_id, lambda name=name: name)
+    # Reading "a" makes "b" the least recently used
+    assert cache.get_or_compute("a", fund_id, lambda: "recomputed") == "a"
+    cache.get_or_compute("d", fund_id, lambda: "d")
+
+    assert backend.size() == 3
+    assert cache.get_or_compute("b", fund_id, lambda: "recomputed") == "recomputed"
+    assert cache.evictions == 2
+    assert cache.stats()["entries"] == 3
+
+def test_hit_and_miss_counters(backend):
+    cache = MetricsCache(backend)
+    fund_id = uuid.uuid4()
+    calls = []
+    for _ in range(3):
+        cache.get_or_compute("metrics", fund_id, lambda: calls.append(1) or {"tvpi": 1.5})
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+    # None means "not found" and is never stored
+    cache.get_or_compute("missing", fund_id, lambda: None)
+    cache.get_or_compute("missing", fund_id, lambda: None)
+    assert cache.misses == 3
+
+def test_bump_invalidates_only_that_fund(backend):
+    cache = MetricsCache(backend)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    cache.get_or_compute("metrics", first, lambda: "first v0")
+    cache.get_or_compute("metrics", second, lambda: "second v0")
+
+    assert cache.bump(first) == 1
+    assert cache.get_or_compute("metrics", first, lambda: "first v1") == "first v1"
+    assert cache.get_or_compute("metrics", second, lambda: "second v1") == "second v0"
+    assert cache.version(first) == 1 and cache.version(second) == 0
+
+def test_disabled_cache_always_computes():
+    cache = MetricsCache(LocalBackend(max_entries=3), enabled=False)
+    fund_id = uuid.uuid4()
+    assert [cache.get_or_compute("metrics", fund_id, lambda i=i: i) for i in range(2)] == [0, 1]
+    assert cache.backend.size() == 0
+
+def test_writes_bump_the_fund_version(session):
+    from app.logic.cache import metrics_cache
+    fund = Fund(name="Versioned", fund_start_date=date(2020, 1, 1), total_commitment=1e7, management_fee_pct=0.02, carry_pct=0.2)
+    session.add(fund)
+    session.commit()
+    before = metrics_cache.version(fund.id)
+    crud.create_transaction(session, {
+        "fund_id": fund.id, "transaction_date": date(2020, 2, 1), "amount": 1e6, "tx_type": "capital_call",
+    })
+    assert metrics_cache.version(fund.id) == before + 1
+    crud.create_transaction(session, {
+        "fund_id": fund.id, "transaction_date": date(2021, 2, 1), "amount": 5e5, "tx_type": "distribution",
+    })
+    # The transaction itself, then its waterfall recompute (run inline here)
+    assert metrics_cache.version(fund.id) == before + 3
+
+def test_concurrent_misses_share_one_computation():
+    cache = MetricsCache(LocalBackend(max_entries=10))
+    fund_id = uuid.uuid4()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"tvpi": 2.0}
+
+    async def run():
+        return await asyncio.gather(*(cache.aget_or_compute("metrics", fund_id, compute) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert results == [{"tvpi": 2.0}] * 10
+    assert cache.coalesced == 9
+    # Stored once the computation finished
+    assert asyncio.run(cache.aget_or_compute("metrics", fund_id, compute)) == {"tvpi": 2.0}
+    assert len(calls) == 1
+
+def test_failed_computation_reaches_every_waiter_and_is_not_stored():
+    cache = MetricsCache(LocalBackend(max_entries=10))
+    fund_id = uuid.uuid4()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.aget_or_compute("metrics", fund_id, compute) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.backend.size() == 0
+    assert not cache._pending
+
+def test_cancelled_computation_lets_waiters_compute():
+    cache = MetricsCache(LocalBackend(max_entries=10))
+    fund_id = uuid.uuid4()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def fast():
+        return "fresh"
+
+    async def run():
+        leader = asyncio.create_task(cache.aget_or_compute("metrics", fund_id, slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.aget_or_compute("metrics", fund_id, fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == "fresh"
+
+def test_an_incomplete_backend_fails_when_constructed():
+    class NoVersions(CacheBackend):
+        def get(self, key):
+            return False, None
+
+        def set(self, key, value):
+            return 0
+
+    with pytest.raises(TypeError, match="bump_version"):
+        NoVersions()
@@ -0,0 +1,94 @@
+import pytest
+from sqlmodel import Session
+from app.database import engine
+from app.logic.jobs import job_queue
+
+@pytest.fixture
+def fund_id(client):
+    response = client.post("/api/funds/", json={
+        "name": "Changes", "fund_start_date": "2020-01-01", "total_commitment": 1e7,
+        "management_fee_pct": 0.02, "carry_pct": 0.2,
+    })
+    assert response.status_code == 200
+    return response.json()["id"]
+
+def _post(client, fund_id, tx_type, day, amount):
+    response = client.post(f"/api/funds/{fund_id}/transactions", json={
+        "transaction_date": day, "amount": amount, "tx_type": tx_type,
+    })
+    assert response.status_code == 200
+    return response.json()
+
+@pytest.mark.parametrize("path", [
+    "/api/funds/{fund_id}",
+    "/api/funds/{fund_id}/transactions",
+    "/api/funds/{fund_id}/metrics",
+    "/api/funds/{fund_id}/changes",
+])
+def test_unchanged_fund_answers_304_until_a_write(client, fund_id, path):
+    url = path.format(fund_id=fund_id)
+    _post(client, fund_id, "capital_call", "2020-01-15", 1e6)
+    first = client.get(url)
+    etag = first.headers["ETag"]
+
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert again.content == b""
+    assert client.get(url, headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+    _post(client, fund_id, "distribution", "2021-01-15", 5e5)
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+def test_representations_get_their_own_etags(client, fund_id):
+    url = f"/api/funds/{fund_id}/transactions"
+    json_tag = client.get(url).headers["ETag"]
+    ndjson_tag = client.get(url, headers={"Accept": "application/x-ndjson"}).headers["ETag"]
+    assert json_tag != ndjson_tag
+    assert client.get(url, headers={"Accept": "application/x-ndjson", "If-None-Match": json_tag}).status_code == 200
+
+def test_a_waterfall_job_moves_the_etag(client, fund_id):
+    _post(client, fund_id, "capital_call", "2020-01-15", 1e6)
+    _post(client, fund_id, "distribution", "2021-01-15", 5e5)
+    url = f"/api/funds/{fund_id}/changes"
+    before = client.get(url)
+
+    with Session(engine) as session:
+        job = job_queue.enqueue_waterfall(session, before.json()["fund_id"], full=True)
+    assert job["status"] == "succeeded"
+
+    after = client.get(url, headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.json()["seq"] > before.json()["seq"]
+    # Only the rewritten allocations are newer than the last snapshot
+    delta = client.get(url, params={"since": before.json()["seq"]}).json()
+    assert (delta["companies"], delta["transactions"]) == ([], [])
+    assert len(delta["waterfall"]) == 1
+    assert delta["waterfall"][0]["change_seq"] > before.json()["seq"]
+
+def test_changes_since_returns_only_later_rows(client, fund_id):
+    company = client.post(f"/api/funds/{fund_id}/companies", json={"name": "Co", "status": "active"}).json()
+    call = _post(client, fund_id, "capital_call", "2020-01-15", 1e6)
+    snapshot = client.get(f"/api/funds/{fund_id}/changes").json()
+    assert snapshot["since"] == 0
+    assert [row["id"] for row in snapshot["companies"]] == [company["id"]]
+    assert [row["id"] for row in snapshot["transactions"]] == [call["id"]]
+
+    distribution = _post(client, fund_id, "distribution", "2021-01-15", 5e5)
+    delta = client.get(f"/api/funds/{fund_id}/changes", params={"since": snapshot["seq"]}).json()
+    assert delta["since"] == snapshot["seq"]
+    assert delta["seq"] > snapshot["seq"]
+    assert delta["companies"] == []
+    assert [row["id"] for row in delta["transactions"]] == [distribution["id"]]
+    assert [row["transaction_id"] for row in delta["waterfall"]] == [distribution["id"]]
+    for kind in ("companies", "transactions", "waterfall", "marks"):
+        assert all(snapshot["seq"] < row["change_seq"] <= delta["seq"] for row in delta[kind]), kind
+
+    # Caught up: nothing after the latest seq
+    latest = client.get(f"/api/funds/{fund_id}/changes", params={"since": delta["seq"]}).json()
+    assert (latest["companies"], latest["transactions"], latest["waterfall"], latest["marks"]) == ([], [], [], [])
+
+def test_changes_of_an_unknown_fund_is_404(client):
+    assert client.get("/api/funds/00000000-0000-0000-0000-000000000000/changes").status_code == 404
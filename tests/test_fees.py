@@ -0,0 +1,41 @@
+from datetime import date
+from sqlmodel import Session, func, select
+from app.logic.fees import compute_fee_schedule, generate_management_fees, load_fee_inputs, post_fee_schedule
+from app.models import Fund, FundAggregate, Transaction, TransactionType
+
+def _fund(session):
+    fund = Fund(
+        name="Fees", fund_start_date=date(2020, 1, 1), fund_tenor_years=10, investment_period_years=5,
+        total_commitment=1e8, management_fee_pct=0.02, carry_pct=0.2, fee_calc_method="committed",
+    )
+    session.add(fund)
+    session.commit()
+    return fund.id
+
+def _fee_count(session, fund_id):
+    return session.exec(select(func.count()).select_from(Transaction).where(
+        Transaction.fund_id == fund_id, Transaction.tx_type == TransactionType.management_fee,
+    )).one()
+
+def test_racing_runs_skip_the_quarters_already_posted(engine, session):
+    fund_id = _fund(session)
+    through = date(2021, 12, 31)
+    # Both runs read their schedule before either posts
+    with Session(engine) as first, Session(engine) as second:
+        first_schedule = compute_fee_schedule(load_fee_inputs(first, [fund_id]), through)
+        second_schedule = compute_fee_schedule(load_fee_inputs(second, [fund_id]), through)
+        assert post_fee_schedule(first, first_schedule) == (8, 0)
+        assert post_fee_schedule(second, second_schedule) == (0, 8)
+        assert second_schedule["posted"].all()
+
+    assert _fee_count(session, fund_id) == 8
+    aggregate = session.exec(select(FundAggregate).where(FundAggregate.fund_id == fund_id)).one()
+    assert aggregate.total_fees == 8 * 500000
+
+def test_later_runs_post_only_the_new_quarters(session):
+    fund_id = _fund(session)
+    _, inserted, skipped = generate_management_fees(session, [fund_id], date(2021, 12, 31))
+    assert (inserted, skipped) == (8, 0)
+    assert generate_management_fees(session, [fund_id], date(2021, 12, 31))[1:] == (0, 0)
+    assert generate_management_fees(session, [fund_id], date(2022, 6, 30))[1:] == (2, 0)
+    assert _fee_count(session, fund_id) == 10
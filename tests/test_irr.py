@@ -0,0 +1,119 @@
+from datetime import date, timedelta
+import numpy as np
+import pytest
+import pyxirr
+from app.logic.irr import (
+    BISECTED, CONVERGED, NO_ROOT_FOUND, NO_SIGN_CHANGE, SOLVED, TOO_FEW_CASHFLOWS,
+    pad_series, solve_padded, xirr, xirr_batch,
+)
+
+TOLERANCE = 1e-9
+
+def _random_series(rng, length, conventional=True):
+    # A fund-like series: calls, then distributions. Conventional series
+    # change sign once, so their IRR is unique and both solvers must agree;
+    # otherwise some flows are flipped and there may be several IRRs.
+    start = date(2010, 1, 1) + timedelta(days=int(rng.integers(0, 3000)))
+    dates = sorted(start + timedelta(days=int(day)) for day in rng.integers(0, 4000, size=length))
+    calls = max(int(rng.integers(1, length)) if length > 1 else 1, 1)
+    amounts = np.where(np.arange(length) < calls, -1, 1) * rng.uniform(1e3, 1e6, size=length)
+    if not conventional:
+        amounts[rng.random(length) < 0.15] *= -1
+    amounts[0] = -abs(amounts[0])
+    amounts[-1] = abs(amounts[-1]) * rng.uniform(0.05, 4)
+    return dates, amounts.round(2)
+
+def _relative_npv(rate, dates, amounts):
+    # NPV at `rate` relative to the size of its discounted terms
+    years = np.array([(day - dates[0]).days for day in dates]) / 365.0
+    terms = np.asarray(amounts) * (1.0 + rate) ** -years
+    return abs(terms.sum()) / np.abs(terms).sum()
+
+def _expected(dates, amounts):
+    try:
+        return pyxirr.xirr(dates, amounts)
+    except pyxirr.InvalidPaymentsError:
+        return None
+
+def test_mixed_length_batch_matches_pyxirr():
+    rng = np.random.default_rng(10)
+    series = [_random_series(rng, int(length)) for length in rng.integers(2, 60, size=400)]
+    result = xirr_batch(series)
+    compared = 0
+    for (dates, amounts), rate, status in zip(series, result["rates"], result["status"]):
+        expected = _expected(dates, amounts)
+        if expected is None:
+            # pyxirr gives up on some deep losses (IRR near -100%); the
+            # bisection still finds those, and it has to be the root
+            if status in SOLVED:
+                assert _relative_npv(rate, dates, amounts) < 1e-9
+            continue
+        assert status in SOLVED
+        assert rate == pytest.approx(expected, abs=TOLERANCE, rel=TOLERANCE)
+        compared += 1
+    assert compared > 350
+
+def test_every_reported_rate_is_a_root():
+    # Several sign changes can mean several IRRs, and the solvers may settle
+    # on different ones; whichever is reported must zero the NPV
+    rng = np.random.default_rng(12)
+    series = [_random_series(rng, int(length), conventional=False) for length in rng.integers(2, 60, size=400)]
+    result = xirr_batch(series)
+    solved = 0
+    for (dates, amounts), rate, status in zip(series, result["rates"], result["status"]):
+        if status not in SOLVED:
+            assert np.isnan(rate)
+            continue
+        assert _relative_npv(rate, dates, amounts) < 1e-9
+        solved += 1
+    assert solved > 350
+
+def test_bisection_fallback_matches_pyxirr():
+    # No Newton iterations at all: every series goes through the bracketed bisection
+    rng = np.random.default_rng(11)
+    series = [_random_series(rng, int(length)) for length in rng.integers(2, 30, size=100)]
+    times, amounts = pad_series(series)
+    result = solve_padded(times, amounts, max_iter=0)
+    for (dates, flows), rate, status in zip(series, result["rates"], result["status"]):
+        expected = _expected(dates, flows)
+        if expected is None:
+            continue
+        assert status == BISECTED
+        assert rate == pytest.approx(expected, abs=TOLERANCE, rel=TOLERANCE)
+
+def test_extreme_rates_match_pyxirr():
+    day = date(2020, 1, 1)
+    cases = [
+        ([day, day + timedelta(days=10)], [-100.0, 1000.0]),     # 10x in ten days, about 3e36
+        ([day, day + timedelta(days=3650)], [-100.0, 1.0]),      # -99% over ten years
+        ([day, day + timedelta(days=365)], [-100.0, 100.0]),     # zero
+    ]
+    for dates, amounts in cases:
+        rate, status = xirr(dates, amounts)
+        assert status in SOLVED
+        assert rate == pytest.approx(pyxirr.xirr(dates, amounts), abs=TOLERANCE, rel=TOLERANCE)
+
+@pytest.mark.parametrize("amounts, status", [
+    ([100.0, 200.0, 50.0], NO_SIGN_CHANGE),
+    ([-100.0, -200.0, -50.0], NO_SIGN_CHANGE),
+    ([-100.0], TOO_FEW_CASHFLOWS),
+    ([0.0, 0.0], TOO_FEW_CASHFLOWS),
+    ([-1.0, 1.0, -1.0], NO_ROOT_FOUND),
+], ids=["all-positive", "all-negative", "single", "all-zero", "no-real-root"])
+def test_unsolvable_series_report_why(amounts, status):
+    dates = [date(2020, 1, 1) + timedelta(days=365 * i) for i in range(len(amounts))]
+    assert xirr(dates, amounts) == (None, status)
+    # pyxirr has no IRR for these either
+    assert _expected(dates, amounts) is None
+
+def test_unsolvable_series_do_not_disturb_the_batch():
+    day = date(2020, 1, 1)
+    good = ([day, day + timedelta(days=400), day + timedelta(days=900)], [-1000.0, 300.0, 1200.0])
+    series = [([day], [-5.0]), good, ([day, day], [10.0, 20.0]), ([], []), good]
+    result = xirr_batch(series)
+    assert list(result["status"]) == [TOO_FEW_CASHFLOWS, CONVERGED, NO_SIGN_CHANGE, TOO_FEW_CASHFLOWS, CONVERGED]
+    expected = pyxirr.xirr(*good)
+    assert result["rates"][1] == pytest.approx(expected, abs=TOLERANCE)
+    assert result["rates"][4] == pytest.approx(expected, abs=TOLERANCE)
+    assert np.isnan(result["rates"][[0, 2, 3]]).all()
+    assert result["iterations"][1] > 0 and result["iterations"][0] == 0
@@ -0,0 +1,189 @@
+from datetime import date
+import uuid
+import pytest
+from sqlalchemy import inspect
+from app import crud
+from app.config import settings
+from app.logic import jobs
+from app.logic.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobBackend, JobQueue, LocalJobBackend, job_queue
+from app.models import Fund, Transaction
+
+def test_writes_fold_into_the_queued_job():
+    backend = LocalJobBackend(history=10)
+    fund_id = uuid.uuid4()
+    first = backend.enqueue(fund_id, date(2020, 6, 1), False, False)
+    backend.enqueue(fund_id, date(2019, 1, 1), False, False)
+    job = backend.enqueue(fund_id, date(2021, 1, 1), True, False)
+
+    assert job["id"] == first["id"]
+    assert (job["since"], job["capital_changed"], job["full"]) == (date(2019, 1, 1), True, False)
+    assert (job["version"], job["writes"]) == (3, 3)
+    assert backend.stats() == {"queued": 1, "running": 0, "coalesced": 2}
+
+def test_a_fund_never_runs_two_jobs():
+    backend = LocalJobBackend(history=10)
+    fund_id, other = uuid.uuid4(), uuid.uuid4()
+    running = backend.enqueue(fund_id, None, True, False)
+    assert backend.claim(fund_id)["status"] == RUNNING
+    queued = backend.enqueue(fund_id, None, False, False)
+    backend.enqueue(other, None, False, False)
+
+    assert queued["id"] != running["id"]
+    assert backend.claim(fund_id) is None
+    # Any fund: skips the busy one
+    assert backend.claim()["fund_id"] == other
+    backend.finish(running["id"])
+    assert backend.claim(fund_id)["id"] == queued["id"]
+
+def test_versions_track_what_the_jobs_covered():
+    backend = LocalJobBackend(history=10)
+    fund_id = uuid.uuid4()
+    assert backend.fund_status(fund_id)["fresh"]
+    job = backend.enqueue(fund_id, None, False, False)
+    backend.claim(fund_id)
+    backend.enqueue(fund_id, None, False, False)
+    status = backend.fund_status(fund_id)
+    assert (status["requested_version"], status["computed_version"], status["fresh"]) == (2, 0, False)
+
+    backend.finish(job["id"])
+    status = backend.fund_status(fund_id)
+    assert (status["requested_version"], status["computed_version"], status["fresh"]) == (2, 1, False)
+    # Newest first
+    assert [job["status"] for job in status["jobs"]] == [QUEUED, SUCCEEDED]
+
+    backend.finish(backend.claim(fund_id)["id"])
+    status = backend.fund_status(fund_id)
+    assert (status["requested_version"], status["computed_version"], status["fresh"]) == (2, 2, True)
+
+def test_a_failed_job_is_retried_as_a_full_rebuild():
+    backend = LocalJobBackend(history=10)
+    fund_id = uuid.uuid4()
+    job = backend.enqueue(fund_id, date(2020, 1, 1), False, False)
+    backend.claim(fund_id)
+    backend.finish(job["id"], "OperationalError: database is locked")
+    assert backend.get(job["id"])["status"] == FAILED
+
+    retry = backend.claim(fund_id)
+    assert (retry["full"], retry["since"], retry["version"], retry["writes"]) == (True, None, 1, 0)
+    assert not backend.fund_status(fund_id)["fresh"]
+    backend.finish(retry["id"])
+    assert backend.fund_status(fund_id)["fresh"]
+
+def test_a_failure_turns_the_queued_job_into_a_full_rebuild():
+    backend = LocalJobBackend(history=10)
+    fund_id = uuid.uuid4()
+    job = backend.enqueue(fund_id, date(2020, 1, 1), False, False)
+    backend.claim(fund_id)
+    queued = backend.enqueue(fund_id, date(2021, 1, 1), False, False)
+    backend.finish(job["id"], "ValueError: boom")
+
+    assert backend.stats()["queued"] == 1
+    assert backend.claim(fund_id) == {**backend.get(queued["id"]), "full": True}
+
+def test_a_failed_full_rebuild_waits_for_the_next_write():
+    backend = LocalJobBackend(history=10)
+    fund_id = uuid.uuid4()
+    job = backend.enqueue(fund_id, None, False, True)
+    backend.claim(fund_id)
+    backend.finish(job["id"], "ValueError: boom")
+    assert backend.claim(fund_id) is None
+
+    assert backend.enqueue(fund_id, date(2021, 1, 1), False, False)["full"]
+
+def test_finished_jobs_are_trimmed_to_the_history():
+    backend = LocalJobBackend(history=2)
+    fund_id = uuid.uuid4()
+    ids = []
+    for _ in range(4):
+        ids.append(backend.enqueue(fund_id, None, False, False)["id"])
+        backend.finish(backend.claim(fund_id)["id"])
+    assert [backend.get(job_id) is not None for job_id in ids] == [False, False, True, True]
+
+@pytest.fixture
+def recomputes(monkeypatch):
+    # Stands in for recompute_waterfall: records each call's `full` and runs
+    # the next of `steps` (None, or an exception to raise, or a callable)
+    calls, steps = [], []
+
+    def recompute(session, fund_id, since=None, capital_changed=False, full=False):
+        calls.append(full)
+        step = steps.pop(0) if steps else None
+        if isinstance(step, Exception):
+            raise step
+        if step is not None:
+            step()
+
+    monkeypatch.setattr(jobs, "recompute_waterfall", recompute)
+    return calls, steps
+
+class _Session:
+    # The writer's session: the jobs only take its bind
+    def get_bind(self):
+        return None
+
+def test_inline_runs_the_job_queued_while_the_fund_was_busy(recomputes):
+    calls, steps = recomputes
+    queue = JobQueue(LocalJobBackend(history=10), workers=0)
+    fund_id = uuid.uuid4()
+    # Another request writes to the fund while this one runs its job: its
+    # job stays queued there, and this request runs it next
+    waiting = []
+    steps.append(lambda: waiting.append(queue.enqueue_waterfall(_Session(), fund_id)))
+    job = queue.enqueue_waterfall(_Session(), fund_id)
+
+    assert waiting[0]["status"] == QUEUED
+    assert len(calls) == 2
+    assert job["status"] == SUCCEEDED
+    assert queue.get(waiting[0]["id"])["status"] == SUCCEEDED
+    assert queue.backend.stats()["queued"] == 0
+    assert queue.fund_status(fund_id)["fresh"]
+
+def test_inline_retries_a_failed_job_before_returning(recomputes):
+    calls, steps = recomputes
+    queue = JobQueue(LocalJobBackend(history=10), workers=0)
+    fund_id = uuid.uuid4()
+    steps.append(RuntimeError("half-written"))
+    job = queue.enqueue_waterfall(_Session(), fund_id, since=date(2020, 1, 1))
+
+    assert calls == [False, True]
+    assert job["status"] == FAILED
+    assert queue.fund_status(fund_id)["fresh"]
+
+    # Nothing left to retry: the writer sees the error
+    steps.extend([RuntimeError("still broken"), RuntimeError("still broken")])
+    with pytest.raises(RuntimeError, match="still broken"):
+        queue.enqueue_waterfall(_Session(), fund_id, since=date(2020, 1, 1))
+    assert calls == [False, True, False, True]
+    assert not queue.fund_status(fund_id)["fresh"]
+
+def test_an_incomplete_backend_fails_when_constructed():
+    class NoStatus(JobBackend):
+        def enqueue(self, fund_id, since, capital_changed, full):
+            return {}
+
+        def claim(self, fund_id=None, timeout=None):
+            return None
+
+        def finish(self, job_id, error=None):
+            pass
+
+    with pytest.raises(TypeError, match="fund_status"):
+        NoStatus()
+
+def test_unknown_job_backend_is_rejected(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_BACKEND", "redis")
+    with pytest.raises(ValueError, match="JOB_BACKEND"):
+        jobs._create_backend()
+
+def test_inline_jobs_leave_the_writers_objects_loaded(session):
+    # A capital call with nothing distributed yet leaves the waterfall as it
+    # is; the job rolls back its own session, not the writer's
+    fund = Fund(name="Inline", fund_start_date=date(2020, 1, 1), total_commitment=1e7, management_fee_pct=0.02, carry_pct=0.2)
+    session.add(fund)
+    session.commit()
+    transaction = crud.create_transaction(session, {
+        "fund_id": fund.id, "transaction_date": date(2020, 2, 1), "amount": 1e6, "tx_type": "capital_call",
+    })
+    columns = {column.key for column in inspect(Transaction).column_attrs}
+    assert not columns & inspect(transaction).expired_attributes
+    assert job_queue.fund_status(fund.id)["fresh"]
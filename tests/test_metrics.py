@@ -0,0 +1,91 @@
+from datetime import date
+import pytest
+import generate_data
+from app import crud
+from app.logic.metrics import calculate_fund_metrics, calculate_portfolio_metrics, load_fund_metrics_inputs, load_portfolio_frames
+from app.logic.timeseries import compute_metrics_timeseries, load_timeseries_inputs
+from app.models import Fund
+
+HURDLE_TIERS = [{"type": "roc"}, {"type": "preferred_return", "rate": 0.08}, {"type": "catch_up", "rate": 1.0}, {"type": "carry"}]
+
+def _statements(count_statements, load, *args):
+    with count_statements() as counter:
+        load(*args)
+    return counter.count
+
+def test_fund_metrics_statements_do_not_grow_with_the_fund(session, count_statements):
+    small = generate_data.generate(session, 1, companies=2, transactions=3, seed=1)[0]
+    large = generate_data.generate(session, 1, companies=40, transactions=30, seed=2)[0]
+    session.expunge_all()
+    counts = [_statements(count_statements, load_fund_metrics_inputs, session, fund_id) for fund_id in (small, large)]
+    # Fund, aggregate, net cashflows, gross cashflows
+    assert counts == [4, 4]
+
+def test_portfolio_statements_do_not_grow_with_fund_count(session, count_statements):
+    fund_ids = generate_data.generate(session, 8, companies=5, transactions=5, seed=3)
+    counts = [
+        _statements(count_statements, load_portfolio_frames, session, fund_ids[:n])
+        for n in (1, 2, 8)
+    ]
+    assert counts[0] == counts[1] == counts[2] == 4
+    assert _statements(count_statements, load_portfolio_frames, session, None) == 4
+
+def test_portfolio_metrics_match_fund_metrics(session):
+    fund_ids = generate_data.generate(session, 3, companies=5, transactions=6, seed=4)
+    portfolio = calculate_portfolio_metrics(session, fund_ids)
+    for fund_id in fund_ids:
+        single = calculate_fund_metrics(session, fund_id)
+        for field in ("total_contributed", "total_distributions", "total_fees", "lp_net_moic",
+                      "total_gp_carry", "fund_unrealized_value", "tvpi", "dpi"):
+            assert portfolio[fund_id][field] == single[field], field
+
+def _fund_with_late_call(session, tiers=None):
+    fund = Fund(
+        name="As of", fund_start_date=date(2020, 1, 1), total_commitment=5e6,
+        management_fee_pct=0.0, carry_pct=0.2,
+        extra_metadata={"waterfall": {"tiers": tiers}} if tiers else {},
+    )
+    session.add(fund)
+    session.commit()
+    for tx_type, day, amount in [
+        ("capital_call", date(2020, 1, 1), 1e6),
+        ("distribution", date(2021, 1, 1), 1.5e6),
+        # Returned with the first call when the split is rerun today
+        ("capital_call", date(2022, 1, 1), 1e6),
+    ]:
+        crud.create_transaction(session, {"fund_id": fund.id, "transaction_date": day, "amount": amount, "tx_type": tx_type})
+    return fund.id
+
+def test_as_of_metrics_split_on_the_capital_called_by_then(session):
+    fund_id = _fund_with_late_call(session)
+    current = calculate_fund_metrics(session, fund_id)
+    assert current["total_gp_carry"] == 0
+
+    # On 2021-06-30 only the first call was in: 0.5m profit, 20% of it carry
+    metrics = calculate_fund_metrics(session, fund_id, date(2021, 6, 30))
+    assert metrics["total_contributed"] == 1e6
+    assert metrics["total_gp_carry"] == 1e5
+    assert metrics["lp_net_moic"] == 1.4
+    assert metrics["fund_net_irr"] == round(1.4 ** (365 / 366) - 1, 4)
+
+@pytest.mark.parametrize("tiers", [None, HURDLE_TIERS], ids=["roc-carry", "hurdle"])
+def test_as_of_after_the_last_transaction_matches_current_metrics(session, tiers):
+    fund_id = _fund_with_late_call(session, tiers)
+    current = calculate_fund_metrics(session, fund_id)
+    metrics = calculate_fund_metrics(session, fund_id, date(2023, 1, 1))
+    for field in ("total_contributed", "total_distributions", "total_gp_carry", "lp_net_moic", "dpi"):
+        assert metrics[field] == current[field], field
+
+@pytest.mark.parametrize("tiers", [None, HURDLE_TIERS], ids=["roc-carry", "hurdle"])
+def test_timeseries_matches_as_of_metrics_at_every_period_end(session, tiers):
+    fund_id = _fund_with_late_call(session, tiers)
+    crud.create_transaction(session, {
+        "fund_id": fund_id, "transaction_date": date(2022, 8, 1), "amount": 2e6, "tx_type": "distribution",
+    })
+    series = compute_metrics_timeseries(load_timeseries_inputs(session, fund_id), "Q", date(2023, 3, 31))
+    assert len(series["points"]) == 13
+    for point in series["points"]:
+        metrics = calculate_fund_metrics(session, fund_id, point["as_of"])
+        for field in ("total_contributed", "total_distributions", "fund_unrealized_value",
+                      "tvpi", "dpi", "lp_net_moic", "fund_net_irr"):
+            assert point[field] == metrics[field], (point["as_of"], field)
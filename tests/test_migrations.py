@@ -0,0 +1,55 @@
+from datetime import date
+from sqlalchemy import inspect, text
+from sqlmodel import Session
+from app import crud
+from app.migrations import create_schema
+from app.models import Fund
+
+# Added to existing tables after their first release
+ADDED_COLUMNS = ["funds.change_seq", "portfolio_companies.change_seq", "transactions.change_seq", "waterfall_allocations.change_seq"]
+ADDED_INDEXES = ["idx_company_fund_seq", "idx_tx_fund_date", "idx_tx_fund_seq", "idx_wf_fund_date", "idx_wf_fund_seq"]
+
+def _downgrade(engine):
+    # Back to the original layout of those tables, with a row in each
+    with engine.begin() as connection:
+        for index in ADDED_INDEXES:
+            connection.execute(text(f"DROP INDEX {index}"))
+        for column in ADDED_COLUMNS:
+            table, name = column.split(".")
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+
+def test_create_schema_adds_missing_columns_and_indexes(engine):
+    with Session(engine) as session:
+        fund = crud.create_fund(session, {
+            "name": "Existing", "fund_start_date": date(2015, 1, 1), "total_commitment": 1e7,
+            "management_fee_pct": 0.02, "carry_pct": 0.2,
+        })
+        fund_id = fund.id
+        crud.create_transaction(session, {
+            "fund_id": fund_id, "transaction_date": date(2015, 2, 1), "amount": 1e6, "tx_type": "capital_call",
+        })
+        crud.create_transaction(session, {
+            "fund_id": fund_id, "transaction_date": date(2016, 2, 1), "amount": 2e6, "tx_type": "distribution",
+        })
+    _downgrade(engine)
+    assert "change_seq" not in {column["name"] for column in inspect(engine).get_columns("transactions")}
+
+    assert sorted(create_schema(engine)) == sorted(ADDED_COLUMNS + ADDED_INDEXES)
+    # Idempotent
+    assert create_schema(engine) == []
+
+    with Session(engine) as session:
+        # Existing rows start at 0: part of a since=0 snapshot, not of later deltas
+        changes = crud.get_changes(session, fund_id, 0)
+        assert changes["seq"] == 0
+        assert [row.change_seq for row in changes["transactions"]] == [0, 0]
+        crud.create_transaction(session, {
+            "fund_id": fund_id, "transaction_date": date(2017, 2, 1), "amount": 5e5, "tx_type": "distribution",
+        })
+        # The transaction, then its waterfall recompute
+        changes = crud.get_changes(session, fund_id, 0)
+        assert changes["seq"] == 2
+        assert sorted(row.change_seq for row in changes["transactions"]) == [0, 0, 1]
+        delta = crud.get_changes(session, fund_id, 1)
+        assert delta["transactions"] == []
+        assert {row.change_seq for row in delta["waterfall"]} == {2}
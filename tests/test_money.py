@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, Table, insert, select
+from sqlmodel import select as model_select
+import generate_data
+from app.logic.money import CENTS, cents, from_cents, sum_cents, to_cents
+from app.logic.waterfall_engine import run_waterfall
+from app.models import FundAggregate, Transaction, TransactionType, WaterfallAllocation
+
+HURDLE_TIERS = [{"type": "roc"}, {"type": "preferred_return", "rate": 0.08}, {"type": "catch_up", "rate": 1.0}, {"type": "carry"}]
+
+def _amounts(n, seed):
+    # Whole cents, as stored amounts are, from a cent to ten million
+    rng = np.random.default_rng(seed)
+    amount_cents = rng.integers(1, 10**9, n)
+    return amount_cents, amount_cents / CENTS
+
+@pytest.mark.parametrize("tiers", [None, HURDLE_TIERS], ids=["roc-carry", "hurdle"])
+def test_waterfall_splits_are_exact_over_millions_of_rows(tiers):
+    rng = np.random.default_rng(1)
+    n = 2_000_000
+    dates = np.sort(np.datetime64("2010-01-01") + rng.integers(0, 5000, n)).astype("datetime64[D]")
+    gross, _ = _amounts(n, 2)
+    call_dates = (np.datetime64("2009-06-01") + np.arange(100) * 30).astype("datetime64[D]")
+    calls = rng.integers(10**8, 10**11, 100)
+    allocation = run_waterfall(dates, gross, int(calls.sum()), 0.2, tiers or [{"type": "roc"}, {"type": "carry"}], call_dates, calls)
+
+    assert allocation["gp_distribution"].sum() > 0
+    assert np.array_equal(allocation["lp_distribution"] + allocation["gp_distribution"], gross)
+    assert np.array_equal(allocation["roc_paid"] + allocation["profit_portion"], gross)
+    assert np.array_equal(allocation["lp_share"] + allocation["gp_share"], allocation["profit_portion"])
+    # Totals are exact integer sums: LP + GP is the gross to the cent
+    total = sum(int(value) for value in gross)
+    assert int(allocation["lp_distribution"].sum()) + int(allocation["gp_distribution"].sum()) == total
+    # ...and they survive the trip through stored floats
+    assert np.array_equal(to_cents(from_cents(allocation["lp_distribution"])), allocation["lp_distribution"])
+
+def test_cents_totals_do_not_drift_over_millions_of_rows(engine):
+    amount_cents, amounts = _amounts(3_000_000, 3)
+    exact = sum(int(value) for value in amount_cents)
+    assert int(to_cents(amounts).sum()) == exact
+
+    # The same in SQL, over a million stored floats
+    table = Table("amounts", MetaData(), Column("id", Integer, primary_key=True), Column("amount", Float))
+    table.create(engine)
+    stored = amounts[:1_000_000]
+    with engine.begin() as connection:
+        connection.execute(insert(table), [{"amount": float(amount)} for amount in stored])
+        total = connection.execute(select(sum_cents(table.c.amount))).scalar()
+    assert total == sum(int(value) for value in amount_cents[:1_000_000])
+
+def test_stored_allocations_and_totals_are_exact(session):
+    fund_ids = generate_data.generate(session, 4, companies=25, transactions=20, seed=5)
+    allocations = session.exec(model_select(WaterfallAllocation).where(WaterfallAllocation.fund_id.in_(fund_ids))).all()
+    assert allocations
+    for row in allocations:
+        assert cents(row.lp_distribution) + cents(row.gp_distribution) == cents(row.gross)
+        assert cents(row.roc_paid) + cents(row.profit_portion) == cents(row.gross)
+
+    transactions = session.exec(model_select(Transaction).where(Transaction.fund_id.in_(fund_ids))).all()
+    for fund_id in fund_ids:
+        aggregate = session.get(FundAggregate, fund_id)
+        fund_transactions = [t for t in transactions if t.fund_id == fund_id]
+        fund_allocations = [row for row in allocations if row.fund_id == fund_id]
+        for field, tx_type in (("total_contributed", TransactionType.capital_call), ("total_distributions", TransactionType.distribution)):
+            assert cents(getattr(aggregate, field)) == sum(cents(t.amount) for t in fund_transactions if t.tx_type == tx_type)
+        lp = sum(cents(row.lp_distribution) for row in fund_allocations)
+        gp = sum(cents(row.gp_distribution) for row in fund_allocations)
+        assert (cents(aggregate.lp_total_distributions), cents(aggregate.total_gp_carry)) == (lp, gp)
+        assert lp + gp == cents(aggregate.total_distributions)
@@ -0,0 +1,90 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app import database
+from app.api import funds
+from app.database import Database, ReadAfterWriteMiddleware, ReplicaPool, get_async_read_session
+from app.migrations import create_schema
+from sqlite_replica import copy_database
+
+# A primary and two replicas, each a SQLite file; replicas are brought up to
+# date with sqlite_replica.copy_database, so until the next copy they lag
+# the primary the way a streaming replica would
+
+FUND = {"name": "Replicated", "fund_start_date": "2020-01-01", "total_commitment": 1e7, "management_fee_pct": 0.02, "carry_pct": 0.2}
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    paths = {name: str(tmp_path / f"{name}.db") for name in ("primary", "replica-1", "replica-2")}
+    primary = Database("primary", f"sqlite:///{paths['primary']}")
+    create_schema(primary.engine)
+    replicas = [Database(name, f"sqlite:///{paths[name]}") for name in ("replica-1", "replica-2")]
+    pool = ReplicaPool(primary, replicas)
+    monkeypatch.setattr(database, "primary", primary)
+    monkeypatch.setattr(database, "replica_pool", pool)
+
+    def sync():
+        for name in ("replica-1", "replica-2"):
+            copy_database(paths["primary"], paths[name])
+
+    sync()
+    yield pool, sync
+    # Including any the test swapped in
+    for db in {primary, *replicas, *pool.replicas}:
+        db.engine.dispose()
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.add_middleware(ReadAfterWriteMiddleware)
+    app.include_router(funds.router)
+
+    @app.get("/served-by")
+    async def served_by(session: AsyncSession = Depends(get_async_read_session)):
+        return session.info["database"].name
+
+    return app
+
+def test_reads_go_round_robin_over_the_replicas(databases, app):
+    with TestClient(app) as client:
+        assert [client.get("/served-by").json() for _ in range(4)] == ["replica-1", "replica-2"] * 2
+
+def test_writes_pin_the_client_to_the_primary(databases, app):
+    pool, sync = databases
+    writer, other = TestClient(app), TestClient(app)
+    created = writer.post("/api/funds/", json=FUND)
+    assert created.status_code == 200
+    assert "read_primary=1" in created.headers["set-cookie"]
+    fund_id = created.json()["id"]
+
+    # The writer reads its own write from the primary; a client without the
+    # cookie reads a replica that hasn't caught up yet
+    assert writer.get("/served-by").json() == "primary"
+    assert writer.get(f"/api/funds/{fund_id}").status_code == 200
+    assert other.get(f"/api/funds/{fund_id}").status_code == 404
+    sync()
+    assert other.get(f"/api/funds/{fund_id}").status_code == 200
+    assert other.get("/served-by").json().startswith("replica")
+    # Failed writes don't pin
+    assert "set-cookie" not in other.post("/api/funds/", json={"name": "Incomplete"}).headers
+
+def test_unavailable_and_lagging_replicas_are_skipped(databases, app, tmp_path):
+    pool, _ = databases
+    client = TestClient(app)
+    broken = Database("replica-2", f"sqlite:///{tmp_path}/missing/replica.db")
+    pool.replicas[1] = broken
+    pool.check()
+    assert broken.error is not None and not broken.healthy
+    assert {client.get("/served-by").json() for _ in range(4)} == {"replica-1"}
+
+    # Too far behind (REPLICA_MAX_LAG_SECONDS): skipped too, so reads fall back to the primary
+    pool.replicas[0].lag = 10 ** 6
+    assert {client.get("/served-by").json() for _ in range(4)} == {"primary"}
+
+    # Recovered replicas are used again after the next check
+    pool.replicas[0].lag = 0
+    pool.replicas[1] = Database("replica-2", pool.replicas[0].engine.url.render_as_string())
+    pool.check()
+    assert {client.get("/served-by").json() for _ in range(4)} == {"replica-1", "replica-2"}
+    broken.engine.dispose()
@@ -0,0 +1,96 @@
+from datetime import date, timedelta
+import pytest
+from app import crud
+from app.logic.metrics import calculate_fund_metrics
+from app.logic.simulation import load_simulation_inputs, run_simulation
+from app.models import Fund, PortfolioCompany
+
+# Every company exits at exactly its current mark
+CERTAIN_EXIT = {
+    "multiple_median": 1.0, "multiple_sigma": 0.0, "loss_probability": 0.0,
+    "exit_years_min": 1.0, "exit_years_max": 3.0,
+}
+
+# Carry only on profit beyond an 8% preferred return, without a catch-up
+PREFERRED_RETURN_TIERS = [{"type": "roc"}, {"type": "preferred_return", "rate": 0.08}, {"type": "carry"}]
+
+def _fund(session, carry_pct, tiers=None):
+    fund = Fund(
+        name="Simulated", fund_start_date=date(2016, 1, 1), total_commitment=5e7, management_fee_pct=0.02, carry_pct=carry_pct,
+        extra_metadata={"waterfall": {"tiers": tiers}} if tiers else {},
+    )
+    session.add(fund)
+    session.commit()
+    companies = []
+    for i, (post_money, ownership) in enumerate([(4e7, 0.15), (1.2e8, 0.05), (2.5e7, 0.2)]):
+        company = PortfolioCompany(fund_id=fund.id, name=f"Co {i}", latest_post_money=post_money, ownership_pct=ownership, status="active")
+        session.add(company)
+        companies.append(company)
+    session.commit()
+    day = date(2016, 2, 1)
+    for i, company in enumerate(companies):
+        crud.create_transaction(session, {
+            "fund_id": fund.id, "company_id": company.id, "transaction_date": day + timedelta(days=90 * i),
+            "amount": 3_000_000.0 + i * 1234.56, "tx_type": "capital_call",
+        })
+    crud.create_transaction(session, {
+        "fund_id": fund.id, "transaction_date": date(2017, 6, 1), "amount": 1e5, "tx_type": "management_fee",
+    })
+    for i, amount in enumerate([4_500_000.0, 3_200_000.55, 2_100_000.0]):
+        crud.create_transaction(session, {
+            "fund_id": fund.id, "company_id": companies[i].id, "transaction_date": date(2018, 1, 1) + timedelta(days=200 * i),
+            "amount": amount, "tx_type": "distribution",
+        })
+    return fund
+
+def test_certain_exits_reproduce_the_deterministic_tvpi(session):
+    # No carry: LP TVPI after every company exits at its mark is the fund's TVPI
+    fund = _fund(session, carry_pct=0.0)
+    metrics = calculate_fund_metrics(session, fund.id)
+    result = run_simulation(load_simulation_inputs(session, fund.id), paths=50, default=CERTAIN_EXIT, seed=1)
+
+    assert result["net_tvpi"]["p50"] == pytest.approx(metrics["tvpi"], abs=5e-4)
+    assert result["net_tvpi"]["p5"] == result["net_tvpi"]["p95"]
+    assert result["gp_carry"]["p50"] == metrics["total_gp_carry"] == 0
+
+def test_certain_exits_carry_matches_the_waterfall(session):
+    # With carry: the exits continue the stored waterfall, so over the fund's
+    # life GP carry is 20% of everything distributed beyond the capital called
+    fund = _fund(session, carry_pct=0.2)
+    metrics = calculate_fund_metrics(session, fund.id)
+    inputs = load_simulation_inputs(session, fund.id)
+    result = run_simulation(inputs, paths=50, default=CERTAIN_EXIT, seed=1)
+
+    future_carry = 0.2 * metrics["fund_unrealized_value"]
+    expected_carry = 0.2 * (metrics["total_distributions"] + metrics["fund_unrealized_value"] - metrics["total_contributed"])
+    assert result["gp_carry"]["p50"] == pytest.approx(expected_carry, abs=0.05)
+    assert result["gp_carry"]["p50"] == pytest.approx(metrics["total_gp_carry"] + future_carry, abs=0.05)
+    expected_tvpi = (
+        metrics["lp_net_moic"] * metrics["total_contributed"] - future_carry
+    ) / metrics["total_contributed"]
+    assert result["net_tvpi"]["p50"] == pytest.approx(expected_tvpi, abs=5e-4)
+    assert inputs["total_contributed"] == metrics["total_contributed"]
+
+def test_exits_go_through_the_funds_preferred_return(session):
+    # Every company exits at its mark on one day; the simulated carry is what
+    # the stored waterfall shows once those exits are posted as distributions
+    fund = _fund(session, carry_pct=0.2, tiers=PREFERRED_RETURN_TIERS)
+    as_of = date(2024, 1, 1)
+    inputs = load_simulation_inputs(session, fund.id)
+    exit_on = dict(CERTAIN_EXIT, exit_years_min=2.0, exit_years_max=2.0)
+    result = run_simulation(inputs, paths=20, default=exit_on, seed=1, as_of=as_of)
+    assert result["gp_carry"]["p5"] == result["gp_carry"]["p95"]
+
+    for company in inputs["companies"]:
+        crud.create_transaction(session, {
+            "fund_id": fund.id, "company_id": company["id"], "transaction_date": as_of + timedelta(days=730),
+            "amount": round(company["value"], 2), "tx_type": "distribution",
+        })
+    metrics = calculate_fund_metrics(session, fund.id)
+    assert result["gp_carry"]["p50"] == pytest.approx(metrics["total_gp_carry"], abs=0.05)
+    lp_total = metrics["lp_net_moic"] * metrics["total_contributed"] - metrics["fund_unrealized_value"]
+    assert result["net_tvpi"]["p50"] == pytest.approx(lp_total / metrics["total_contributed"], abs=2e-4)
+
+    # The hurdle holds carry below 20% of the profit
+    profit = metrics["total_distributions"] - metrics["total_contributed"]
+    assert metrics["total_gp_carry"] < 0.2 * profit - 1e5